@@ -1,6 +1,7 @@
 """
 Note: Import this file to needed directory.
 """
+import numpy
 
 class ElementsError(Exception):
     pass
@@ -14,6 +15,23 @@ def check_point(tuple_point):
         error_message = "point invalid format"
         raise ElementsError(error_message)
 
+# Function taken from https://en.wikipedia.org/wiki/Even%E2%80%93odd_rule.
+def _even_odd(x, y, poly):
+    """Return True if (x, y) is inside poly according to the even-odd rule.
+
+    Shared by polygon.inside_polygon and inside_polygon, without their checks,
+    so that float coordinates may be used.
+    """
+    j = len(poly) - 1
+    c = False
+    for i in range(len(poly)):
+        if ((poly[i][1] > y) != (poly[j][1] > y)) and \
+                (x < poly[i][0] + (poly[j][0] - poly[i][0]) * (y - poly[i][1]) /
+                                  (poly[j][1] - poly[i][1])):
+            c = not c
+        j = i
+    return c
+
 class polygon:
     def __init__(self, points):
         self.number_of_points = 0
@@ -27,7 +45,6 @@ class polygon:
             error_message = f"Expected 3 or more elements but only recieved {self.number_of_points}"
             raise ElementsError(error_message)
 
-    # Function taken from https://en.wikipedia.org/wiki/Even%E2%80%93odd_rule.
     def inside_polygon(self, point):
         """Determine if the point is in the path.
 
@@ -38,23 +55,8 @@ class polygon:
           True if the point is in the path.
         """
         check_point(point) # Check the point's format
+        return _even_odd(point[0], point[1], self.points)
 
-        x = point[0]
-        y = point[1]
-        poly = self.points
-        num = len(poly)
-        i = 0
-        j = num - 1
-        c = False
-        for i in range(num):
-            if ((poly[i][1] > y) != (poly[j][1] > y)) and \
-                    (x < poly[i][0] + (poly[j][0] - poly[i][0]) * (y - poly[i][1]) /
-                                      (poly[j][1] - poly[i][1])):
-                c = not c
-            j = i
-        return c
-
-# Function taken from https://en.wikipedia.org/wiki/Even%E2%80%93odd_rule.
 # Use this if you don't want to create a polygon object.
 def inside_polygon(point, poly) -> bool:
     """Determine if the point is in the path.
@@ -70,19 +72,500 @@ def inside_polygon(point, poly) -> bool:
         error_message = f"Expected 3 or more elements but only recieved {len(poly)}"
         raise ElementsError(error_message)
     check_point(point) # Check the point's format
+    return _even_odd(point[0], point[1], poly)
 
-    x = point[0]
-    y = point[1]
-    num = len(poly)
-    i = 0
-    j = num - 1
-    c = False
-    for i in range(num):
-        if ((poly[i][1] > y) != (poly[j][1] > y)) and \
-                (x < poly[i][0] + (poly[j][0] - poly[i][0]) * (y - poly[i][1]) /
-                                  (poly[j][1] - poly[i][1])):
-            c = not c
-        j = i
-    return c
 
 
+def _orientation(p, q, r):
+    """Return the sign of the cross product (q - p) x (r - p)."""
+    value = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    return int(value > 0) - int(value < 0)
+
+def _on_segment(p, q, r):
+    """Return True if r lies within the bounding box of segment pq."""
+    return min(p[0], q[0]) <= r[0] <= max(p[0], q[0]) and min(p[1], q[1]) <= r[1] <= max(p[1], q[1])
+
+def segments_intersect(p1, p2, q1, q2) -> bool:
+    """Determine if the segments p1-p2 and q1-q2 intersect or touch.
+
+    Args:
+      p1, p2, q1, q2 -- tuples of: (x-cordinate, y-cordinate)
+
+    Returns:
+      True if the segments have at least one point in common.
+    """
+    o1 = _orientation(p1, p2, q1)
+    o2 = _orientation(p1, p2, q2)
+    o3 = _orientation(q1, q2, p1)
+    o4 = _orientation(q1, q2, p2)
+    if o1 != o2 and o3 != o4:
+        return True
+    return (o1 == 0 and _on_segment(p1, p2, q1)) or (o2 == 0 and _on_segment(p1, p2, q2)) or \
+        (o3 == 0 and _on_segment(q1, q2, p1)) or (o4 == 0 and _on_segment(q1, q2, p2))
+
+def polygons_intersect(poly1, poly2) -> bool:
+    """Determine if two simple polygons overlap or touch.
+
+    Unlike inside_polygon, float coordinates are allowed.
+
+    Args:
+      poly1 -- a list of tuples [(x, y), (x, y), ...]
+      poly2 -- a list of tuples [(x, y), (x, y), ...]
+
+    Returns:
+      True if the polygons have at least one point in common.
+    """
+    for poly in (poly1, poly2):
+        if len(poly) < 3:
+            error_message = f"Expected 3 or more elements but only recieved {len(poly)}"
+            raise ElementsError(error_message)
+
+    # Quick reject using the bounding boxes.
+    if max(p[0] for p in poly1) < min(p[0] for p in poly2) or max(p[0] for p in poly2) < min(p[0] for p in poly1) or \
+            max(p[1] for p in poly1) < min(p[1] for p in poly2) or max(p[1] for p in poly2) < min(p[1] for p in poly1):
+        return False
+
+    # Crossing edges.
+    for i in range(len(poly1)):
+        a1, a2 = poly1[i - 1], poly1[i]
+        for j in range(len(poly2)):
+            if segments_intersect(a1, a2, poly2[j - 1], poly2[j]):
+                return True
+
+    # No crossing edges, so either one polygon contains the other or they are disjoint.
+    return _even_odd(poly1[0][0], poly1[0][1], poly2) or _even_odd(poly2[0][0], poly2[0][1], poly1)
+
+def _as_points(points):
+    """Return points as an (N, 2) float array."""
+    points = numpy.asarray(points, dtype=numpy.float64)
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ElementsError("points invalid format, expected an (N, 2) array")
+    return points
+
+def _as_polygons(polys):
+    """Return polys as an (M, K, 2) float array of M polygons with K vertices each."""
+    polys = numpy.asarray(polys, dtype=numpy.float64)
+    if polys.ndim != 3 or polys.shape[2] != 2:
+        raise ElementsError("polygons invalid format, expected an (M, K, 2) array")
+    if polys.shape[1] < 3:
+        error_message = f"Expected 3 or more elements but only recieved {polys.shape[1]}"
+        raise ElementsError(error_message)
+    return polys
+
+def _crossings(x, y, xi, yi, xj, yj):
+    """Return a mask of the edges (xi, yi)-(xj, yj) crossed by a ray from (x, y) towards +x.
+
+    All arguments must be broadcastable against each other.
+    """
+    straddles = (yi > y) != (yj > y)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        x_cross = xi + (xj - xi) * (y - yi) / (yj - yi)
+    return straddles & (x < x_cross)
+
+def points_inside_polygon(points, poly):
+    """Determine which points are inside a polygon, using the even-odd rule.
+
+    Vectorized version of inside_polygon. Float coordinates are allowed.
+
+    Args:
+      points -- (N, 2) array-like of (x, y) points
+      poly -- (K, 2) array-like or list of tuples [(x, y), (x, y), ...]
+
+    Returns:
+      (N,) boolean array, True for the points inside the polygon.
+    """
+    return points_inside_polygons(points, [poly])[0]
+
+def points_inside_polygons(points, polys):
+    """Determine which points are inside which polygons, using the even-odd rule.
+
+    Args:
+      points -- (N, 2) array-like of (x, y) points
+      polys -- (M, K, 2) array-like of M polygons with K vertices each
+
+    Returns:
+      (M, N) boolean array, element [m, n] is True if point n is inside polygon m.
+    """
+    points = _as_points(points)
+    polys = _as_polygons(polys)
+
+    # Shapes: points (1, N, 1), edges (M, 1, K)
+    x = points[numpy.newaxis, :, 0, numpy.newaxis]
+    y = points[numpy.newaxis, :, 1, numpy.newaxis]
+    xi = polys[:, numpy.newaxis, :, 0]
+    yi = polys[:, numpy.newaxis, :, 1]
+    xj = numpy.roll(polys, 1, axis=1)[:, numpy.newaxis, :, 0]
+    yj = numpy.roll(polys, 1, axis=1)[:, numpy.newaxis, :, 1]
+
+    crossings = _crossings(x, y, xi, yi, xj, yj)
+    return numpy.count_nonzero(crossings, axis=2) % 2 == 1
+
+def _batch_orientation(p, q, r):
+    """Return the signs of the cross products (q - p) x (r - p) of broadcastable (..., 2) arrays."""
+    return numpy.sign((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1]) -
+                      (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+
+def _batch_on_segment(p, q, r):
+    """Return a mask of the points r within the bounding boxes of the segments pq."""
+    return ((numpy.minimum(p, q) <= r) & (r <= numpy.maximum(p, q))).all(axis=-1)
+
+def _edges_touch(a1, a2, b1, b2):
+    """Return a mask of the segment pairs a1-a2 and b1-b2 that intersect or touch.
+
+    All arguments are broadcastable (..., 2) arrays of segment end points.
+    """
+    o1 = _batch_orientation(a1, a2, b1)
+    o2 = _batch_orientation(a1, a2, b2)
+    o3 = _batch_orientation(b1, b2, a1)
+    o4 = _batch_orientation(b1, b2, a2)
+    return ((o1 != o2) & (o3 != o4)) | \
+        ((o1 == 0) & _batch_on_segment(a1, a2, b1)) | ((o2 == 0) & _batch_on_segment(a1, a2, b2)) | \
+        ((o3 == 0) & _batch_on_segment(b1, b2, a1)) | ((o4 == 0) & _batch_on_segment(b1, b2, a2))
+
+def batch_polygons_intersect(polys, poly):
+    """Determine which of many simple polygons overlap or touch a polygon.
+
+    Vectorized version of polygons_intersect. Float coordinates are allowed.
+
+    Args:
+      polys -- (M, K, 2) array-like of M polygons with K vertices each
+      poly -- (L, 2) array-like or list of tuples [(x, y), (x, y), ...]
+
+    Returns:
+      (M,) boolean array, True for the polygons with at least one point in
+      common with poly.
+    """
+    polys = _as_polygons(polys)
+    poly = _as_polygons([poly])[0]
+    result = numpy.zeros(len(polys), dtype=bool)
+
+    # Quick reject using the bounding boxes.
+    candidates = (polys.min(axis=1) <= poly.max(axis=0)).all(axis=1) & \
+        (polys.max(axis=1) >= poly.min(axis=0)).all(axis=1)
+    subjects = polys[candidates]
+    if len(subjects) == 0:
+        return result
+
+    # Shapes: subject edges (M, K, 1, 2), poly edges (1, 1, L, 2)
+    a1 = numpy.roll(subjects, 1, axis=1)[:, :, numpy.newaxis, :]
+    a2 = subjects[:, :, numpy.newaxis, :]
+    b1 = numpy.roll(poly, 1, axis=0)[numpy.newaxis, numpy.newaxis, :, :]
+    b2 = poly[numpy.newaxis, numpy.newaxis, :, :]
+    touching = _edges_touch(a1, a2, b1, b2)
+
+    # Without touching edges, either one polygon contains the other or they are disjoint.
+    result[candidates] = touching.any(axis=(1, 2)) | points_inside_polygon(subjects[:, 0], poly) | \
+        points_inside_polygons(poly[:1], subjects)[:, 0]
+    return result
+
+def _segments_cross(a1, a2, b1, b2):
+    """Return an (Ka, Kb) mask of the segment pairs that properly cross each other.
+
+    a1, a2 -- (Ka, 2) arrays with the end points of the first segments
+    b1, b2 -- (Kb, 2) arrays with the end points of the second segments
+
+    Segments that only touch or are collinear are not considered crossing.
+    """
+    def cross(o, p, q):
+        return (p[..., 0] - o[..., 0]) * (q[..., 1] - o[..., 1]) - (p[..., 1] - o[..., 1]) * (q[..., 0] - o[..., 0])
+
+    a1, a2 = a1[:, numpy.newaxis], a2[:, numpy.newaxis]
+    b1, b2 = b1[numpy.newaxis], b2[numpy.newaxis]
+    d1 = cross(a1, a2, b1)
+    d2 = cross(a1, a2, b2)
+    d3 = cross(b1, b2, a1)
+    d4 = cross(b1, b2, a2)
+    return (d1 * d2 < 0) & (d3 * d4 < 0)
+
+class PreparedPolygon:
+    """A polygon prepared for repeated point and polygon tests.
+
+    The bounding box and the edges are computed once when the object is
+    created. Each edge is stored as the y-range it spans together with the
+    slope and intercept of x as a function of y, so testing a point needs
+    no divisions. Points outside the bounding box are rejected without
+    looking at the edges.
+
+    Vertices are given as (x, y) tuples. When built from Coordinates, x is
+    the latitude and y the longitude.
+    """
+
+    def __init__(self, points):
+        """PreparedPolygon constructor.
+
+        points -- (K, 2) array-like or list of tuples [(x, y), (x, y), ...]
+        """
+        vertices = _as_polygons([points])[0]
+        self.vertices = vertices
+        self.number_of_points = len(vertices)
+        self.min_x, self.min_y = vertices.min(axis=0)
+        self.max_x, self.max_y = vertices.max(axis=0)
+
+        start = vertices
+        end = numpy.roll(vertices, 1, axis=0)
+        self.edge_start = start
+        self.edge_end = end
+        self.edge_y0 = start[:, 1].copy()
+        self.edge_y1 = end[:, 1].copy()
+        dy = end[:, 1] - start[:, 1]
+        horizontal = dy == 0
+        # Horizontal edges never straddle a ray, their slope is never used.
+        self.edge_slope = numpy.where(horizontal, 0.0, (end[:, 0] - start[:, 0]) / numpy.where(horizontal, 1.0, dy))
+        self.edge_intercept = start[:, 0] - self.edge_slope * start[:, 1]
+
+    @classmethod
+    def from_coordinates(cls, coordinates):
+        """Create a PreparedPolygon from objects with lat and long attributes, e.g. Coordinates."""
+        return cls([(coordinate.lat, coordinate.long) for coordinate in coordinates])
+
+    @classmethod
+    def from_area_vertices(cls, area_vertices):
+        """Create a PreparedPolygon from the AreaVertex objects of a UserSession."""
+        ordered = sorted(area_vertices, key=lambda vertex: vertex.vertex_no)
+        return cls.from_coordinates(vertex.coordinate for vertex in ordered)
+
+    def bbox_contains(self, x, y):
+        """Return True if (x, y) is inside the bounding box."""
+        return self.min_x <= x <= self.max_x and self.min_y <= y <= self.max_y
+
+    def bbox_intersects(self, other):
+        """Return True if the bounding boxes of self and other PreparedPolygon overlap."""
+        return self.min_x <= other.max_x and other.min_x <= self.max_x and \
+            self.min_y <= other.max_y and other.min_y <= self.max_y
+
+    def contains(self, point):
+        """Determine if a point is inside the polygon, using the even-odd rule.
+
+        Args:
+          point -- tuple of: (x-cordinate, y-cordinate), floats allowed
+
+        Returns:
+          True if the point is inside the polygon.
+        """
+        x, y = point
+        if not self.bbox_contains(x, y):
+            return False
+        straddles = (self.edge_y0 > y) != (self.edge_y1 > y)
+        crossings = straddles & (x < self.edge_slope * y + self.edge_intercept)
+        return bool(numpy.count_nonzero(crossings) % 2)
+
+    def contains_points(self, points):
+        """Determine which points are inside the polygon.
+
+        Args:
+          points -- (N, 2) array-like of (x, y) points
+
+        Returns:
+          (N,) boolean array, True for the points inside the polygon.
+        """
+        points = _as_points(points)
+        result = numpy.zeros(len(points), dtype=bool)
+        x, y = points[:, 0], points[:, 1]
+        candidates = numpy.flatnonzero((x >= self.min_x) & (x <= self.max_x) & (y >= self.min_y) & (y <= self.max_y))
+        if len(candidates) == 0:
+            return result
+        x = x[candidates, numpy.newaxis]
+        y = y[candidates, numpy.newaxis]
+        straddles = (self.edge_y0 > y) != (self.edge_y1 > y)
+        crossings = straddles & (x < self.edge_slope * y + self.edge_intercept)
+        result[candidates] = numpy.count_nonzero(crossings, axis=1) % 2 == 1
+        return result
+
+    def intersects(self, other):
+        """Determine if the polygon and other overlap or touch.
+
+        Args:
+          other -- a PreparedPolygon or a list of tuples [(x, y), (x, y), ...]
+
+        Returns:
+          True if the polygons have at least one point in common.
+        """
+        if not isinstance(other, PreparedPolygon):
+            other = PreparedPolygon(other)
+        if not self.bbox_intersects(other):
+            return False
+        if _edges_touch(self.edge_start[:, numpy.newaxis], self.edge_end[:, numpy.newaxis],
+                        other.edge_start[numpy.newaxis], other.edge_end[numpy.newaxis]).any():
+            return True
+        # No touching edges, so either one polygon contains the other or they are disjoint.
+        return bool(self.contains_points(other.vertices[:1])[0] or other.contains_points(self.vertices[:1])[0])
+
+    def contains_polygon(self, other):
+        """Determine if other lies completely inside the polygon.
+
+        Args:
+          other -- a PreparedPolygon or a list of tuples [(x, y), (x, y), ...]
+
+        Returns:
+          True if all vertices of other are inside the polygon and no edges
+          of the polygons cross.
+        """
+        if not isinstance(other, PreparedPolygon):
+            other = PreparedPolygon(other)
+        if not (self.min_x <= other.min_x and other.max_x <= self.max_x and
+                self.min_y <= other.min_y and other.max_y <= self.max_y):
+            return False
+        if not self.contains_points(other.vertices).all():
+            return False
+        return not _segments_cross(self.edge_start, self.edge_end, other.edge_start, other.edge_end).any()
+
+def _signed_area(poly):
+    """Return the signed area of a polygon, positive if its vertices are counterclockwise."""
+    poly = numpy.asarray(poly, dtype=numpy.float64)
+    x, y = poly[:, 0], poly[:, 1]
+    return 0.5 * float(numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(y, numpy.roll(x, -1)))
+
+def polygon_area(poly) -> float:
+    """Return the area of a simple polygon, using the shoelace formula.
+
+    Args:
+      poly -- (K, 2) array-like or list of tuples [(x, y), (x, y), ...]
+    """
+    if len(poly) < 3:
+        return 0.0
+    return abs(_signed_area(poly))
+
+def _clip_edges(clip):
+    """Return the edges of a convex clip polygon as (start, end) pairs in counterclockwise order."""
+    clip = _as_polygons([clip])[0]
+    if _signed_area(clip) < 0:
+        clip = clip[::-1]
+    return list(zip(clip, numpy.roll(clip, -1, axis=0)))
+
+def clip_polygon(subject, clip):
+    """Clip a polygon against a convex polygon, using the Sutherland-Hodgman algorithm.
+
+    Args:
+      subject -- a list of tuples [(x, y), (x, y), ...], the polygon to clip
+      clip -- a list of tuples [(x, y), (x, y), ...], a convex polygon
+
+    Returns:
+      The part of subject inside clip as a list of (x, y) tuples. The list is
+      empty if the polygons do not overlap.
+    """
+    output = [tuple(map(float, point)) for point in subject]
+    for a, b in _clip_edges(clip):
+        if not output:
+            break
+        polygon = output
+        output = []
+        prev = polygon[-1]
+        d_prev = (b[0] - a[0]) * (prev[1] - a[1]) - (b[1] - a[1]) * (prev[0] - a[0])
+        for cur in polygon:
+            d_cur = (b[0] - a[0]) * (cur[1] - a[1]) - (b[1] - a[1]) * (cur[0] - a[0])
+            if (d_cur >= 0) != (d_prev >= 0):
+                t = d_prev / (d_prev - d_cur)
+                output.append((prev[0] + (cur[0] - prev[0]) * t, prev[1] + (cur[1] - prev[1]) * t))
+            if d_cur >= 0:
+                output.append(cur)
+            prev, d_prev = cur, d_cur
+    return output
+
+def intersection_area(subject, clip) -> float:
+    """Return the area of the overlap between a polygon and a convex polygon."""
+    return polygon_area(clip_polygon(subject, clip))
+
+def intersection_over_union(poly1, poly2) -> float:
+    """Return the area of the overlap divided by the area of the union of two polygons.
+
+    poly2 must be convex. Returns 0 if both polygons are degenerate.
+    """
+    overlap = intersection_area(poly1, poly2)
+    union = polygon_area(poly1) + polygon_area(poly2) - overlap
+    return overlap / union if union > 0 else 0.0
+
+def view_coverage(footprint, view) -> float:
+    """Return the fraction of a convex view covered by footprint, between 0 and 1."""
+    view_area = polygon_area(view)
+    return intersection_area(footprint, view) / view_area if view_area > 0 else 0.0
+
+def batch_clip_polygons(subjects, clip):
+    """Clip many polygons against one convex polygon at once.
+
+    Vectorized version of clip_polygon. The clipped polygons have varying
+    numbers of vertices, so they are returned padded to a common length.
+
+    Args:
+      subjects -- (N, K, 2) array-like of N polygons with K vertices each
+      clip -- a list of tuples [(x, y), (x, y), ...], a convex polygon
+
+    Returns:
+      A tuple (vertices, counts) where vertices is an (N, L, 2) array and
+      counts an (N,) array with the number of valid vertices of each clipped
+      polygon. Vertices beyond the count of a polygon are undefined.
+    """
+    vertices = _as_polygons(subjects).copy()
+    counts = numpy.full(len(vertices), vertices.shape[1])
+    for a, b in _clip_edges(clip):
+        n, k = vertices.shape[0], vertices.shape[1]
+        if k == 0:
+            break
+        index = numpy.arange(k)[numpy.newaxis, :]
+        valid = index < counts[:, numpy.newaxis]
+        prev_index = numpy.where(index == 0, numpy.maximum(counts[:, numpy.newaxis] - 1, 0), index - 1)
+        prev = numpy.take_along_axis(vertices, prev_index[:, :, numpy.newaxis], axis=1)
+
+        d_cur = (b[0] - a[0]) * (vertices[..., 1] - a[1]) - (b[1] - a[1]) * (vertices[..., 0] - a[0])
+        d_prev = (b[0] - a[0]) * (prev[..., 1] - a[1]) - (b[1] - a[1]) * (prev[..., 0] - a[0])
+        cur_in = d_cur >= 0
+        crossing = valid & (cur_in != (d_prev >= 0))
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            t = numpy.where(crossing, d_prev / (d_prev - d_cur), 0.0)
+        cut = prev + (vertices - prev) * t[..., numpy.newaxis]
+
+        # Every input vertex yields up to two output vertices: the cut point and itself.
+        candidates = numpy.stack([cut, vertices], axis=2).reshape(n, 2 * k, 2)
+        keep = numpy.stack([crossing, valid & cur_in], axis=2).reshape(n, 2 * k)
+        order = numpy.argsort(~keep, axis=1, kind="stable")
+        counts = numpy.count_nonzero(keep, axis=1)
+        width = int(counts.max()) if n else 0
+        vertices = numpy.take_along_axis(candidates, order[:, :width, numpy.newaxis], axis=1)
+    return vertices, counts
+
+def batch_polygon_areas(vertices, counts):
+    """Return the areas of padded polygons, as returned by batch_clip_polygons.
+
+    Args:
+      vertices -- (N, L, 2) array of polygon vertices
+      counts -- (N,) array with the number of valid vertices of each polygon
+
+    Returns:
+      (N,) array of areas. Polygons with fewer than 3 vertices have area 0.
+    """
+    n, k = vertices.shape[0], vertices.shape[1]
+    if k == 0:
+        return numpy.zeros(n)
+    index = numpy.arange(k)[numpy.newaxis, :]
+    valid = index < counts[:, numpy.newaxis]
+    next_index = numpy.where(index + 1 < counts[:, numpy.newaxis], index + 1, 0)
+    following = numpy.take_along_axis(vertices, next_index[:, :, numpy.newaxis], axis=1)
+    terms = vertices[..., 0] * following[..., 1] - following[..., 0] * vertices[..., 1]
+    areas = 0.5 * numpy.abs(numpy.where(valid, terms, 0.0).sum(axis=1))
+    return numpy.where(counts >= 3, areas, 0.0)
+
+def batch_intersection_areas(subjects, clip):
+    """Return the overlap areas of many polygons with one convex polygon.
+
+    Args:
+      subjects -- (N, K, 2) array-like of N polygons with K vertices each
+      clip -- a list of tuples [(x, y), (x, y), ...], a convex polygon
+
+    Returns:
+      (N,) array of overlap areas.
+    """
+    return batch_polygon_areas(*batch_clip_polygons(subjects, clip))
+
+def batch_view_coverage(footprints, view):
+    """Return the fraction of a convex view covered by each footprint.
+
+    Args:
+      footprints -- (N, K, 2) array-like of N footprints with K vertices each
+      view -- a list of tuples [(x, y), (x, y), ...], a convex polygon
+
+    Returns:
+      (N,) array of fractions between 0 and 1.
+    """
+    view_area = polygon_area(view)
+    if view_area == 0:
+        return numpy.zeros(len(footprints))
+    return batch_intersection_areas(footprints, view) / view_area
@@ -3,17 +3,34 @@ from IMM.thread_handler import ThreadHandler
 from flask import Flask, jsonify, request
 import json
 from flask_socketio import SocketIO, join_room, emit
+from IMM_database.database import session_scope, read_scope, UserSession, Drone, Coordinate, get_active_session_id
+from IMM.view_query import CORNERS, coordinates_from_json, images_in_view, record_client_view
+from IMM.image_payloads import image_message
+from IMM.renditions import RENDITIONS
+from IMM.session_area import get_session_area
+from IMM.threads.thread_gui_pub import session_room
 
 app = Flask(__name__)
 thread_handler = ThreadHandler()
 thread_handler.start_threads()
 socketio = SocketIO(app)
+thread_handler.get_gui_pub_thread().set_socketio(socketio)
 
+# The drone modes accepted by set_mode, see UserSession.drone_mode.
+DRONE_MODES = ("AUTO", "MAN")
+
+
+
+def join_session_room(session_id):
+    """Add the requesting client to the room notified about the new images of a UserSession."""
+    if session_id is not None:
+        join_room(session_room(session_id))
 
 
 @socketio.on("connect")
 def on_connect():
     # Unclear what this should do? Issue: #43
+    join_session_room(get_active_session_id())
     socketio.emit("response", "CONNECTED TO BACKEND")
     return {"fcn":"unit_test_ack", "name":"connect"}
 
@@ -42,50 +59,109 @@ def on_set_area():
 
 @socketio.on("request_view")
 def on_request_view(data):
-    # TODO: Implement this
-    print("recieved request for a POI")
-    print(data)
-    emit("response", data)
-    # Sends request to rds pub thread
-    # poi = json.loads(request.data)
-    # Psudocode
-    # if poi in IMM_database:
-    # return db.image.metadata
-    # else
-    thread_handler.get_rds_pub_thread().add_request(data)
-    pass
+    """Respond with the ids of the images covering the requested view, newest first."""
+    arg = data["arg"]
+    view = coordinates_from_json(arg["coordinates"])
+    session_id = get_active_session_id()
+    join_session_room(session_id)
+    with read_scope() as session:
+        image_ids = images_in_view(session, view, session_id, arg.get("limit"), arg.get("min_coverage"))
+    if arg.get("client_id") is not None:
+        with session_scope() as session:
+            record_client_view(session, arg["client_id"], view)
+    emit("response", {"fcn": "ack", "fcn_name": "request_view", "arg": {"image_ids": image_ids}})
 
 
 @socketio.on("request_priority_view")
-def on_request_priority_view():
-    # TODO: Implement this
-    # Sends request to rds pub thread
-    pass
+def on_request_priority_view(data):
+    """Schedule a prioritized image of the center of the requested view and respond with its force_que_id."""
+    arg = data["arg"]
+    view = coordinates_from_json(arg["coordinates"])
+    center = view.get("center") or Coordinate(
+        lat=sum(view[corner].lat for corner in CORNERS) / len(CORNERS),
+        long=sum(view[corner].long for corner in CORNERS) / len(CORNERS))
+    session_id = get_active_session_id()
+    if session_id is None:
+        emit("response", {"fcn": "error", "fcn_name": "request_priority_view",
+                          "arg": {"msg": "No active session."}})
+        return
+    area = get_session_area(session_id)
+    if area is not None and not area.contains((center.lat, center.long)):
+        emit("response", {"fcn": "error", "fcn_name": "request_priority_view",
+                          "arg": {"msg": "The requested view is outside the session area."}})
+        return
+    force_que_id = thread_handler.get_rds_pub_thread().request_priority_poi(session_id, center, arg.get("client_id"))
+    emit("response", {"fcn": "ack", "fcn_name": "request_priority_view", "arg": {"force_que_id": force_que_id}})
 
 
 @socketio.on("clear_queue")
 def on_clear_queue():
-    # TODO: Implement this
-    # Sends request to rds pub thread
-    pass
+    """Cancel the pending prioritized images of the active session."""
+    session_id = get_active_session_id()
+    if session_id is None:
+        emit("response", {"fcn": "error", "fcn_name": "clear_queue", "arg": {"msg": "No active session."}})
+        return
+    thread_handler.get_rds_pub_thread().clear_prio_queue(session_id)
+    emit("response", {"fcn": "ack", "fcn_name": "clear_queue"})
 
 
 @socketio.on("set_mode")
 def on_set_mode(data):
-    # TODO: Implement this
-    # Sends request to rds pub thread
+    """Send the new drone mode to the RDS and store it in the active session."""
+    arg = data.get("arg") if isinstance(data, dict) else None
+    mode = arg.get("mode") if isinstance(arg, dict) else None
+    if mode not in DRONE_MODES:
+        emit("response", {"fcn": "error", "fcn_name": "set_mode",
+                          "arg": {"msg": "Unknown mode: " + str(mode)}})
+        return
     thread_handler.get_rds_pub_thread().add_request(data)
+    session_id = get_active_session_id()
+    if session_id is not None:
+        with session_scope() as session:
+            # Committing the new mode invalidates the cached active session.
+            session.query(UserSession).get(session_id).drone_mode = mode
     socketio.emit("set_mode", data)
 
 @socketio.on("get_image_by_id")
-def on_get_image_by_id(self):
-    # TODO: Implement this
-    pass
+def on_get_image_by_id(data):
+    """Send the requested images one message at a time, then acknowledge the request.
+
+    Each image is emitted as soon as it is loaded, with the encoded image as
+    a binary attachment. Unknown ids are listed as missing in the ack.
+    """
+    arg = data["arg"]
+    rendition = arg.get("rendition", "full")
+    if rendition not in RENDITIONS:
+        emit("response", {"fcn": "error", "fcn_name": "get_image_by_id",
+                          "arg": {"msg": "Unknown rendition: " + str(rendition)}})
+        return
+
+    sent = []
+    missing = []
+    for image_id in arg["ids"]:
+        with read_scope() as session:
+            message = image_message(session, image_id, rendition)
+        if message is None:
+            missing.append(image_id)
+            continue
+        emit("response", message)
+        sent.append(image_id)
+        # Let the server flush the message before the next image is loaded.
+        socketio.sleep(0)
+    emit("response", {"fcn": "ack", "fcn_name": "get_image_by_id", "arg": {"image_ids": sent, "missing": missing}})
+
 
 @socketio.on("get_info")
-def on_get_info(self):
-    # TODO: Implement this
-    pass
+def on_get_info():
+    """Respond with the drones of the active session, as last reported by RDS, and the RDS queue ETA."""
+    session_id = get_active_session_id()
+    with read_scope() as session:
+        drones = session.query(Drone.id, Drone.last_updated, Drone.eta).\
+            filter(Drone.session_id == session_id).order_by(Drone.id).all()
+    emit("response", {"fcn": "ack", "fcn_name": "get_info", "arg": {"drones": [
+        {"drone-id": drone_id, "last_updated": last_updated, "eta": eta}
+        for drone_id, last_updated, eta in drones],
+        "queue_eta": thread_handler.get_rds_pub_thread().queue_eta}})
 
 @socketio.on("/request_image",)
 def request_image():
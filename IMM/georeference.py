@@ -0,0 +1,97 @@
+"""Georeferencing of drone images from their four corner coordinates.
+
+An image arrives with the lat/long of its four corners. The projective
+transform (homography) mapping image pixels to lat/long is determined
+exactly by these four correspondences. Over the small area covered by a
+drone image, lat/long can be treated as a plane.
+
+Pixel coordinates are given as (column, row), with (0, 0) at the upper left
+corner of the upper left pixel, so the center of that pixel is (0.5, 0.5).
+
+The following public classes are provided:
+Homography -- Projective transform between image pixels and lat/long.
+"""
+from collections import OrderedDict
+
+import numpy
+
+# The corners of an image footprint and their pixel positions relative to the image size.
+CORNER_PIXELS = OrderedDict([
+    ("up_left", (0, 0)),
+    ("up_right", (1, 0)),
+    ("down_right", (1, 1)),
+    ("down_left", (0, 1)),
+])
+
+
+def _solve_homography(source, target):
+    """Return the 3x3 matrix H mapping the four source points to the four target points."""
+    rows = []
+    values = []
+    for (x, y), (u, v) in zip(source, target):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+        values.extend([u, v])
+    h = numpy.linalg.solve(numpy.array(rows, dtype=numpy.float64), numpy.array(values, dtype=numpy.float64))
+    return numpy.append(h, 1.0).reshape(3, 3)
+
+
+def _apply(matrix, a, b):
+    """Apply a homography to coordinate arrays a and b, returning two arrays."""
+    a = numpy.asarray(a, dtype=numpy.float64)
+    b = numpy.asarray(b, dtype=numpy.float64)
+    w = matrix[2, 0] * a + matrix[2, 1] * b + matrix[2, 2]
+    return (matrix[0, 0] * a + matrix[0, 1] * b + matrix[0, 2]) / w, \
+           (matrix[1, 0] * a + matrix[1, 1] * b + matrix[1, 2]) / w
+
+
+class Homography:
+    """Projective transform between the pixels of an image and lat/long.
+
+    Both sides are normalized before solving, pixels by the image size and
+    lat/long relative to the footprint's first corner and extent, to keep the
+    linear system well conditioned.
+    """
+
+    def __init__(self, corners, width, height):
+        """Homography constructor.
+
+        corners     A list of the (lat, long) tuples of the up_left, up_right,
+                    down_right and down_left corners, in that order.
+        width       The image width in pixels.
+        height      The image height in pixels.
+        """
+        corners = numpy.asarray(corners, dtype=numpy.float64)
+        self.width = width
+        self.height = height
+        self.origin = corners[0].copy()
+        extent = numpy.ptp(corners, axis=0).max()
+        self.scale = extent if extent > 0 else 1.0
+
+        source = [(cx, cy) for cx, cy in CORNER_PIXELS.values()]
+        target = (corners - self.origin) / self.scale
+        self.matrix = _solve_homography(source, target)
+        self.inverse = numpy.linalg.inv(self.matrix)
+
+    @classmethod
+    def from_footprint(cls, footprint, width, height):
+        """Create a Homography from a dict mapping corner names to (lat, long) tuples."""
+        return cls([footprint[corner] for corner in CORNER_PIXELS], width, height)
+
+    def pixel_to_lat_long(self, column, row):
+        """Return the (lat, long) of pixel coordinates. Works on scalars and arrays."""
+        u, v = _apply(self.matrix, numpy.asarray(column) / self.width, numpy.asarray(row) / self.height)
+        return u * self.scale + self.origin[0], v * self.scale + self.origin[1]
+
+    def lat_long_to_pixel(self, lat, long):
+        """Return the fractional (column, row) of lat/long coordinates. Works on scalars and arrays."""
+        x, y = _apply(self.inverse, (numpy.asarray(lat) - self.origin[0]) / self.scale,
+                      (numpy.asarray(long) - self.origin[1]) / self.scale)
+        return x * self.width, y * self.height
+
+    def bounds(self):
+        """Return the (min_lat, min_long, max_lat, max_long) bounding box of the image."""
+        lat, long = self.pixel_to_lat_long(
+            numpy.array([0, self.width, self.width, 0]), numpy.array([0, 0, self.height, self.height]))
+        return lat.min(), long.min(), lat.max(), long.max()
+
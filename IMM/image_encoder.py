@@ -0,0 +1,159 @@
+"""Pluggable JPEG encoder backends used when saving received images.
+
+The following public classes are provided:
+EncoderSettings -- JPEG quality, optimize and progressive settings.
+InlineEncoder -- Encodes in the calling thread.
+ThreadPoolEncoder -- Encodes in a pool of threads.
+ProcessPoolEncoder -- Encodes in a pool of processes, passing pixels through shared memory.
+
+The following public functions are provided:
+create_encoder -- Create an encoder backend by name.
+"""
+import os
+
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy
+from PIL import Image as PIL_image
+
+
+class EncoderSettings:
+    """Settings passed to PIL when saving a JPEG file."""
+
+    def __init__(self, quality=85, optimize=False, progressive=False):
+        """EncoderSettings constructor.
+
+        quality     JPEG quality between 1 and 95. (default 85)
+        optimize    True if an extra pass should be made to optimize the
+                    Huffman tables, else False. (default False)
+        progressive True if a progressive JPEG should be written, else False.
+                    (default False)
+        """
+        self.quality = quality
+        self.optimize = optimize
+        self.progressive = progressive
+
+    def save_kwargs(self):
+        """Return the keyword arguments for PIL.Image.save."""
+        return {"format": "JPEG", "quality": self.quality, "optimize": self.optimize,
+                "progressive": self.progressive}
+
+
+def _encode(array, path, save_kwargs):
+    """Encode array as a JPEG file at path and return path."""
+    PIL_image.fromarray(array).save(path, **save_kwargs)
+    return path
+
+
+def _encode_shared(shm_name, shape, dtype, path, save_kwargs):
+    """Encode an array stored in a shared memory block and return path. Runs in a worker process."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        array = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        _encode(array, path, save_kwargs)
+        del array
+    finally:
+        shm.close()
+    return path
+
+
+class InlineEncoder:
+    """Encodes images in the thread calling submit()."""
+
+    def __init__(self, settings=None):
+        self.settings = settings or EncoderSettings()
+
+    def submit(self, array, path):
+        """Encode array to path and return a completed Future.
+
+        Every backend returns a Future resolving to path.
+        """
+        future = Future()
+        try:
+            future.set_result(_encode(array, path, self.settings.save_kwargs()))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def encode(self, array, path):
+        """Encode array to path, blocking until the file is written."""
+        return self.submit(array, path).result()
+
+    def shutdown(self):
+        pass
+
+
+class ThreadPoolEncoder(InlineEncoder):
+    """Encodes images in a pool of threads.
+
+    PIL releases the GIL during parts of the encoding, so a thread pool gives
+    some parallelism without copying the pixels.
+    """
+
+    def __init__(self, settings=None, workers=None):
+        super().__init__(settings)
+        self.__executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+
+    def submit(self, array, path):
+        return self.__executor.submit(_encode, array, path, self.settings.save_kwargs())
+
+    def shutdown(self):
+        self.__executor.shutdown()
+
+
+class ProcessPoolEncoder(InlineEncoder):
+    """Encodes images in a pool of processes, using every core of the machine.
+
+    The pixels are copied once into a shared memory block which the worker
+    process maps, so the array is never pickled. The block is released when
+    the encoding is done.
+    """
+
+    def __init__(self, settings=None, workers=None):
+        super().__init__(settings)
+        self.__executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+
+    def submit(self, array, path):
+        array = numpy.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        try:
+            numpy.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            future = self.__executor.submit(_encode_shared, shm.name, array.shape, array.dtype.str,
+                                            path, self.settings.save_kwargs())
+        except:
+            shm.close()
+            shm.unlink()
+            raise
+
+        def release(_future):
+            shm.close()
+            shm.unlink()
+        future.add_done_callback(release)
+        return future
+
+    def shutdown(self):
+        self.__executor.shutdown()
+
+
+_BACKENDS = {
+    "inline": InlineEncoder,
+    "thread": ThreadPoolEncoder,
+    "process": ProcessPoolEncoder,
+}
+
+
+def create_encoder(backend="thread", workers=None, quality=85, optimize=False, progressive=False):
+    """Create an encoder backend.
+
+    backend     "inline", "thread" or "process". (default "thread")
+    workers     Number of pool workers, defaults to the number of cores. Ignored
+                by the inline backend.
+    quality, optimize, progressive -- See EncoderSettings.
+    """
+    if backend not in _BACKENDS:
+        raise ValueError("Unknown encoder backend: " + str(backend))
+    settings = EncoderSettings(quality=quality, optimize=optimize, progressive=progressive)
+    if backend == "inline":
+        return InlineEncoder(settings)
+    return _BACKENDS[backend](settings, workers=workers)
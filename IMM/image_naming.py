@@ -0,0 +1,50 @@
+"""Allocation of unique image file names without database lookups.
+
+The following public classes are provided:
+ImageNameAllocator -- Generates unique, time-ordered image file names.
+"""
+import datetime
+import itertools
+import os
+import time
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _base36(number):
+    """Return number as a lowercase base 36 string."""
+    digits = ""
+    while True:
+        number, rest = divmod(number, 36)
+        digits = _DIGITS[rest] + digits
+        if number == 0:
+            return digits
+
+
+class ImageNameAllocator:
+    """Generates unique image file names from a run id and an in-process sequence.
+
+    Names have the form "<date>_<time>_<run id>-<sequence>.jpg". The run id is
+    derived from the time the allocator was created and the process id, so
+    names stay unique across restarts. The sequence is a thread-safe counter,
+    so no database query is needed to avoid collisions between images taken
+    in the same second.
+    """
+
+    def __init__(self, extension=".jpg"):
+        """ImageNameAllocator constructor.
+
+        extension   File extension appended to every name. (default ".jpg")
+        """
+        self.extension = extension
+        self.run_id = _base36(time.time_ns() // 1000) + _base36(os.getpid())
+        self.__sequence = itertools.count()
+
+    def next_name(self, timestamp):
+        """Return a new unique file name for an image taken at timestamp.
+
+        timestamp   The Unix timestamp when the image was taken.
+        """
+        readable_time = datetime.datetime.fromtimestamp(timestamp)
+        image_datetime = readable_time.strftime("%Y-%m-%d_%H-%M-%S")
+        return "{}_{}-{}{}".format(image_datetime, self.run_id, next(self.__sequence), self.extension)
@@ -0,0 +1,111 @@
+"""Loading of stored images and tiles for sending to clients.
+
+Payloads are read through a PayloadCache, so images and tiles requested by
+several clients are only read from disk once.
+
+The following public functions are provided:
+read_image_file -- Return the encoded contents of a stored image rendition.
+image_message -- Return the get_image_by_id message of an image.
+read_tile -- Return the PNG contents of a rendered tile.
+"""
+import io
+
+from PIL import Image as PIL_image
+
+from IMM.payload_cache import PayloadCache, image_key, tile_key
+from IMM.renditions import rendition_size
+from IMM.view_query import CORNERS
+from sqlalchemy import func
+
+from IMM_database.database import Image, PrioImage
+from helper_functions import get_path_from_root
+
+# Cache shared by all client requests.
+payload_cache = PayloadCache()
+
+RENDITION_QUALITY = 85
+
+
+def __read_file(path):
+    try:
+        with open(path, "rb") as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
+
+
+def __downscale(payload, size):
+    """Return a JPEG encoded copy of an encoded image, resized to size."""
+    with PIL_image.open(io.BytesIO(payload)) as full:
+        resized = full.convert("RGB").resize(size, PIL_image.BILINEAR)
+    output = io.BytesIO()
+    resized.save(output, "JPEG", quality=RENDITION_QUALITY)
+    return output.getvalue()
+
+
+def read_image_file(image, rendition="full", cache=payload_cache):
+    """Return the encoded contents of a rendition of an Image, or None if its file is missing.
+
+    Renditions stored at ingest are read from their files. Other renditions,
+    e.g. of images received before renditions were stored, are generated from
+    the full image on demand.
+    """
+    size = rendition_size(rendition, image.width, image.height)
+    if rendition == "full":
+        path = get_path_from_root("/IMM/images/") + image.file_name
+        return cache.get_or_load(image_key(image.id), lambda: __read_file(path))
+    for stored in image.renditions:
+        if stored.rendition == rendition:
+            path = get_path_from_root("/IMM/images/") + stored.file_name
+            return cache.get_or_load(image_key(image.id, rendition), lambda: __read_file(path))
+
+    def load():
+        payload = read_image_file(image, "full", cache)
+        return __downscale(payload, size) if payload is not None else None
+    return cache.get_or_load(image_key(image.id, rendition), load)
+
+
+def image_message(session, image_id, rendition="full", cache=payload_cache):
+    """Return the get_image_by_id image message of an image as described in api.md.
+
+    The encoded image is included as bytes, which Socket.IO sends as a binary
+    attachment. Returns None if there is no image with id image_id or its file
+    is missing.
+    """
+    image = session.query(Image).get(image_id)
+    if image is None:
+        return None
+    payload = read_image_file(image, rendition, cache)
+    if payload is None:
+        return None
+
+    coordinates = {}
+    for corner in CORNERS + ("center",):
+        coordinate = getattr(image, corner)
+        coordinates[corner] = {"lat": coordinate.lat, "long": coordinate.long}
+    width, height = rendition_size(rendition, image.width, image.height)
+    # An image may deliver several PrioImages, the first one is reported.
+    force_que_id = session.query(func.min(PrioImage.id)).filter(PrioImage.image_id == image.id).scalar()
+    return {
+        "fcn": "image",
+        "fcn_name": "get_image_by_id",
+        "arg": {
+            "image_id": image.id,
+            "rendition": rendition,
+            "width": width,
+            "height": height,
+            "image_data": payload,
+            "type": image.type,
+            "force_que_id": force_que_id or 0,
+            "coordinates": coordinates,
+        }
+    }
+
+
+def read_tile(renderer, zoom, x, y, cache=payload_cache):
+    """Return the PNG contents of a tile of a TileRenderer, or None if it is not rendered.
+
+    Register cache.invalidate_tile as a listener of the renderer to drop
+    tiles from the cache when they are recomposited.
+    """
+    return cache.get_or_load(tile_key(zoom, x, y), lambda: __read_file(renderer.tile_path(zoom, x, y)))
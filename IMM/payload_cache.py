@@ -0,0 +1,189 @@
+"""In-process cache of encoded image and tile payloads.
+
+The following public classes are provided:
+PayloadCache -- Byte-budgeted segmented LRU cache.
+
+The following public functions are provided:
+image_key -- Return the cache key of an image rendition.
+tile_key -- Return the cache key of a tile.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+
+def image_key(image_id, rendition="full"):
+    """Return the cache key of a rendition of the image with id image_id."""
+    return ("image", image_id, rendition)
+
+
+def tile_key(zoom, x, y):
+    """Return the cache key of a tile."""
+    return ("tile", zoom, x, y)
+
+
+class PayloadCache:
+    """Byte-budgeted segmented LRU cache of bytes payloads.
+
+    Entries start in a probationary segment and are promoted to a protected
+    segment when they are hit again. Eviction takes the least recently used
+    probationary entry first, so a burst of payloads requested only once (e.g.
+    an operator panning over a new area) cannot flush the payloads that
+    several clients keep requesting.
+
+    Payloads larger than max_entry_bytes are not cached at all.
+
+    get_or_load does not cache a payload if its key was invalidated while the
+    payload was loaded, since it may have been loaded from the old file.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, max_entry_bytes=None, protected_fraction=0.8):
+        """PayloadCache constructor.
+
+        max_bytes           The maximum total size of the cached payloads. (default 256 MiB)
+        max_entry_bytes     The maximum size of a single payload. (default max_bytes / 8)
+        protected_fraction  The share of max_bytes reserved for the protected segment. (default 0.8)
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        self.max_protected_bytes = int(max_bytes * protected_fraction)
+        self.__probation = OrderedDict()
+        self.__protected = OrderedDict()
+        self.__probation_bytes = 0
+        self.__protected_bytes = 0
+        # Maps keys being loaded to [generation, number of loads]. The
+        # generation is incremented when the key is invalidated.
+        self.__loads = {}
+        self.__mutex = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    def __len__(self):
+        with self.__mutex:
+            return len(self.__probation) + len(self.__protected)
+
+    def __contains__(self, key):
+        with self.__mutex:
+            return key in self.__probation or key in self.__protected
+
+    def get(self, key):
+        """Return the payload cached under key, or None on a miss."""
+        with self.__mutex:
+            if key in self.__protected:
+                self.__protected.move_to_end(key)
+                self.hits += 1
+                return self.__protected[key]
+            payload = self.__probation.pop(key, None)
+            if payload is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__probation_bytes -= len(payload)
+            self.__protected[key] = payload
+            self.__protected_bytes += len(payload)
+            self.__demote()
+            return payload
+
+    def put(self, key, payload):
+        """Cache payload under key, replacing any previous payload.
+
+        Returns False if the payload is too large to be cached, else True.
+        """
+        with self.__mutex:
+            return self.__put(key, payload)
+
+    def get_or_load(self, key, loader):
+        """Return the payload cached under key, calling loader() to produce it on a miss.
+
+        Nothing is cached if loader returns None, or if key is invalidated
+        before loader returns.
+        """
+        payload = self.get(key)
+        if payload is not None:
+            return payload
+        with self.__mutex:
+            load = self.__loads.setdefault(key, [0, 0])
+            load[1] += 1
+            generation = load[0]
+        try:
+            payload = loader()
+        finally:
+            with self.__mutex:
+                load[1] -= 1
+                if load[1] == 0:
+                    del self.__loads[key]
+                if payload is not None and load[0] == generation:
+                    self.__put(key, payload)
+        return payload
+
+    def invalidate(self, key):
+        """Remove the payload cached under key, if any."""
+        with self.__mutex:
+            self.__remove(key)
+            if key in self.__loads:
+                self.__loads[key][0] += 1
+
+    def invalidate_tile(self, zoom, x, y):
+        """Remove a cached tile. Can be used as a TileRenderer listener."""
+        self.invalidate(tile_key(zoom, x, y))
+
+    def clear(self):
+        """Remove all cached payloads. The counters are kept."""
+        with self.__mutex:
+            for load in self.__loads.values():
+                load[0] += 1
+            self.__probation.clear()
+            self.__protected.clear()
+            self.__probation_bytes = 0
+            self.__protected_bytes = 0
+
+    def stats(self):
+        """Return a dict with the size of the cache and its hit, miss, eviction and rejection counters."""
+        with self.__mutex:
+            return {
+                "entries": len(self.__probation) + len(self.__protected),
+                "bytes": self.__probation_bytes + self.__protected_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "rejected": self.rejected,
+            }
+
+    def __put(self, key, payload):
+        self.__remove(key)
+        if len(payload) > self.max_entry_bytes:
+            self.rejected += 1
+            return False
+        self.__probation[key] = payload
+        self.__probation_bytes += len(payload)
+        self.__evict()
+        return True
+
+    def __remove(self, key):
+        payload = self.__probation.pop(key, None)
+        if payload is not None:
+            self.__probation_bytes -= len(payload)
+        payload = self.__protected.pop(key, None)
+        if payload is not None:
+            self.__protected_bytes -= len(payload)
+
+    def __demote(self):
+        """Move the least recently used protected entries back to probation while the segment is too large."""
+        while self.__protected_bytes > self.max_protected_bytes:
+            key, payload = self.__protected.popitem(last=False)
+            self.__protected_bytes -= len(payload)
+            self.__probation[key] = payload
+            self.__probation_bytes += len(payload)
+        self.__evict()
+
+    def __evict(self):
+        while self.__probation_bytes + self.__protected_bytes > self.max_bytes:
+            if self.__probation:
+                _key, payload = self.__probation.popitem(last=False)
+                self.__probation_bytes -= len(payload)
+            else:
+                _key, payload = self.__protected.popitem(last=False)
+                self.__protected_bytes -= len(payload)
+            self.evictions += 1
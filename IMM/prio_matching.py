@@ -0,0 +1,170 @@
+"""Matching of received images to pending prioritized image requests.
+
+A PrioImage is satisfied by any image whose footprint contains its
+coordinate, so one image may deliver several requests at once. The pending
+coordinates of each UserSession are kept in memory, sorted by latitude, so
+matching an image only tests the pending points within the latitude range
+of its footprint. Delivered and cancelled requests are not kept, so the
+cost does not depend on how many requests a session has made.
+
+The following public functions are provided:
+match_pending_prio_images -- Return the ids of pending PrioImages inside a footprint.
+deliver_prio_images -- Mark the pending PrioImages inside a footprint as delivered.
+invalidate_pending_prio_images -- Forget cached pending PrioImages.
+"""
+import numpy
+
+from IMM_database.database import CommitCache, PrioImage, read_scope, session_scope, track_commits, update_rows
+from Help_functions.geometry import PreparedPolygon
+
+
+class _PendingPoints:
+    """The ids and coordinates of pending PrioImages, sorted by latitude. Never modified."""
+
+    def __init__(self, ids, points):
+        """_PendingPoints constructor.
+
+        ids     Sequence of PrioImage ids.
+        points  Sequence of (lat, long) coordinates, one per id.
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        points = numpy.asarray(points, dtype=numpy.float64).reshape(len(ids), 2)
+        order = numpy.argsort(points[:, 0], kind="stable")
+        self.ids = ids[order]
+        self.points = points[order]
+
+    def inside(self, polygon):
+        """Return a mask of the points inside a PreparedPolygon with x = lat and y = long."""
+        inside = numpy.zeros(len(self.ids), dtype=bool)
+        lats = self.points[:, 0]
+        start = numpy.searchsorted(lats, polygon.min_x, side="left")
+        end = numpy.searchsorted(lats, polygon.max_x, side="right")
+        if start < end:
+            inside[start:end] = polygon.contains_points(self.points[start:end])
+        return inside
+
+    def added(self, ids, points):
+        """Return a copy with the given points added."""
+        return _PendingPoints(numpy.concatenate([self.ids, ids]),
+                              numpy.concatenate([self.points, numpy.asarray(points, dtype=numpy.float64)]))
+
+    def removed(self, mask):
+        """Return a copy without the points selected by mask."""
+        copy = _PendingPoints.__new__(_PendingPoints)
+        copy.ids = self.ids[~mask]
+        copy.points = self.points[~mask]
+        return copy
+
+
+# The pending points of each UserSession. Commits that insert pending
+# PrioImages through the ORM add them, and commits that update or delete
+# PrioImages through the ORM invalidate the points of their session.
+__pending = CommitCache()
+
+
+def __load_pending(session_id):
+    """Return the _PendingPoints of the pending PrioImages of a UserSession."""
+    with read_scope() as session:
+        rows = session.query(PrioImage.id, PrioImage.coordinate).\
+            filter(PrioImage.session_id == session_id, PrioImage.status == "PENDING").all()
+    return _PendingPoints([prio_id for prio_id, _coordinate in rows],
+                          [(coordinate.lat, coordinate.long) for _prio_id, coordinate in rows])
+
+
+def __get_pending(session_id):
+    """Return the _PendingPoints of a UserSession, loading them if they are not cached."""
+    return __pending.get(session_id, lambda: __load_pending(session_id))
+
+
+def __footprint_polygon(footprint):
+    """Return a PreparedPolygon of a footprint given as a sequence of Coordinates or (lat, long) tuples."""
+    return PreparedPolygon([(point.lat, point.long) if hasattr(point, "lat") else point for point in footprint])
+
+
+def match_pending_prio_images(session_id, footprint):
+    """Return the ids of the pending PrioImages of a UserSession whose coordinate is inside footprint.
+
+    session_id  The id of the UserSession.
+    footprint   The corners of an image footprint, as Coordinates or (lat, long)
+                tuples in traversal order.
+    """
+    pending = __get_pending(session_id)
+    return pending.ids[pending.inside(__footprint_polygon(footprint))].tolist()
+
+
+def deliver_prio_images(session_id, image_id, footprint, force_que_id=0, writer=None):
+    """Mark the pending PrioImages satisfied by an image as delivered and return their ids.
+
+    All pending PrioImages of the UserSession whose coordinate is inside the
+    footprint of the image are delivered, as well as the PrioImage with id
+    force_que_id if it is pending. Their status is set to "DELIVERED" and
+    their image_id to image_id with a single UPDATE, which only matches rows
+    that are still pending. Only the ids of the rows actually updated are
+    returned, so
+    each PrioImage is only delivered once, even if images are delivered
+    concurrently or the cached points are out of date.
+
+    session_id  The id of the UserSession of the image.
+    image_id    The id of the delivered Image.
+    footprint   The corners of the image footprint, see match_pending_prio_images.
+    force_que_id The force_que_id the RDS sent the image with, 0 if none.
+    writer      If given, the updates are commited by this DatabaseWriterThread.
+    """
+    pending = __get_pending(session_id)
+    candidates = pending.ids[pending.inside(__footprint_polygon(footprint)) | (pending.ids == force_que_id)]
+    if not len(candidates):
+        return []
+
+    values = {PrioImage.status: "DELIVERED", PrioImage.image_id: image_id}
+    still_pending = PrioImage.status == "PENDING"
+    try:
+        if writer is not None:
+            delivered = writer.submit_bulk_update(PrioImage, candidates.tolist(), values, still_pending).result()
+        else:
+            with session_scope() as session:
+                delivered = update_rows(session, PrioImage, candidates.tolist(), values, still_pending)
+    except Exception:
+        invalidate_pending_prio_images(session_id)
+        raise
+    # Candidates that were not updated are no longer pending either.
+    __pending.update(session_id, lambda current: current.removed(numpy.isin(current.ids, candidates)))
+    return delivered
+
+
+def invalidate_pending_prio_images(session_id=None):
+    """Forget the cached pending PrioImages of session_id, or of all sessions if session_id is None.
+
+    Commited ORM changes to PrioImage rows update the cache automatically.
+    Bulk updates, e.g. cancelling a queue with Query.update, must be followed
+    by a call to this function.
+    """
+    __pending.invalidate(session_id)
+
+
+def __pending_prio_image(target):
+    """Return a (session_id, id, (lat, long)) tuple of an inserted PrioImage, or None if it is not pending."""
+    if target.status != "PENDING":
+        return None
+    return target.session_id, target.id, (target.coordinate.lat, target.coordinate.long)
+
+
+def __add_pending_prio_images(inserted):
+    """Add the pending PrioImages inserted by a commit to the cached points of their session."""
+    by_session = {}
+    for session_id, prio_id, point in inserted:
+        by_session.setdefault(session_id, ([], []))
+        by_session[session_id][0].append(prio_id)
+        by_session[session_id][1].append(point)
+    for session_id, (ids, points) in by_session.items():
+        __pending.update(session_id, lambda pending: pending.added(ids, points))
+
+
+def __invalidate_changed_prio_images(session_ids):
+    """Invalidate the cached points of the sessions whose PrioImages a commit changed."""
+    for session_id in set(session_ids):
+        invalidate_pending_prio_images(session_id)
+
+
+track_commits(PrioImage, ("after_insert", ), __pending_prio_image, __add_pending_prio_images)
+track_commits(PrioImage, ("after_update", "after_delete"), lambda target: target.session_id,
+              __invalidate_changed_prio_images)
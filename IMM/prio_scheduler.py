@@ -0,0 +1,159 @@
+"""Scheduling of prioritized image requests.
+
+Every prioritized image request is tracked by a PrioImage row, whose id is
+the force_que_id sent to RDS and to the client. The scheduler allocates the
+ids in memory, so many requests can be made at once without a query per
+request to find a free id.
+
+The following public classes are provided:
+PrioRequest -- A scheduled prioritized image request.
+PrioScheduler -- Allocates force_que_ids and orders pending requests.
+"""
+import heapq
+import itertools
+import time
+
+from threading import Lock
+
+from sqlalchemy import func
+
+from IMM.prio_matching import invalidate_pending_prio_images
+from IMM.request_queue import PRIO_HIGH
+from IMM_database.database import PrioImage, bulk_insert, read_scope, session_scope
+
+
+class PrioRequest:
+    """A prioritized image request waiting to be sent to RDS.
+
+    force_que_id    The id of the PrioImage of the request.
+    session_id      The id of the UserSession the request was made in.
+    coordinate      The Coordinate where the image should be taken.
+    priority        The priority of the request, lower is more urgent.
+    time_requested  The Unix timestamp when the request was made.
+    client_id       The id of the Client that made the request, or None.
+    """
+
+    def __init__(self, force_que_id, session_id, coordinate, priority, time_requested, client_id=None):
+        """PrioRequest constructor."""
+        self.force_que_id = force_que_id
+        self.session_id = session_id
+        self.coordinate = coordinate
+        self.priority = priority
+        self.time_requested = time_requested
+        self.client_id = client_id
+
+
+class PrioScheduler:
+    """Keeps the pending prioritized image requests of all UserSessions in a heap.
+
+    Requests are popped in order of priority, then time requested, then
+    force_que_id. The force_que_ids are allocated from a counter which is
+    seeded from the largest PrioImage id the first time an id is needed, so
+    ids are never reused, even if rows are deleted.
+
+    Clearing the queue of a UserSession does not search the heap. Each
+    UserSession has an epoch, which clear_queue() increments, and requests
+    pushed in an earlier epoch are dropped when they reach the top of the
+    heap. The PrioImage rows are cancelled with a single UPDATE.
+
+    New PrioImages are inserted through the DatabaseWriterThread writer, if
+    given, so they share its group commits. Cancelling is a single UPDATE
+    made while holding the lock of the scheduler and is written directly.
+    """
+
+    def __init__(self, writer=None):
+        """PrioScheduler constructor.
+
+        writer  The DatabaseWriterThread inserting new PrioImages, or None to
+                insert them in their own transaction.
+        """
+        self.__writer = writer
+        self.__lock = Lock()
+        self.__heap = []
+        self.__next_id = None
+        self.__epochs = {}
+        self.__pending = {}
+
+    def __allocate_ids(self):
+        if self.__next_id is None:
+            with read_scope() as session:
+                self.__next_id = itertools.count((session.query(func.max(PrioImage.id)).scalar() or 0) + 1)
+        return self.__next_id
+
+    def submit(self, session_id, coordinate, priority=PRIO_HIGH, client_id=None):
+        """Schedule a prioritized image request and return its force_que_id.
+
+        The PrioImage of the request is stored with status "PENDING".
+
+        session_id  The id of the UserSession the request is made in.
+        coordinate  The Coordinate where the image should be taken.
+        priority    The priority of the request, lower is more urgent.
+                    (default PRIO_HIGH)
+        client_id   The id of the Client making the request, or None.
+        """
+        return self.submit_many(session_id, [coordinate], priority, client_id)[0]
+
+    def submit_many(self, session_id, coordinates, priority=PRIO_HIGH, client_id=None):
+        """Schedule one request per Coordinate in coordinates and return their force_que_ids.
+
+        All PrioImages are stored in a single transaction. See submit.
+        """
+        time_requested = int(time.time())
+        with self.__lock:
+            # The rows are inserted while holding the lock, so that clear_queue
+            # can't miss requests that are scheduled but not yet stored.
+            ids = self.__allocate_ids()
+            requests = [PrioRequest(next(ids), session_id, coordinate, priority, time_requested, client_id)
+                        for coordinate in coordinates]
+            prio_images = [PrioImage(id=request.force_que_id, session_id=session_id, time_requested=time_requested,
+                                     status="PENDING", coordinate=request.coordinate)
+                           for request in requests]
+            if self.__writer is not None:
+                self.__writer.submit_insert_all(prio_images).result()
+            else:
+                with session_scope() as session:
+                    bulk_insert(session, prio_images)
+            epoch = self.__epochs.get(session_id, 0)
+            for request in requests:
+                heapq.heappush(self.__heap, (priority, time_requested, request.force_que_id, epoch, request))
+            self.__pending[session_id] = self.__pending.get(session_id, 0) + len(requests)
+        return [request.force_que_id for request in requests]
+
+    def pop(self):
+        """Remove and return the most urgent pending PrioRequest, or None if there is none."""
+        with self.__lock:
+            while self.__heap:
+                _priority, _time, _id, epoch, request = heapq.heappop(self.__heap)
+                if epoch == self.__epochs.get(request.session_id, 0):
+                    self.__pending[request.session_id] -= 1
+                    return request
+            return None
+
+    def clear_queue(self, session_id):
+        """Cancel all pending requests of the UserSession with id session_id.
+
+        Requests already popped are cancelled too, unless an image has been
+        delivered for them. Returns the number of PrioImages cancelled.
+        """
+        with self.__lock:
+            self.__epochs[session_id] = self.__epochs.get(session_id, 0) + 1
+            self.__pending[session_id] = 0
+            if not any(self.__pending.values()):
+                # Only cancelled requests are left, drop them at once.
+                self.__heap = []
+            with session_scope() as session:
+                cancelled = session.query(PrioImage).\
+                    filter(PrioImage.session_id == session_id, PrioImage.status == "PENDING").\
+                    update({PrioImage.status: "CANCELLED"}, synchronize_session=False)
+            invalidate_pending_prio_images(session_id)
+            return cancelled
+
+    def pending(self, session_id):
+        """Return the number of requests of a UserSession that have not been popped or cancelled."""
+        with self.__lock:
+            return self.__pending.get(session_id, 0)
+
+    def __len__(self):
+        """Return the number of requests that have not been popped or cancelled."""
+        with self.__lock:
+            return sum(self.__pending.values())
@@ -0,0 +1,90 @@
+"""Downscaled renditions of received images.
+
+Besides the full image, every received image is stored in smaller
+renditions, so that clients can show a low resolution version first and
+refine it progressively.
+
+The following public functions are provided:
+rendition_size -- Return the size of an image rendition.
+rendition_file_name -- Return the file name of an image rendition.
+downscale_renditions -- Return the downscaled renditions of an image array.
+"""
+import os
+
+import numpy
+from PIL import Image as PIL_image
+
+# The renditions a client can request, from largest to smallest.
+RENDITIONS = ("full", "half", "preview", "thumbnail")
+
+# The renditions stored next to the full image.
+DOWNSCALED_RENDITIONS = RENDITIONS[1:]
+
+THUMBNAIL_SIZE = 256
+
+
+def rendition_size(rendition, width, height):
+    """Return the (width, height) of a rendition of a width x height image.
+
+    The half and preview renditions are scaled down by 2 and 4. The thumbnail
+    fits within THUMBNAIL_SIZE x THUMBNAIL_SIZE. Renditions are never larger
+    than the image.
+    """
+    if rendition == "full":
+        return width, height
+    if rendition == "half":
+        return max(width // 2, 1), max(height // 2, 1)
+    if rendition == "preview":
+        return max(width // 4, 1), max(height // 4, 1)
+    if rendition == "thumbnail":
+        scale = min(THUMBNAIL_SIZE / max(width, height), 1.0)
+        return max(round(width * scale), 1), max(round(height * scale), 1)
+    raise ValueError("Unknown rendition: " + str(rendition))
+
+
+def rendition_file_name(file_name, rendition):
+    """Return the file name of a rendition of the image stored in file_name."""
+    if rendition == "full":
+        return file_name
+    root, extension = os.path.splitext(file_name)
+    return root + "_" + rendition + extension
+
+
+def _halve(array):
+    """Return array scaled down by 2 in both dimensions, averaging 2x2 blocks."""
+    height, width = array.shape[0] // 2 * 2, array.shape[1] // 2 * 2
+    blocks = [array[row:height:2, column:width:2] for row in (0, 1) for column in (0, 1)]
+    if numpy.issubdtype(array.dtype, numpy.integer):
+        total = blocks[0].astype(numpy.uint32)
+        for block in blocks[1:]:
+            total += block
+        return ((total + 2) // 4).astype(array.dtype)
+    return (sum(blocks) / 4).astype(array.dtype)
+
+
+def _resize(array, size):
+    """Return array resized to size = (width, height)."""
+    height, width = array.shape[:2]
+    if size == (width // 2, height // 2) and width >= 2 and height >= 2:
+        return _halve(array)
+    return numpy.asarray(PIL_image.fromarray(array).resize(size, PIL_image.BILINEAR))
+
+
+def downscale_renditions(array):
+    """Return a list of (rendition, array) with the downscaled renditions of an image array.
+
+    Each rendition is computed from the smallest rendition already computed
+    that is at least as large, so the full image is only read once.
+    """
+    height, width = array.shape[:2]
+    computed = [array]
+    renditions = []
+    for rendition in DOWNSCALED_RENDITIONS:
+        size = rendition_size(rendition, width, height)
+        source = min((candidate for candidate in computed
+                      if candidate.shape[1] >= size[0] and candidate.shape[0] >= size[1]),
+                     key=lambda candidate: candidate.shape[0] * candidate.shape[1])
+        scaled = _resize(source, size)
+        computed.append(scaled)
+        renditions.append((rendition, scaled))
+    return renditions
@@ -0,0 +1,116 @@
+"""Blocking, thread-safe priority queue used to dispatch requests to worker threads.
+
+The following public classes are provided:
+RequestQueue -- Priority queue with blocking get, timed wakeups and counters.
+
+The following public constants are provided:
+PRIO_HIGH -- Priority class for requests that must overtake everything else.
+PRIO_NORMAL -- Priority class for regular requests.
+PRIO_LOW -- Priority class for bulk requests, e.g. plain points of interest.
+"""
+import heapq
+import itertools
+import time
+
+from threading import Condition
+
+PRIO_HIGH = 0
+PRIO_NORMAL = 1
+PRIO_LOW = 2
+
+
+class RequestQueue:
+    """A blocking priority queue of requests.
+
+    Requests with a lower priority class are dequeued first. Requests within
+    the same priority class are dequeued in the order they were added. A
+    consumer blocks in get() until a request arrives, the timeout expires or
+    the queue is closed, so no CPU time is spent while the queue is idle.
+
+    The queue keeps the following counters, see stats():
+    depth           The number of requests currently waiting.
+    max_depth       The highest depth observed.
+    enqueued        The total number of requests added.
+    dequeued        The total number of requests removed.
+    total_wait      The accumulated time in seconds requests spent waiting.
+    max_wait        The longest time in seconds a single request waited.
+    """
+
+    def __init__(self):
+        """RequestQueue constructor."""
+        self.__heap = []
+        self.__sequence = itertools.count()
+        self.__condition = Condition()
+        self.__closed = False
+
+        self.__max_depth = 0
+        self.__enqueued = 0
+        self.__dequeued = 0
+        self.__total_wait = 0.0
+        self.__max_wait = 0.0
+
+    def put(self, request, priority=PRIO_NORMAL):
+        """Add a request to the queue and wake up one waiting consumer.
+
+        request     The request to add.
+        priority    The priority class of the request. (default PRIO_NORMAL)
+        """
+        with self.__condition:
+            entry = (priority, next(self.__sequence), time.monotonic(), request)
+            heapq.heappush(self.__heap, entry)
+            self.__enqueued += 1
+            self.__max_depth = max(self.__max_depth, len(self.__heap))
+            self.__condition.notify()
+
+    def get(self, timeout=None):
+        """Remove and return the most urgent request.
+
+        Blocks until a request is available. Returns None if the timeout
+        expires or the queue is closed before a request arrives.
+
+        timeout     The maximum time in seconds to wait, or None to wait
+                    until a request arrives. (default None)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__condition:
+            while not self.__heap:
+                if self.__closed:
+                    return None
+                if deadline is None:
+                    self.__condition.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self.__condition.wait(remaining)
+
+            _priority, _seq, enqueued_at, request = heapq.heappop(self.__heap)
+            wait = time.monotonic() - enqueued_at
+            self.__dequeued += 1
+            self.__total_wait += wait
+            self.__max_wait = max(self.__max_wait, wait)
+            return request
+
+    def close(self):
+        """Wake up all waiting consumers and make empty get() calls return None."""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    def __len__(self):
+        """Return the number of requests currently waiting."""
+        with self.__condition:
+            return len(self.__heap)
+
+    def stats(self):
+        """Return a dict with a snapshot of the queue counters."""
+        with self.__condition:
+            return {
+                "depth": len(self.__heap),
+                "max_depth": self.__max_depth,
+                "enqueued": self.__enqueued,
+                "dequeued": self.__dequeued,
+                "total_wait": self.__total_wait,
+                "max_wait": self.__max_wait,
+                "mean_wait": self.__total_wait / self.__dequeued if self.__dequeued else 0.0,
+            }
@@ -0,0 +1,47 @@
+"""Cache of the prepared area polygon of each UserSession.
+
+The following public functions are provided:
+get_session_area -- Return the PreparedPolygon of a UserSession area.
+invalidate_session_area -- Forget cached session areas.
+"""
+from IMM_database.database import AreaVertex, CommitCache, read_scope, track_commits
+from Help_functions.geometry import PreparedPolygon
+
+# Commits that change AreaVertex rows through the ORM invalidate the area of their session.
+__areas = CommitCache()
+
+
+def __load_session_area(session_id):
+    """Return the PreparedPolygon of the AreaVertex rows of a UserSession, or None if it has no area."""
+    with read_scope() as session:
+        vertices = session.query(AreaVertex).filter(AreaVertex.session_id == session_id).all()
+        if len(vertices) < 3:
+            return None
+        return PreparedPolygon.from_area_vertices(vertices)
+
+
+def get_session_area(session_id):
+    """Return the area of a UserSession as a PreparedPolygon, or None if it has no area.
+
+    The polygon is built from the AreaVertex rows the first time it is needed
+    and then reused until the vertices of the session change.
+    """
+    return __areas.get(session_id, lambda: __load_session_area(session_id))
+
+
+def invalidate_session_area(session_id=None):
+    """Forget the cached area of session_id, or of all sessions if session_id is None.
+
+    Commited ORM changes to AreaVertex rows invalidate the cache automatically.
+    """
+    __areas.invalidate(session_id)
+
+
+def __invalidate_changed_areas(session_ids):
+    """Invalidate the session areas changed by a commit."""
+    for session_id in set(session_ids):
+        invalidate_session_area(session_id)
+
+
+track_commits(AreaVertex, ("after_insert", "after_update", "after_delete"), lambda target: target.session_id,
+              __invalidate_changed_areas)
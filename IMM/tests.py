@@ -0,0 +1,1035 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image as PIL_image
+
+from threading import Thread
+from time import sleep, monotonic
+
+from IMM.request_queue import RequestQueue, PRIO_HIGH, PRIO_NORMAL, PRIO_LOW
+from IMM.threads.thread_rds_pub import request_priority, RDSPubThread
+from IMM.threads import thread_rds_pub
+from IMM.IMM_thread_config import context, zmq
+from IMM.threads.thread_gui_pub import GUIPubThread, DROP_NEWEST, DROP_OLDEST, MERGE, session_room
+from IMM.threads.thread_rds_sub import RDSSubThread
+from IMM.threads.thread_ingest import IngestRing, IngestWorkerThread
+from IMM.image_encoder import create_encoder
+from IMM.image_naming import ImageNameAllocator
+from IMM.threads.thread_db_writer import DatabaseWriterThread
+from IMM_database.database import use_test_database, session_scope, UserSession, Client, Image, Coordinate
+from IMM.view_query import CORNERS, coordinates_from_json, images_in_view, record_client_view
+from IMM.session_area import get_session_area, invalidate_session_area
+from IMM_database.database import AreaVertex, ImageRendition, read_scope, get_image_columns, query_image_ids_in_bbox
+from IMM.georeference import Homography
+from IMM.payload_cache import PayloadCache, image_key, tile_key
+from IMM.image_payloads import read_tile, image_message
+from IMM.renditions import rendition_size, rendition_file_name, downscale_renditions
+from helper_functions import get_path_from_root
+from IMM.tiling import TileRenderer, lat_long_to_tile, tile_to_lat_long, tiles_for_footprint
+from IMM.prio_scheduler import PrioScheduler
+from IMM.prio_matching import match_pending_prio_images, deliver_prio_images, invalidate_pending_prio_images
+from IMM_database.database import PrioImage
+from sqlalchemy.exc import IntegrityError
+
+
+class RequestQueueTester(unittest.TestCase):
+
+    def test_priority_order(self):
+        queue = RequestQueue()
+        queue.put("low_1", PRIO_LOW)
+        queue.put("normal", PRIO_NORMAL)
+        queue.put("low_2", PRIO_LOW)
+        queue.put("high", PRIO_HIGH)
+        self.assertEqual([queue.get(timeout=0) for _i in range(4)],
+            ["high", "normal", "low_1", "low_2"],
+            "Requests dequeued in the wrong order.")
+        self.assertIsNone(queue.get(timeout=0),
+            "Empty queue returned a request.")
+
+    def test_timeout(self):
+        queue = RequestQueue()
+        start = monotonic()
+        self.assertIsNone(queue.get(timeout=0.05))
+        self.assertGreaterEqual(monotonic() - start, 0.05,
+            "get() returned before the timeout expired.")
+
+    def test_blocking_get(self):
+        queue = RequestQueue()
+        results = []
+        consumer = Thread(target=lambda: results.append(queue.get()))
+        consumer.start()
+        sleep(0.05)
+        self.assertEqual(results, [], "get() did not block on an empty queue.")
+        queue.put("request")
+        consumer.join(1)
+        self.assertEqual(results, ["request"])
+
+    def test_close(self):
+        queue = RequestQueue()
+        results = []
+        consumer = Thread(target=lambda: results.append(queue.get()))
+        consumer.start()
+        queue.close()
+        consumer.join(1)
+        self.assertFalse(consumer.is_alive(), "close() did not wake up the consumer.")
+        self.assertEqual(results, [None])
+
+    def test_stats(self):
+        queue = RequestQueue()
+        for i in range(3):
+            queue.put(i)
+        queue.get()
+        stats = queue.stats()
+        self.assertEqual(stats["depth"], 2)
+        self.assertEqual(stats["max_depth"], 3)
+        self.assertEqual(stats["enqueued"], 3)
+        self.assertEqual(stats["dequeued"], 1)
+        self.assertGreaterEqual(stats["max_wait"], 0)
+
+    def test_request_priority(self):
+        self.assertEqual(request_priority({"fcn": "quit"}), PRIO_HIGH)
+        self.assertEqual(request_priority({"fcn": "set_mode", "arg": {"mode": "MAN"}}), PRIO_HIGH)
+        self.assertEqual(request_priority({"fcn": "request_POI", "arg": {"prio": True}}), PRIO_HIGH)
+        self.assertEqual(request_priority({"fcn": "request_POI", "arg": {"prio": False}}), PRIO_LOW)
+        self.assertEqual(request_priority({"fcn": "request_view"}), PRIO_NORMAL)
+
+
+class RDSPubThreadTester(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Bound once, since a closed socket releases its address asynchronously.
+        cls.rds = context.socket(zmq.REP)
+        cls.rds.bind("tcp://*:5572")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.rds.close(linger=0)
+
+    def setUp(self):
+        self.thread = RDSPubThread(None)
+        self.timeout = thread_rds_pub.RDS_REPLY_TIMEOUT
+        thread_rds_pub.RDS_REPLY_TIMEOUT = 200
+
+    def tearDown(self):
+        thread_rds_pub.RDS_REPLY_TIMEOUT = self.timeout
+        self.thread.RDS_req_socket.close(linger=0)
+        self.thread.RDS_pub_socket.close(linger=0)
+
+    def reply(self, response):
+        def serve():
+            if self.rds.poll(2000):
+                self.request = json.loads(self.rds.recv_json())
+                self.rds.send_json(response)
+        server = Thread(target=serve)
+        server.start()
+        return server
+
+    def test_regular_update(self):
+        server = self.reply({"fcn": "ack", "arg": "que_ETA", "arg2": "7"})
+        self.thread.regular_update()
+        server.join()
+        self.assertEqual(self.request, {"fcn": "queue_eta"})
+        self.assertEqual(self.thread.queue_eta, 7)
+
+    def test_no_reply(self):
+        self.thread.regular_update()
+        self.assertIsNone(self.thread.queue_eta)
+        self.assertEqual(self.thread.update_interval, 2 * thread_rds_pub.UPDATE_INTERVAL, "Polling did not back off.")
+        # Answer the request that timed out, the reply goes to the replaced socket.
+        self.rds.recv_json()
+        self.rds.send_json({"fcn": "ack", "arg": "que_ETA", "arg2": "5"})
+        # The request link works again once the RDS replies.
+        server = self.reply({"fcn": "ack", "arg": "que_ETA", "arg2": "3"})
+        self.thread.regular_update()
+        server.join()
+        self.assertEqual(self.thread.queue_eta, 3)
+        self.assertEqual(self.thread.update_interval, thread_rds_pub.UPDATE_INTERVAL)
+
+    def test_error_reply(self):
+        server = self.reply({"fcn": "error", "arg": "Unknown fcn: queue_eta"})
+        self.thread.regular_update()
+        server.join()
+        self.assertIsNone(self.thread.queue_eta)
+
+    def test_set_mode_and_quit(self):
+        server = self.reply({"msg": "mode set"})
+        self.assertTrue(self.thread.set_mode({"fcn": "set_mode", "arg": {"mode": "AUTO"}}))
+        server.join()
+        self.assertEqual(self.request, {"fcn": "set_mode", "arg": {"mode": "AUTO"}})
+        server = self.reply({"fcn": "ack"})
+        self.assertTrue(self.thread.quit())
+        server.join()
+        self.assertEqual(self.request, {"fcn": "quit", "arg": ""})
+
+    def test_clear_que(self):
+        server = self.reply({"fcn": "ack", "arg": "clear_que"})
+        self.assertTrue(self.thread.clear_que())
+        server.join()
+        self.assertEqual(self.request, {"fcn": "clear_que", "arg": ""})
+        self.assertFalse(self.thread.clear_que(), "Missing reply was not detected.")
+        self.rds.recv_json()
+        self.rds.send_json({"fcn": "ack", "arg": "clear_que"})
+
+
+class _FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data, room=None):
+        self.emitted.append((event, data, room))
+
+
+def _new_pic(image_id, room=None, img_type="RGB", prioritized=False):
+    msg = {"fcn": "new_pic", "arg": {"type": img_type, "prioritized": prioritized, "image_id": image_id}}
+    return {"IMM_fcn": "send_to_gui", "arg": msg, "room": room}
+
+
+class GUIPubThreadTester(unittest.TestCase):
+
+    def setUp(self):
+        self.socketio = _FakeSocketIO()
+
+    def create_thread(self, **kwargs):
+        thread = GUIPubThread(None, **kwargs)
+        thread.set_socketio(self.socketio)
+        return thread
+
+    def test_batch_per_room(self):
+        thread = self.create_thread()
+        thread.add_request(_new_pic(1, room="a"))
+        thread.add_request(_new_pic(2, room="b"))
+        thread.add_request(_new_pic(3, room="a"))
+        thread.send_batch(thread.next_batch())
+
+        self.assertEqual(len(self.socketio.emitted), 2, "Expected one emit per room.")
+        by_room = {room: data for _event, data, room in self.socketio.emitted}
+        self.assertEqual(by_room["a"]["fcn"], "new_pics")
+        self.assertEqual([pic["image_id"] for pic in by_room["a"]["arg"]["images"]], [1, 3])
+        self.assertEqual(by_room["b"], {"fcn": "new_pic", "arg": {"type": "RGB", "prioritized": False, "image_id": 2}})
+
+    def test_session_room(self):
+        thread = self.create_thread()
+
+        class _Handler:
+            def get_gui_pub_thread(self):
+                return thread
+        sub_thread = RDSSubThread.__new__(RDSSubThread)
+        sub_thread.thread_handler = _Handler()
+        sub_thread.send_tile_to_gui(None, 1, {"type": "RGB"}, session_id=3)
+        sub_thread.send_tile_to_gui(None, 2, {"type": "RGB"})
+        thread.send_batch(thread.next_batch())
+        rooms = {room: data["arg"]["image_id"] for _event, data, room in self.socketio.emitted}
+        self.assertEqual(rooms, {session_room(3): 1, None: 2})
+
+    def test_batch_size_ends_window(self):
+        thread = self.create_thread(batch_window=10, batch_size=2)
+        thread.add_request(_new_pic(1))
+        thread.add_request(_new_pic(2))
+        start = monotonic()
+        self.assertEqual(len(thread.next_batch()), 2)
+        self.assertLess(monotonic() - start, 1, "Full batch waited for the whole window.")
+
+    def test_drop_oldest(self):
+        thread = self.create_thread(max_pending=2, overflow_policy=DROP_OLDEST)
+        for i in range(3):
+            thread.add_request(_new_pic(i))
+        self.assertEqual([r["arg"]["arg"]["image_id"] for r in thread.request_queue], [1, 2])
+        self.assertEqual(thread.get_queue_stats()["dropped"], 1)
+
+    def test_drop_newest(self):
+        thread = self.create_thread(max_pending=2, overflow_policy=DROP_NEWEST)
+        for i in range(3):
+            thread.add_request(_new_pic(i))
+        self.assertEqual([r["arg"]["arg"]["image_id"] for r in thread.request_queue], [0, 1])
+        self.assertEqual(thread.get_queue_stats()["dropped"], 1)
+
+    def test_merge(self):
+        thread = self.create_thread(max_pending=2, overflow_policy=MERGE)
+        thread.add_request(_new_pic(0, img_type="RGB"))
+        thread.add_request(_new_pic(1, img_type="IR"))
+        thread.add_request(_new_pic(2, img_type="RGB"))
+        self.assertEqual([r["arg"]["arg"]["image_id"] for r in thread.request_queue], [2, 1])
+        self.assertEqual(thread.get_queue_stats()["merged"], 1)
+
+    def test_stop(self):
+        thread = self.create_thread()
+        thread.start()
+        thread.stop()
+        thread.join(1)
+        self.assertFalse(thread.is_alive(), "stop() did not wake up the thread.")
+
+
+class IngestRingTester(unittest.TestCase):
+
+    def test_fill(self):
+        ring = IngestRing(4)
+        ring.put(1)
+        ring.put(2)
+        self.assertEqual(ring.fill(), 0.5)
+        self.assertEqual(ring.get(), 1)
+        stats = ring.stats()
+        self.assertEqual(stats["depth"], 1)
+        self.assertEqual(stats["high_watermark"], 2)
+        self.assertEqual(stats["total"], 2)
+
+    def test_put_blocks_when_full(self):
+        ring = IngestRing(1)
+        ring.put(1)
+        producer = Thread(target=lambda: ring.put(2))
+        producer.start()
+        sleep(0.05)
+        self.assertTrue(producer.is_alive(), "put() did not block on a full ring.")
+        self.assertEqual(ring.get(), 1)
+        producer.join(1)
+        self.assertEqual(ring.get(), 2)
+
+    def test_close(self):
+        ring = IngestRing(2)
+        ring.put(1)
+        ring.close()
+        self.assertFalse(ring.put(2), "Closed ring accepted an item.")
+        self.assertEqual(ring.get(), 1, "Items in a closed ring were lost.")
+        self.assertIsNone(ring.get())
+
+    def test_workers(self):
+        ring = IngestRing(8)
+        results = []
+        workers = [IngestWorkerThread(ring, lambda a, b: results.append(a + b)) for _i in range(2)]
+        for worker in workers:
+            worker.start()
+        for i in range(20):
+            ring.put((i, i))
+        ring.close()
+        for worker in workers:
+            worker.join(1)
+        self.assertEqual(sorted(results), [2 * i for i in range(20)])
+        self.assertEqual(ring.stats()["failed"], 0)
+
+    def test_failed_items(self):
+        ring = IngestRing(8)
+        worker = IngestWorkerThread(ring, lambda a, b: a / b)
+        worker.start()
+        for i in range(3):
+            ring.put((1, i))
+        ring.close()
+        worker.join(1)
+        stats = ring.stats()
+        self.assertEqual(stats["failed"], 1)
+        self.assertIn("ZeroDivisionError", stats["last_error"])
+
+
+class ImageEncoderTester(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.array = numpy.zeros((40, 60, 3), dtype=numpy.uint8)
+        self.array[:, 30:] = (255, 0, 0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check_backend(self, backend):
+        encoder = create_encoder(backend, workers=2, quality=90, progressive=True)
+        paths = [os.path.join(self.directory.name, backend + str(i) + ".jpg") for i in range(3)]
+        try:
+            futures = [encoder.submit(self.array, path) for path in paths]
+            for future, path in zip(futures, paths):
+                self.assertEqual(future.result(timeout=30), path)
+        finally:
+            encoder.shutdown()
+        for path in paths:
+            with PIL_image.open(path) as image:
+                self.assertEqual(image.format, "JPEG")
+                self.assertEqual(image.size, (60, 40))
+                self.assertGreater(image.getpixel((50, 20))[0], 200, "Wrong pixel data encoded.")
+
+    def test_inline(self):
+        self.check_backend("inline")
+
+    def test_thread(self):
+        self.check_backend("thread")
+
+    def test_process(self):
+        self.check_backend("process")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_encoder("gpu")
+
+
+class ImageNameAllocatorTester(unittest.TestCase):
+
+    def test_unique_across_threads(self):
+        allocator = ImageNameAllocator()
+        names = []
+
+        def allocate():
+            for _i in range(500):
+                names.append(allocator.next_name(1600000000))
+
+        threads = [Thread(target=allocate) for _i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(names)), 2000, "Duplicate image names generated.")
+
+    def test_unique_across_restarts(self):
+        first = ImageNameAllocator().next_name(1600000000)
+        sleep(0.001)
+        second = ImageNameAllocator().next_name(1600000000)
+        self.assertNotEqual(first, second)
+
+    def test_format(self):
+        name = ImageNameAllocator().next_name(1600000000)
+        self.assertTrue(name.endswith("-0.jpg"))
+        self.assertRegex(name, r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_[0-9a-z]+-0\.jpg$")
+
+
+class DatabaseWriterThreadTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database(in_memory=False)
+        self.writer = DatabaseWriterThread(batch_window=0.05)
+        self.writer.start()
+
+    def tearDown(self):
+        self.writer.stop()
+        self.writer.join(5)
+
+    def test_group_commit(self):
+        futures = [self.writer.submit_insert(UserSession(start_time=i, drone_mode="AUTO")) for i in range(100)]
+        ids = [future.result(timeout=5) for future in futures]
+        self.assertEqual(sorted(ids), list(range(1, 101)), "Wrong ids returned.")
+        self.assertLess(self.writer.commits, 100, "Inserts were not grouped.")
+        with session_scope() as session:
+            self.assertEqual(session.query(UserSession).count(), 100)
+
+    def test_update(self):
+        session_id = self.writer.submit_insert(UserSession(start_time=1, drone_mode="AUTO")).result(timeout=5)
+        updated = self.writer.submit_update(UserSession, session_id, {"drone_mode": "MAN"}).result(timeout=5)
+        self.assertEqual(updated, 1)
+        with session_scope() as session:
+            self.assertEqual(session.query(UserSession).get(session_id).drone_mode, "MAN")
+        condition = UserSession.drone_mode == "AUTO"
+        updated = self.writer.submit_update(UserSession, session_id, {"drone_mode": "AUTO"}, condition)
+        self.assertEqual(updated.result(timeout=5), 0, "Row not matching the condition updated.")
+
+    def test_insert_with_children(self):
+        session_id = self.writer.submit_insert(UserSession(start_time=1, drone_mode="AUTO")).result(timeout=5)
+        with read_scope() as session:
+            self.assertEqual(len(get_image_columns(session, session_id)), 0)
+        images = [_image_from_json(session_id, i, _rectangle_json(58.0, 16.0, 58.1, 16.1)) for i in range(3)]
+        images[1].renditions = [ImageRendition(rendition="half", file_name="1_half.jpg", width=2, height=1, size=10)]
+        ids = self.writer.submit_insert_all(images).result(timeout=5)
+        self.assertEqual(ids, [1, 2, 3])
+        with read_scope() as session:
+            self.assertEqual(session.query(ImageRendition.image_id).all(), [(2, )])
+            self.assertEqual(sorted(get_image_columns(session, session_id).ids), ids, "Image columns missed inserts.")
+            self.assertEqual(query_image_ids_in_bbox(session, 58.0, 16.0, 58.1, 16.1), ids)
+
+    def test_bulk_update(self):
+        ids = [self.writer.submit_insert(UserSession(start_time=i, drone_mode="AUTO")).result(timeout=5)
+               for i in range(3)]
+        self.writer.submit_update(UserSession, ids[0], {"drone_mode": "MAN"}).result(timeout=5)
+        future = self.writer.submit_bulk_update(UserSession, ids + [99], {"drone_mode": "MAN"},
+                                                UserSession.drone_mode == "AUTO")
+        self.assertEqual(sorted(future.result(timeout=5)), ids[1:])
+        with session_scope() as session:
+            self.assertEqual(session.query(UserSession).filter_by(drone_mode="MAN").count(), 3)
+
+    def test_invalid_row(self):
+        valid = self.writer.submit_insert(UserSession(start_time=1, drone_mode="AUTO"))
+        invalid = self.writer.submit_insert(UserSession(start_time=2))
+        self.assertIsInstance(invalid.exception(timeout=5), IntegrityError)
+        self.assertIsNotNone(valid.result(timeout=5), "Valid row failed together with an invalid one.")
+
+    def test_stop_flushes_pending(self):
+        future = self.writer.submit_insert(UserSession(start_time=1, drone_mode="AUTO"))
+        self.writer.stop()
+        self.writer.join(5)
+        self.assertEqual(future.result(timeout=0), 1)
+
+
+def _rectangle_json(lat0, long0, lat1, long1):
+    corner = lambda lat, long: {"lat": lat, "long": long}
+    return {
+        "up_left": corner(lat1, long0), "up_right": corner(lat1, long1),
+        "down_right": corner(lat0, long1), "down_left": corner(lat0, long0),
+        "center": corner((lat0 + lat1) / 2, (long0 + long1) / 2)
+    }
+
+
+def _image_from_json(session_id, time_taken, footprint):
+    coordinates = coordinates_from_json(footprint)
+    return Image(session_id=session_id, time_taken=time_taken, width=4, height=3, type="RGB",
+                 file_name=str(time_taken) + ".jpg", **coordinates)
+
+
+class ViewQueryTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="AUTO"))
+            session.add(UserSession(start_time=2, drone_mode="AUTO"))
+            session.add(_image_from_json(1, 10, _rectangle_json(58.0, 16.0, 58.1, 16.1)))
+            session.add(_image_from_json(1, 30, _rectangle_json(58.05, 16.05, 58.15, 16.15)))
+            session.add(_image_from_json(1, 20, _rectangle_json(59.0, 17.0, 59.1, 17.1)))
+            session.add(_image_from_json(2, 40, _rectangle_json(58.0, 16.0, 58.1, 16.1)))
+            # Diamond whose bounding box overlaps the view below, but not the footprint itself.
+            diamond = {
+                "up_left": {"lat": 58.3, "long": 16.2}, "up_right": {"lat": 58.2, "long": 16.3},
+                "down_right": {"lat": 58.1, "long": 16.2}, "down_left": {"lat": 58.2, "long": 16.1},
+                "center": {"lat": 58.2, "long": 16.2}
+            }
+            session.add(_image_from_json(1, 50, diamond))
+            session.add(Client(session_id=1))
+        self.view = coordinates_from_json(_rectangle_json(58.09, 16.09, 58.12, 16.12))
+
+    def test_images_in_view(self):
+        with session_scope() as session:
+            self.assertEqual(images_in_view(session, self.view), [4, 2, 1],
+                "Wrong images or wrong order.")
+            self.assertEqual(images_in_view(session, self.view, session_id=1), [2, 1])
+            self.assertEqual(images_in_view(session, self.view, session_id=1, limit=1), [2])
+
+    def test_new_image_in_view(self):
+        with session_scope() as session:
+            self.assertEqual(images_in_view(session, self.view, session_id=1), [2, 1])
+        with session_scope() as session:
+            session.add(_image_from_json(1, 5, _rectangle_json(58.1, 16.1, 58.2, 16.2)))
+        with session_scope() as session:
+            self.assertEqual(images_in_view(session, self.view, session_id=1), [2, 1, 6],
+                "Image commited after the first query not found.")
+
+    def test_min_coverage(self):
+        with session_scope() as session:
+            # Image 1 and 4 cover 1/9 of the view, image 2 covers all of it.
+            self.assertEqual(images_in_view(session, self.view, min_coverage=0.2), [2])
+            self.assertEqual(images_in_view(session, self.view, min_coverage=0.1), [4, 2, 1])
+
+    def test_record_client_view(self):
+        with session_scope() as session:
+            self.assertTrue(record_client_view(session, 1, self.view))
+            self.assertFalse(record_client_view(session, 2, self.view))
+        with session_scope() as session:
+            self.assertEqual(session.query(Client).get(1).up_left, Coordinate(58.12, 16.09))
+
+
+class SessionAreaTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+        invalidate_session_area()
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="AUTO"))
+            for vertex_no, (lat, long) in enumerate([(0, 0), (0, 10), (10, 10), (10, 0)]):
+                session.add(AreaVertex(session_id=1, vertex_no=vertex_no, coordinate=Coordinate(lat, long)))
+
+    def test_cached(self):
+        area = get_session_area(1)
+        self.assertTrue(area.contains((5, 5)))
+        self.assertIs(get_session_area(1), area, "Area was not cached.")
+        self.assertIsNone(get_session_area(2))
+
+    def test_invalidated_on_change(self):
+        self.assertFalse(get_session_area(1).contains((15, 5)))
+        with session_scope() as session:
+            session.query(AreaVertex).filter_by(session_id=1, vertex_no=2).one().coordinate = Coordinate(20, 10)
+            session.query(AreaVertex).filter_by(session_id=1, vertex_no=3).one().coordinate = Coordinate(20, 0)
+        self.assertTrue(get_session_area(1).contains((15, 5)), "Changed area was not reloaded.")
+
+
+class GeoreferenceTester(unittest.TestCase):
+
+    def test_corners(self):
+        # A non-affine quadrilateral, as seen by a tilted camera.
+        footprint = {
+            "up_left": (58.41, 15.62), "up_right": (58.412, 15.63),
+            "down_right": (58.405, 15.628), "down_left": (58.404, 15.621)
+        }
+        homography = Homography.from_footprint(footprint, 640, 480)
+        pixels = {"up_left": (0, 0), "up_right": (640, 0), "down_right": (640, 480), "down_left": (0, 480)}
+        for corner, (column, row) in pixels.items():
+            lat, long = homography.pixel_to_lat_long(column, row)
+            self.assertAlmostEqual(lat, footprint[corner][0], places=9)
+            self.assertAlmostEqual(long, footprint[corner][1], places=9)
+            self.assertAlmostEqual(homography.lat_long_to_pixel(*footprint[corner])[0], column, places=6)
+            self.assertAlmostEqual(homography.lat_long_to_pixel(*footprint[corner])[1], row, places=6)
+
+        columns, rows = numpy.meshgrid(numpy.linspace(0, 640, 9), numpy.linspace(0, 480, 7))
+        back = homography.lat_long_to_pixel(*homography.pixel_to_lat_long(columns, rows))
+        numpy.testing.assert_allclose(back[0], columns, atol=1e-6)
+        numpy.testing.assert_allclose(back[1], rows, atol=1e-6)
+
+
+class TilingTester(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # A footprint exactly covering tile (x=10, y=12) at zoom 5.
+        (lat0, long0), (lat1, long1) = tile_to_lat_long(10, 13, 5), tile_to_lat_long(11, 12, 5)
+        self.footprint = {
+            "up_left": (lat1, long0), "up_right": (lat1, long1),
+            "down_right": (lat0, long1), "down_left": (lat0, long0)
+        }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        x, y = lat_long_to_tile(58.4108, 15.6214, 15)
+        lat, long = tile_to_lat_long(x, y, 15)
+        self.assertAlmostEqual(lat, 58.4108)
+        self.assertAlmostEqual(long, 15.6214)
+        self.assertEqual((int(x), int(y)), (17805, 9798))
+
+    def test_tiles_for_footprint(self):
+        polygon = [self.footprint[corner] for corner in ("up_left", "up_right", "down_right", "down_left")]
+        self.assertEqual(tiles_for_footprint(polygon, 5), [(10, 12)])
+        self.assertEqual(len(tiles_for_footprint(polygon, 6)), 4)
+
+    def test_render(self):
+        renderer = TileRenderer(self.directory.name, min_zoom=5, max_zoom=6)
+        image = numpy.zeros((64, 64, 3), dtype=numpy.uint8)
+        image[:32] = (255, 0, 0)    # Upper half red
+        image[32:] = (0, 0, 255)    # Lower half blue
+        touched = renderer.render(image, self.footprint)
+        self.assertEqual(sorted(touched), [(5, 10, 12), (6, 20, 24), (6, 20, 25), (6, 21, 24), (6, 21, 25)])
+
+        with PIL_image.open(renderer.tile_path(5, 10, 12)) as tile:
+            self.assertEqual(tile.getpixel((128, 10)), (255, 0, 0, 255))
+            self.assertEqual(tile.getpixel((128, 250)), (0, 0, 255, 255))
+        with PIL_image.open(renderer.tile_path(6, 20, 24)) as tile:
+            self.assertEqual(tile.getpixel((128, 128)), (255, 0, 0, 255))
+
+    def test_newest_on_top(self):
+        renderer = TileRenderer(self.directory.name, min_zoom=5, max_zoom=5)
+        renderer.render(numpy.full((8, 8, 3), 50, dtype=numpy.uint8), self.footprint)
+        # Newer image covering the left half of the tile only.
+        left_half = dict(self.footprint)
+        middle = tile_to_lat_long(10.5, 12, 5)[1]
+        left_half["up_right"] = (left_half["up_right"][0], middle)
+        left_half["down_right"] = (left_half["down_right"][0], middle)
+        future = renderer.submit(numpy.full((8, 4), 200, dtype=numpy.uint8), left_half)
+        self.assertEqual(future.result(timeout=10), [(5, 10, 12)])
+        renderer.shutdown()
+        with PIL_image.open(renderer.tile_path(5, 10, 12)) as tile:
+            self.assertEqual(tile.getpixel((10, 128)), (200, 200, 200, 255))
+            self.assertEqual(tile.getpixel((245, 128)), (50, 50, 50, 255))
+
+    def test_older_image_not_on_top(self):
+        renderer = TileRenderer(self.directory.name, min_zoom=5, max_zoom=5)
+        left_half = dict(self.footprint)
+        middle = tile_to_lat_long(10.5, 12, 5)[1]
+        left_half["up_right"] = (left_half["up_right"][0], middle)
+        left_half["down_right"] = (left_half["down_right"][0], middle)
+        renderer.render(numpy.full((8, 4, 3), 200, dtype=numpy.uint8), left_half, time_taken=20)
+        # Older images arriving later only replace the pixels showing even older images.
+        self.assertEqual(renderer.render(numpy.full((8, 8, 3), 50, dtype=numpy.uint8), self.footprint, time_taken=10),
+                         [(5, 10, 12)])
+        self.assertEqual(renderer.render(numpy.full((8, 8, 3), 90, dtype=numpy.uint8), self.footprint, time_taken=15),
+                         [(5, 10, 12)])
+        with PIL_image.open(renderer.tile_path(5, 10, 12)) as tile:
+            self.assertEqual(tile.getpixel((10, 128)), (200, 200, 200, 255))
+            self.assertEqual(tile.getpixel((245, 128)), (90, 90, 90, 255))
+
+        # The times are stored with the tile, so they survive a restart.
+        restarted = TileRenderer(self.directory.name, min_zoom=5, max_zoom=5)
+        self.assertEqual(restarted.render(numpy.full((8, 8, 3), 70, dtype=numpy.uint8), self.footprint, time_taken=12),
+                         [])
+        restarted.render(numpy.full((8, 4, 3), 120, dtype=numpy.uint8), left_half, time_taken=30)
+        with PIL_image.open(restarted.tile_path(5, 10, 12)) as tile:
+            self.assertEqual(tile.getpixel((10, 128)), (120, 120, 120, 255))
+            self.assertEqual(tile.getpixel((245, 128)), (90, 90, 90, 255))
+
+    def test_listener(self):
+        renderer = TileRenderer(self.directory.name, min_zoom=5, max_zoom=5)
+        notified = []
+        renderer.add_listener(lambda zoom, x, y: notified.append((zoom, x, y)))
+        renderer.render(numpy.zeros((8, 8, 3), dtype=numpy.uint8), self.footprint)
+        self.assertEqual(notified, [(5, 10, 12)])
+
+
+
+class PayloadCacheTester(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = PayloadCache(max_bytes=100)
+        self.assertIsNone(cache.get(image_key(1)))
+        self.assertTrue(cache.put(image_key(1), b"a" * 10))
+        self.assertEqual(cache.get(image_key(1)), b"a" * 10)
+        self.assertIsNone(cache.get(image_key(1, "thumbnail")))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["bytes"]), (1, 2, 10))
+
+    def test_reject_oversized(self):
+        cache = PayloadCache(max_bytes=100, max_entry_bytes=20)
+        self.assertFalse(cache.put(image_key(1), b"a" * 21))
+        self.assertNotIn(image_key(1), cache)
+        self.assertEqual(cache.stats()["rejected"], 1)
+
+    def test_lru_eviction(self):
+        cache = PayloadCache(max_bytes=30, max_entry_bytes=10)
+        for image_id in range(3):
+            cache.put(image_key(image_id), b"a" * 10)
+        cache.put(image_key(3), b"a" * 10)
+        self.assertNotIn(image_key(0), cache)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_protected_segment(self):
+        cache = PayloadCache(max_bytes=40, max_entry_bytes=10, protected_fraction=0.5)
+        cache.put(image_key(0), b"a" * 10)
+        cache.get(image_key(0))
+        # A scan of payloads requested once does not evict the payload that was hit.
+        for image_id in range(1, 10):
+            cache.put(image_key(image_id), b"a" * 10)
+        self.assertIn(image_key(0), cache)
+        self.assertNotIn(image_key(1), cache)
+        self.assertLessEqual(cache.stats()["bytes"], 40)
+
+    def test_get_or_load(self):
+        cache = PayloadCache(max_bytes=100)
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return b"payload"
+        self.assertEqual(cache.get_or_load(tile_key(5, 1, 2), loader), b"payload")
+        self.assertEqual(cache.get_or_load(tile_key(5, 1, 2), loader), b"payload")
+        self.assertEqual(len(loads), 1)
+        self.assertIsNone(cache.get_or_load(tile_key(5, 1, 3), lambda: None))
+        self.assertNotIn(tile_key(5, 1, 3), cache)
+
+    def test_invalidated_while_loading(self):
+        cache = PayloadCache(max_bytes=100)
+
+        def loader():
+            # The tile is recomposited after the old file was read.
+            cache.invalidate_tile(5, 1, 2)
+            return b"old"
+        self.assertEqual(cache.get_or_load(tile_key(5, 1, 2), loader), b"old")
+        self.assertNotIn(tile_key(5, 1, 2), cache, "Stale payload cached.")
+        self.assertEqual(cache.get_or_load(tile_key(5, 1, 2), lambda: b"new"), b"new")
+        self.assertIn(tile_key(5, 1, 2), cache)
+
+    def test_tile_invalidation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = PayloadCache(max_bytes=2**20)
+            renderer = TileRenderer(directory, min_zoom=5, max_zoom=5)
+            renderer.add_listener(cache.invalidate_tile)
+            (lat0, long0), (lat1, long1) = tile_to_lat_long(10, 13, 5), tile_to_lat_long(11, 12, 5)
+            footprint = {
+                "up_left": (lat1, long0), "up_right": (lat1, long1),
+                "down_right": (lat0, long1), "down_left": (lat0, long0)
+            }
+            self.assertIsNone(read_tile(renderer, 5, 10, 12, cache))
+            renderer.render(numpy.zeros((8, 8, 3), dtype=numpy.uint8), footprint)
+            first = read_tile(renderer, 5, 10, 12, cache)
+            self.assertIn(tile_key(5, 10, 12), cache)
+            renderer.render(numpy.full((8, 8, 3), 255, dtype=numpy.uint8), footprint)
+            self.assertNotIn(tile_key(5, 10, 12), cache)
+            self.assertNotEqual(read_tile(renderer, 5, 10, 12, cache), first)
+
+
+
+class RenditionsTester(unittest.TestCase):
+
+    def test_rendition_size(self):
+        self.assertEqual(rendition_size("full", 1024, 512), (1024, 512))
+        self.assertEqual(rendition_size("half", 1024, 512), (512, 256))
+        self.assertEqual(rendition_size("preview", 1024, 512), (256, 128))
+        self.assertEqual(rendition_size("thumbnail", 1024, 512), (256, 128))
+        self.assertEqual(rendition_size("thumbnail", 100, 50), (100, 50))
+        self.assertRaises(ValueError, rendition_size, "huge", 100, 50)
+
+    def test_rendition_file_name(self):
+        self.assertEqual(rendition_file_name("a-1.jpg", "full"), "a-1.jpg")
+        self.assertEqual(rendition_file_name("a-1.jpg", "thumbnail"), "a-1_thumbnail.jpg")
+
+    def test_downscale_renditions(self):
+        image = numpy.zeros((1000, 2001, 3), dtype=numpy.uint8)
+        image[0::2, 0::2] = 4
+        image[1::2, 1::2] = 2
+        renditions = dict(downscale_renditions(image))
+        self.assertEqual(list(renditions), ["half", "preview", "thumbnail"])
+        for rendition, array in renditions.items():
+            with self.subTest(rendition=rendition):
+                self.assertEqual((array.shape[1], array.shape[0]), rendition_size(rendition, 2001, 1000))
+                self.assertEqual(array.dtype, numpy.uint8)
+        # Each 2x2 block is averaged, rounding to nearest.
+        self.assertTrue((renditions["half"] == 2).all())
+
+    def test_downscale_single_channel(self):
+        renditions = dict(downscale_renditions(numpy.full((3, 5), 7, dtype=numpy.uint8)))
+        self.assertEqual(renditions["half"].shape, (1, 2))
+        self.assertEqual(renditions["preview"].shape, (1, 1))
+        self.assertEqual(renditions["thumbnail"].shape, (3, 5))
+
+
+class ImagePayloadsTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+        self.cache = PayloadCache(max_bytes=2**22)
+        with session_scope() as session:
+            user_session = UserSession(start_time=0, drone_mode="AUTO")
+            session.add(user_session)
+            session.flush()
+            image = _image_from_json(user_session.id, 1, _rectangle_json(58.0, 15.0, 58.001, 15.001))
+            image.width, image.height = 1024, 512
+            image.file_name = "test_image_payloads_" + str(os.getpid()) + ".jpg"
+            session.add(image)
+            session.flush()
+            self.image_id = image.id
+            self.path = get_path_from_root("/IMM/images/") + image.file_name
+        PIL_image.new("RGB", (1024, 512), (10, 200, 30)).save(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_force_que_id(self):
+        with session_scope() as session:
+            for prio_id in (9, 4):
+                session.add(PrioImage(id=prio_id, session_id=1, time_requested=1, status="DELIVERED",
+                                      image_id=self.image_id, coordinate=Coordinate(58.0005, 15.0005)))
+        with session_scope() as session:
+            message = image_message(session, self.image_id, cache=self.cache)
+        self.assertEqual(message["arg"]["force_que_id"], 4)
+
+    def test_image_message(self):
+        with session_scope() as session:
+            message = image_message(session, self.image_id, cache=self.cache)
+            thumbnail = image_message(session, self.image_id, "thumbnail", cache=self.cache)
+            self.assertIsNone(image_message(session, self.image_id + 1, cache=self.cache))
+
+        self.assertEqual(message["fcn"], "image")
+        self.assertEqual(message["arg"]["image_id"], self.image_id)
+        self.assertIsInstance(message["arg"]["image_data"], bytes)
+        with open(self.path, "rb") as file:
+            self.assertEqual(message["arg"]["image_data"], file.read())
+        self.assertEqual(message["arg"]["coordinates"]["up_left"], {"lat": 58.001, "long": 15.0})
+        self.assertEqual(message["arg"]["force_que_id"], 0)
+
+        self.assertEqual((thumbnail["arg"]["width"], thumbnail["arg"]["height"]), (256, 128))
+        with PIL_image.open(io.BytesIO(thumbnail["arg"]["image_data"])) as decoded:
+            self.assertEqual(decoded.size, (256, 128))
+        self.assertIn(image_key(self.image_id, "thumbnail"), self.cache)
+
+        # Served from the cache after the file is gone.
+        os.rename(self.path, self.path + ".moved")
+        try:
+            with session_scope() as session:
+                self.assertEqual(image_message(session, self.image_id, cache=self.cache)["arg"]["image_data"],
+                                 message["arg"]["image_data"])
+        finally:
+            os.rename(self.path + ".moved", self.path)
+
+    def test_stored_rendition(self):
+        file_name = rendition_file_name(os.path.basename(self.path), "half")
+        path = get_path_from_root("/IMM/images/") + file_name
+        PIL_image.new("RGB", (512, 256), (1, 2, 3)).save(path)
+        try:
+            with session_scope() as session:
+                session.add(ImageRendition(image_id=self.image_id, rendition="half", file_name=file_name,
+                                           width=512, height=256, size=os.path.getsize(path)))
+            with session_scope() as session:
+                message = image_message(session, self.image_id, "half", cache=self.cache)
+            with open(path, "rb") as file:
+                self.assertEqual(message["arg"]["image_data"], file.read())
+        finally:
+            os.remove(path)
+
+
+class PrioSchedulerTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="MAN"))
+            session.add(UserSession(start_time=2, drone_mode="MAN"))
+            session.add(PrioImage(id=7, session_id=1, time_requested=1, status="DELIVERED",
+                                  coordinate=Coordinate(0, 0)))
+        self.scheduler = PrioScheduler()
+
+    def statuses(self):
+        with session_scope() as session:
+            return {prio_image.id: prio_image.status for prio_image in session.query(PrioImage)}
+
+    def test_ids_and_persistence(self):
+        self.assertEqual(self.scheduler.submit(1, Coordinate(58, 16)), 8, "Ids not seeded from the largest id.")
+        self.assertEqual(self.scheduler.submit_many(2, [Coordinate(58, 16), Coordinate(59, 17)]), [9, 10])
+        with session_scope() as session:
+            prio_image = session.query(PrioImage).get(9)
+            self.assertEqual(prio_image.session_id, 2)
+            self.assertEqual(prio_image.status, "PENDING")
+            self.assertEqual(prio_image.coordinate, Coordinate(58, 16))
+
+    def test_writer(self):
+        use_test_database(in_memory=False)
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="MAN"))
+        writer = DatabaseWriterThread(batch_window=0.01)
+        writer.start()
+        try:
+            self.assertEqual(PrioScheduler(writer).submit_many(1, [Coordinate(58, 16), Coordinate(59, 17)]), [1, 2])
+        finally:
+            writer.stop()
+            writer.join(5)
+        self.assertEqual(self.statuses(), {1: "PENDING", 2: "PENDING"})
+
+    def test_order(self):
+        low = self.scheduler.submit(1, Coordinate(1, 1), priority=PRIO_LOW)
+        first = self.scheduler.submit(1, Coordinate(2, 2))
+        second = self.scheduler.submit(2, Coordinate(3, 3))
+        self.assertEqual(len(self.scheduler), 3)
+        popped = [self.scheduler.pop() for _i in range(3)]
+        self.assertEqual([request.force_que_id for request in popped], [first, second, low])
+        self.assertEqual(popped[0].coordinate, Coordinate(2, 2))
+        self.assertIsNone(self.scheduler.pop())
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_clear_queue(self):
+        sent = self.scheduler.submit(1, Coordinate(1, 1))
+        self.scheduler.pop()
+        self.scheduler.submit_many(1, [Coordinate(2, 2), Coordinate(3, 3)])
+        other = self.scheduler.submit(2, Coordinate(4, 4))
+        self.assertEqual(self.scheduler.pending(1), 2)
+
+        self.assertEqual(self.scheduler.clear_queue(1), 3)
+        self.assertEqual(self.scheduler.pending(1), 0)
+        self.assertEqual(self.scheduler.pending(2), 1)
+        self.assertEqual(self.scheduler.pop().force_que_id, other, "Cancelled request popped.")
+        self.assertIsNone(self.scheduler.pop())
+
+        statuses = self.statuses()
+        self.assertEqual(statuses[7], "DELIVERED")
+        self.assertEqual(statuses[sent], "CANCELLED")
+        self.assertEqual(statuses[other], "PENDING")
+
+        after = self.scheduler.submit(1, Coordinate(5, 5))
+        self.assertGreater(after, other)
+        self.assertEqual(self.scheduler.pop().force_que_id, after)
+
+    def test_concurrent_submit(self):
+        ids = []
+
+        def submit():
+            ids.extend(self.scheduler.submit(1, Coordinate(i, i)) for i in range(20))
+
+        use_test_database(in_memory=False)
+        self.addCleanup(use_test_database)
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="MAN"))
+        threads = [Thread(target=submit) for _i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(ids), list(range(1, 81)))
+        self.assertEqual(len(self.statuses()), 80)
+
+
+class PrioMatchingTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+        invalidate_pending_prio_images()
+        self.add_rows()
+        self.footprint = [(58.1, 16.0), (58.1, 16.1), (58.0, 16.1), (58.0, 16.0)]
+
+    def add_rows(self):
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="MAN"))
+            session.add(UserSession(start_time=2, drone_mode="MAN"))
+            session.add(_image_from_json(1, 10, _rectangle_json(58.0, 16.0, 58.1, 16.1)))
+            session.add(_image_from_json(1, 20, _rectangle_json(58.0, 16.0, 58.1, 16.1)))
+            for prio_id, session_id, status, lat, long in [
+                    (1, 1, "PENDING", 58.05, 16.05), (2, 1, "PENDING", 58.09, 16.01),
+                    (3, 1, "PENDING", 58.2, 16.05), (4, 1, "CANCELLED", 58.05, 16.05),
+                    (5, 2, "PENDING", 58.05, 16.05)]:
+                session.add(PrioImage(id=prio_id, session_id=session_id, time_requested=1, status=status,
+                                      coordinate=Coordinate(lat, long)))
+
+    def prio_images(self):
+        with session_scope() as session:
+            return {prio_id: (status, image_id) for prio_id, status, image_id in
+                    session.query(PrioImage.id, PrioImage.status, PrioImage.image_id)}
+
+    def test_match(self):
+        self.assertEqual(sorted(match_pending_prio_images(1, self.footprint)), [1, 2])
+        self.assertEqual(match_pending_prio_images(2, self.footprint), [5])
+        diamond = [(58.1, 16.05), (58.05, 16.1), (58.0, 16.05), (58.05, 16.0)]
+        self.assertEqual(match_pending_prio_images(1, diamond), [1], "Point outside the footprint matched.")
+        view = coordinates_from_json(_rectangle_json(58.15, 16.0, 58.25, 16.1))
+        self.assertEqual(match_pending_prio_images(1, [view[corner] for corner in CORNERS]), [3])
+
+    def test_deliver(self):
+        self.assertEqual(sorted(deliver_prio_images(1, 1, self.footprint)), [1, 2])
+        self.assertEqual(deliver_prio_images(1, 2, self.footprint), [], "Request delivered twice.")
+        prio_images = self.prio_images()
+        self.assertEqual(prio_images[1], ("DELIVERED", 1))
+        self.assertEqual(prio_images[2], ("DELIVERED", 1))
+        self.assertEqual(prio_images[3], ("PENDING", None))
+        self.assertEqual(prio_images[4], ("CANCELLED", None))
+        self.assertEqual(prio_images[5], ("PENDING", None))
+
+    def test_force_que_id(self):
+        self.assertEqual(sorted(deliver_prio_images(1, 1, self.footprint, force_que_id=3)), [1, 2, 3])
+        self.assertEqual(deliver_prio_images(1, 1, self.footprint, force_que_id=4), [],
+            "Cancelled request delivered.")
+
+    def test_new_and_cancelled_requests(self):
+        self.assertEqual(sorted(match_pending_prio_images(1, self.footprint)), [1, 2])
+        scheduler = PrioScheduler()
+        new_id = scheduler.submit(1, Coordinate(58.02, 16.02))
+        self.assertEqual(sorted(match_pending_prio_images(1, self.footprint)), [1, 2, new_id])
+        scheduler.clear_queue(1)
+        self.assertEqual(match_pending_prio_images(1, self.footprint), [])
+        self.assertEqual(match_pending_prio_images(2, self.footprint), [5])
+
+    def test_stale_cache(self):
+        self.assertEqual(sorted(match_pending_prio_images(1, self.footprint)), [1, 2])
+        with session_scope() as session:
+            # Delivered without the ORM, so the cached points are out of date.
+            session.execute("UPDATE prio_images SET status = 'DELIVERED', image_id = 2 WHERE id = 1")
+        self.assertEqual(deliver_prio_images(1, 1, self.footprint), [2], "Delivered request reported again.")
+        self.assertEqual(self.prio_images()[1], ("DELIVERED", 2))
+        self.assertEqual(match_pending_prio_images(1, self.footprint), [])
+
+    def test_deliver_with_writer(self):
+        use_test_database(in_memory=False)
+        invalidate_pending_prio_images()
+        self.add_rows()
+        writer = DatabaseWriterThread(batch_window=0.01)
+        writer.start()
+        try:
+            self.assertEqual(sorted(deliver_prio_images(1, 1, self.footprint, writer=writer)), [1, 2])
+            invalidate_pending_prio_images()
+            self.assertEqual(deliver_prio_images(1, 2, self.footprint, force_que_id=1, writer=writer), [])
+        finally:
+            writer.stop()
+            writer.join(5)
+        self.assertEqual(self.prio_images()[2], ("DELIVERED", 1))
+
+    def test_many_points(self):
+        points = numpy.random.default_rng(5).uniform([57.5, 15.5], [58.5, 16.5], (500, 2))
+        with session_scope() as session:
+            session.add_all([PrioImage(id=100 + i, session_id=2, time_requested=1, status="PENDING",
+                                       coordinate=Coordinate(lat, long)) for i, (lat, long) in enumerate(points)])
+        inside = (points[:, 0] >= 58.0) & (points[:, 0] <= 58.1) & (points[:, 1] >= 16.0) & (points[:, 1] <= 16.1)
+        expected = sorted([5] + [100 + i for i in numpy.flatnonzero(inside)])
+        self.assertEqual(sorted(deliver_prio_images(2, 2, self.footprint)), expected)
+        self.assertEqual(sum(status == "DELIVERED" for status, _image_id in self.prio_images().values()),
+                         len(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@
 from IMM.threads.thread_rds_pub import RDSPubThread
 from IMM.threads.thread_rds_sub import RDSSubThread
 from IMM.threads.thread_gui_pub import GUIPubThread
+from IMM.threads.thread_db_writer import DatabaseWriterThread
 
 
 class ThreadHandler():
@@ -9,11 +10,13 @@ class ThreadHandler():
 
     def __init__(self):
         super().__init__()
+        self.db_writer_thread = DatabaseWriterThread()
         self.rds_pub_thread = RDSPubThread(self)
         self.gui_pub_thread = GUIPubThread(self)
         self.rds_sub_thread = RDSSubThread(self)
 
     def start_threads(self):
+        self.db_writer_thread.start()
         self.rds_pub_thread.start()
         self.rds_sub_thread.start()
         self.gui_pub_thread.start()
@@ -22,6 +25,7 @@ class ThreadHandler():
         self.rds_pub_thread.stop()
         self.rds_sub_thread.stop()
         self.gui_pub_thread.stop()
+        self.db_writer_thread.stop()
 
     def get_rds_pub_thread(self):
         return self.rds_pub_thread
@@ -32,3 +36,6 @@ class ThreadHandler():
     def get_gui_pub_thread(self):
         return self.gui_pub_thread
 
+    def get_db_writer_thread(self):
+        return self.db_writer_thread
+
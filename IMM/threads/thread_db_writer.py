@@ -0,0 +1,192 @@
+from threading import Thread, Condition
+from concurrent.futures import Future
+from collections import deque
+from IMM_database.database import session_scope, update_rows, bulk_insert
+import time
+
+
+class _Insert:
+    """A pending insert of ORM objects.
+
+    Consecutive inserts of a batch are applied together by bulk_insert, see
+    DatabaseWriterThread.__commit.
+    """
+
+    def __init__(self, objects, single=True):
+        self.objects = objects
+        self.single = single
+        self.future = Future()
+
+    def apply(self, session):
+        bulk_insert(session, self.objects)
+
+    def result(self, session):
+        ids = [obj.id for obj in self.objects]
+        return ids[0] if self.single else ids
+
+
+class _Update:
+    """A pending update of the row with a given id, optionally only if it matches a condition."""
+
+    def __init__(self, model, row_id, values, condition=None):
+        self.model = model
+        self.row_id = row_id
+        self.values = values
+        self.condition = condition
+        self.future = Future()
+        self.rowcount = 0
+
+    def apply(self, session):
+        query = session.query(self.model).filter(self.model.id == self.row_id)
+        if self.condition is not None:
+            query = query.filter(self.condition)
+        self.rowcount = query.update(self.values, synchronize_session=False)
+
+    def result(self, session):
+        return self.rowcount
+
+
+class _BulkUpdate:
+    """A pending update of the rows with given ids, see update_rows."""
+
+    def __init__(self, model, row_ids, values, condition=None):
+        self.model = model
+        self.row_ids = row_ids
+        self.values = values
+        self.condition = condition
+        self.future = Future()
+        self.updated = []
+
+    def apply(self, session):
+        self.updated = update_rows(session, self.model, self.row_ids, self.values, self.condition)
+
+    def result(self, session):
+        return self.updated
+
+
+class DatabaseWriterThread(Thread):
+    """This thread performs all ingest writes to the database in group commits
+
+    SQLite only allows one writer at a time and every commit costs a sync to
+    disk. Instead of commiting each image on its own, pending inserts and
+    updates are collected for up to batch_window seconds (or until batch_size
+    are pending) and commited in a single transaction. Consecutive inserts
+    are written with bulk_insert, i.e. bulk_save_objects, instead of the unit
+    of work of the ORM session. Callers get a Future
+    which resolves to the new id (inserts) or the number of updated rows
+    (updates) once the transaction is commited.
+    """
+
+    def __init__(self, batch_window=0.05, batch_size=200):
+        super().__init__(daemon=True)
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.pending = deque()
+        self.condition = Condition()
+        self.commits = 0
+        self.running = True
+
+    def submit_insert(self, obj):
+        """Queue an ORM object for insertion and return a Future resolving to its id."""
+        return self.__submit(_Insert([obj]))
+
+    def submit_insert_all(self, objects):
+        """Queue ORM objects for insertion in the same transaction.
+
+        Returns a Future resolving to the list of their ids.
+        """
+        return self.__submit(_Insert(list(objects), single=False))
+
+    def submit_update(self, model, row_id, values, condition=None):
+        """Queue an update of the model row with id row_id.
+
+        Returns a Future resolving to the number of updated rows.
+
+        model       The ORM class of the row, e.g. PrioImage.
+        row_id      The primary key of the row.
+        values      A dict mapping attributes to new values.
+        condition   If given, an SQL expression the row must also match to be
+                    updated, e.g. PrioImage.status == "PENDING".
+        """
+        return self.__submit(_Update(model, row_id, values, condition))
+
+    def submit_bulk_update(self, model, row_ids, values, condition=None):
+        """Queue an update of the model rows with ids in row_ids.
+
+        Returns a Future resolving to the list of ids of the updated rows. The
+        arguments are those of submit_update, but with a sequence of ids.
+        """
+        return self.__submit(_BulkUpdate(model, list(row_ids), values, condition))
+
+    def __submit(self, operation):
+        with self.condition:
+            if not self.running:
+                raise RuntimeError("Database writer is stopped")
+            self.pending.append(operation)
+            self.condition.notify()
+        return operation.future
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if not batch:
+                break
+            self.write(batch)
+
+    def next_batch(self):
+        """Block until operations are pending and return them after the batch window.
+
+        Returns an empty list once the thread is stopped and nothing is pending.
+        """
+        with self.condition:
+            while self.running and not self.pending:
+                self.condition.wait()
+            deadline = time.monotonic() + self.batch_window
+            while self.running and len(self.pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = [self.pending.popleft() for _i in range(min(len(self.pending), self.batch_size))]
+        return batch
+
+    def write(self, batch):
+        """Commit all operations in batch in one transaction.
+
+        If the transaction fails, the operations are retried one by one so that
+        a single invalid row does not fail the rest of the batch.
+        """
+        try:
+            self.__commit(batch)
+        except Exception:
+            for operation in batch:
+                try:
+                    self.__commit([operation])
+                except Exception as e:
+                    operation.future.set_exception(e)
+
+    def __commit(self, batch):
+        with session_scope() as session:
+            inserts = []
+            for operation in batch:
+                if isinstance(operation, _Insert):
+                    inserts.extend(operation.objects)
+                    continue
+                # Rows are inserted before later operations of the batch, which may update them.
+                if inserts:
+                    bulk_insert(session, inserts)
+                    inserts = []
+                operation.apply(session)
+            if inserts:
+                bulk_insert(session, inserts)
+            session.flush()
+            results = [operation.result(session) for operation in batch]
+        self.commits += 1
+        for operation, result in zip(batch, results):
+            operation.future.set_result(result)
+
+    def stop(self):
+        """Stop the thread once all pending operations are written."""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
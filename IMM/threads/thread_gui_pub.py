@@ -1,33 +1,139 @@
-from threading import Thread
+from threading import Thread, Condition
+from collections import deque
 from helper_functions import check_request
-import json
+import time
+
+# Policies used when a notification arrives while the queue is full.
+DROP_OLDEST = "drop_oldest"   # Discard the oldest pending notification.
+DROP_NEWEST = "drop_newest"   # Discard the incoming notification.
+MERGE = "merge"               # Replace the latest pending new_pic of the same room and type.
+
+
+def session_room(session_id):
+    """Return the name of the Socket.IO room of the clients of a UserSession."""
+    return "session-" + str(session_id)
 
 
 class GUIPubThread(Thread):
-    """This thread sends data to the GUI"""
+    """This thread sends data to the GUI
 
-    def __init__(self, thread_handler):
+    Notifications are collected in a bounded queue. The thread blocks until a
+    notification arrives, then waits at most batch_window seconds (or until
+    batch_size notifications are pending) and sends all pending new_pic
+    notifications as one emit per Socket.IO room. The room of a notification
+    is given by its "room" key, see session_room. Notifications without a room
+    are batched together and sent to all clients.
+    """
+
+    def __init__(self, thread_handler, max_pending=1000, batch_window=0.05, batch_size=50,
+                 overflow_policy=DROP_OLDEST):
         super().__init__()
-        self.request_queue = []
+        if overflow_policy not in (DROP_OLDEST, DROP_NEWEST, MERGE):
+            raise ValueError("Unknown overflow policy: " + str(overflow_policy))
+        self.thread_handler = thread_handler
+        self.socketio = None
+        self.max_pending = max_pending
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.overflow_policy = overflow_policy
+        self.request_queue = deque()
+        self.condition = Condition()
+        self.dropped = 0
+        self.merged = 0
         self.running = True
 
+    def set_socketio(self, socketio):
+        """Set the Socket.IO server used to notify the clients."""
+        self.socketio = socketio
+
     def run(self):
         while self.running:
-            if len(self.request_queue) > 0:
-                request = self.request_queue.pop(0)
-                check_request(request)
-                if request["IMM_fcn"] == "send_to_gui":
-                    self.send_to_gui(request["arg"])
+            batch = self.next_batch()
+            if batch:
+                self.send_batch(batch)
 
-    def send_to_gui(self, param):
-        #socketio.emit("response", data_to_send, room = correct_session_room)
+    def next_batch(self):
+        """Block until notifications are pending and return them after the batch window."""
+        with self.condition:
+            while self.running and not self.request_queue:
+                self.condition.wait()
+            deadline = time.monotonic() + self.batch_window
+            while self.running and len(self.request_queue) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = list(self.request_queue)
+            self.request_queue.clear()
+        return batch
 
-        # old - self.gui_pub_socket.send_json(json.dumps(param))
-        # old - resp = self.gui_pub_socket.recv_json()
-        print("Notify gui")
+    def send_batch(self, batch):
+        """Send new_pic notifications grouped by room, other requests one by one."""
+        rooms = {}
+        for request in batch:
+            check_request(request)
+            if request["IMM_fcn"] != "send_to_gui":
+                continue
+            msg = request["arg"]
+            if msg.get("fcn") == "new_pic":
+                rooms.setdefault(request.get("room"), []).append(msg["arg"])
+            else:
+                self.send_to_gui(msg, request.get("room"))
+
+        for room, pics in rooms.items():
+            if len(pics) == 1:
+                self.send_to_gui({"fcn": "new_pic", "arg": pics[0]}, room)
+            else:
+                self.send_to_gui({"fcn": "new_pics", "arg": {"images": pics}}, room)
+
+    def send_to_gui(self, param, room=None):
+        """Emit a notification to all clients in room, or to all clients if room is None."""
+        if self.socketio is None:
+            return
+        self.socketio.emit("notify", param, room=room)
 
     def add_request(self, request):
-        self.request_queue.append(request)
+        """Queue a request, applying the overflow policy if the queue is full.
+
+        Returns False if a notification was discarded, else True.
+        """
+        with self.condition:
+            accepted = True
+            if len(self.request_queue) >= self.max_pending:
+                if self.overflow_policy == MERGE and self.__merge(request):
+                    self.merged += 1
+                    return True
+                if self.overflow_policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                self.request_queue.popleft()
+                self.dropped += 1
+                accepted = False
+            self.request_queue.append(request)
+            self.condition.notify()
+            return accepted
+
+    def __merge(self, request):
+        """Replace the latest pending new_pic with the same room and type by request."""
+        msg = request.get("arg", {})
+        if msg.get("fcn") != "new_pic" or msg["arg"].get("prioritized"):
+            return False
+        for i in range(len(self.request_queue) - 1, -1, -1):
+            pending = self.request_queue[i]
+            pending_msg = pending.get("arg", {})
+            if pending_msg.get("fcn") == "new_pic" and pending.get("room") == request.get("room") \
+                    and not pending_msg["arg"].get("prioritized") \
+                    and pending_msg["arg"].get("type") == msg["arg"].get("type"):
+                self.request_queue[i] = request
+                return True
+        return False
+
+    def get_queue_stats(self):
+        """Return the number of pending, dropped and merged notifications."""
+        with self.condition:
+            return {"depth": len(self.request_queue), "dropped": self.dropped, "merged": self.merged}
 
     def stop(self):
-        self.running = False
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
@@ -0,0 +1,116 @@
+from threading import Thread, Condition
+from collections import deque
+
+
+class IngestRing:
+    """Bounded in-memory buffer between the RDS receive loop and the ingest workers.
+
+    put() blocks while the ring is full, which throttles the receive loop
+    instead of letting frames pile up in memory. get() blocks until a frame
+    is available or the ring is closed.
+    """
+
+    def __init__(self, capacity):
+        """IngestRing constructor.
+
+        capacity    The maximum number of frames held by the ring.
+        """
+        if capacity < 1:
+            raise ValueError("Ring capacity must be at least 1")
+        self.capacity = capacity
+        self.__items = deque()
+        self.__condition = Condition()
+        self.__closed = False
+        self.__high_watermark = 0
+        self.__total = 0
+        self.__failed = 0
+        self.__last_error = None
+
+    def put(self, item):
+        """Add an item, blocking while the ring is full. Returns False if the ring is closed."""
+        with self.__condition:
+            while len(self.__items) >= self.capacity and not self.__closed:
+                self.__condition.wait()
+            if self.__closed:
+                return False
+            self.__items.append(item)
+            self.__total += 1
+            self.__high_watermark = max(self.__high_watermark, len(self.__items))
+            self.__condition.notify_all()
+            return True
+
+    def get(self):
+        """Remove and return the oldest item, or None once the ring is closed and empty."""
+        with self.__condition:
+            while not self.__items and not self.__closed:
+                self.__condition.wait()
+            if not self.__items:
+                return None
+            item = self.__items.popleft()
+            self.__condition.notify_all()
+            return item
+
+    def close(self):
+        """Stop accepting items and wake up all waiting threads.
+
+        Items already in the ring are still handed out by get().
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    def record_failure(self, error):
+        """Count an item whose ingest raised error."""
+        with self.__condition:
+            self.__failed += 1
+            self.__last_error = repr(error)
+
+    def fill(self):
+        """Return how full the ring is, as a fraction between 0 and 1."""
+        with self.__condition:
+            return len(self.__items) / self.capacity
+
+    def stats(self):
+        """Return a dict with the current depth, fill ratio, high watermark and total count.
+
+        failed counts the items whose ingest raised an exception, and
+        last_error is the repr of the latest such exception, or None.
+        """
+        with self.__condition:
+            return {
+                "depth": len(self.__items),
+                "capacity": self.capacity,
+                "fill": len(self.__items) / self.capacity,
+                "high_watermark": self.__high_watermark,
+                "total": self.__total,
+                "failed": self.__failed,
+                "last_error": self.__last_error,
+            }
+
+
+class IngestWorkerThread(Thread):
+    """Takes received frames from an IngestRing and runs the heavy ingest stages on them.
+
+    An item whose handler raises is counted as failed in the ring stats, and
+    the worker goes on with the next item.
+    """
+
+    def __init__(self, ring, handler):
+        """IngestWorkerThread constructor.
+
+        ring        The IngestRing to consume.
+        handler     Callable run for every item taken from the ring.
+        """
+        super().__init__(daemon=True)
+        self.ring = ring
+        self.handler = handler
+
+    def run(self):
+        while True:
+            item = self.ring.get()
+            if item is None:
+                break
+            try:
+                self.handler(*item)
+            except Exception as e:
+                self.ring.record_failure(e)
@@ -2,8 +2,34 @@ from IMM.IMM_thread_config import context, zmq, RDS_req_socket_url, RDS_pub_sock
 from threading import Thread
 #from IMM.thread_handler import ThreadHandler
 from helper_functions import check_request
+from IMM.request_queue import RequestQueue, PRIO_HIGH, PRIO_NORMAL, PRIO_LOW
+from IMM.prio_scheduler import PrioScheduler
 import json
-import random
+import time
+
+# Time in seconds between the regular updates (get_info, queue_eta etc).
+UPDATE_INTERVAL = 1.0
+
+# While the RDS doesn't reply, the interval is doubled after every update, up to this many seconds.
+MAX_UPDATE_INTERVAL = 30.0
+
+# Time in milliseconds to wait for the RDS to reply on the request link.
+RDS_REPLY_TIMEOUT = 1000
+
+
+def request_priority(request):
+    """Return the priority class a request should be dispatched with.
+
+    Mode changes, quitting and prioritized views overtake plain points of
+    interest, which may arrive in large numbers while an operator pans the map.
+    """
+    fcn = request.get("fcn")
+    if fcn in ("quit", "set_mode", "set_area", "clear_que"):
+        return PRIO_HIGH
+    if fcn == "request_POI":
+        arg = request.get("arg") or {}
+        return PRIO_HIGH if arg.get("prio") else PRIO_LOW
+    return PRIO_NORMAL
 
 
 class RDSPubThread(Thread):
@@ -16,14 +42,19 @@ class RDSPubThread(Thread):
         self.RDS_req_socket.connect(RDS_req_socket_url)
         self.RDS_pub_socket.connect(RDS_pub_socket_url)
         self.thread_handler = thread_handler
-        self.request_queue = []
+        self.request_queue = RequestQueue()
+        self.prio_scheduler = PrioScheduler(thread_handler.get_db_writer_thread() if thread_handler else None)
         self.running = True
+        self.next_update = time.monotonic()
+        self.update_interval = UPDATE_INTERVAL
+        self.queue_eta = None
 
     def run(self):
         while self.running:
-            if len(self.request_queue) > 0:
-                request = self.request_queue.pop(0)
+            timeout = max(0.0, self.next_update - time.monotonic())
+            request = self.request_queue.get(timeout=timeout)
 
+            if request is not None:
                 check_request(request)
 
                 if request["fcn"] == "set_area":
@@ -35,28 +66,95 @@ class RDSPubThread(Thread):
                 elif request["fcn"] == "set_mode":
                     self.set_mode(request)
 
+                elif request["fcn"] == "clear_que":
+                    self.clear_que()
+
                 elif request["fcn"] == "quit":
                     self.quit()
 
-            # do regular update stuff below (get_info() que_eta etc)
+            if self.running and time.monotonic() >= self.next_update:
+                self.regular_update()
+                self.next_update = time.monotonic() + self.update_interval
 
     def add_request(self, request):
-        self.request_queue.append(request)
+        self.request_queue.put(request, request_priority(request))
+
+    def request_priority_poi(self, session_id, coordinate, client_id=None):
+        """Schedule a prioritized point of interest and return its force_que_id.
+
+        The request is sent to the RDS by the thread, in the order decided by
+        the prio scheduler.
+        """
+        force_que_id = self.prio_scheduler.submit(session_id, coordinate, client_id=client_id)
+        self.add_request({"fcn": "request_POI", "arg": {"prio": True}})
+        return force_que_id
+
+    def clear_prio_queue(self, session_id):
+        """Cancel the pending prioritized requests of a session and tell the RDS to clear its queue."""
+        self.prio_scheduler.clear_queue(session_id)
+        self.add_request({"fcn": "clear_que"})
+
+    def get_queue_stats(self):
+        """Return the depth and wait time counters of the request queue."""
+        return self.request_queue.stats()
+
+    def regular_update(self):
+        """Fetch information that is regularly polled from the RDS.
+
+        Polls the time in seconds until the next image of the RDS queue. It is
+        kept in queue_eta, which is None while the RDS does not reply or
+        doesn't know. While the RDS does not reply, update_interval backs off
+        so that client requests don't wait for timed out polls.
+        """
+        resp = self.request_rds({"fcn": "queue_eta"})
+        if resp is None:
+            self.queue_eta = None
+            self.update_interval = min(2 * self.update_interval, MAX_UPDATE_INTERVAL)
+            return
+        self.update_interval = UPDATE_INTERVAL
+        self.queue_eta = None
+        if resp.get("fcn") == "ack" and "arg2" in resp:
+            try:
+                self.queue_eta = int(float(resp["arg2"]))
+            except (TypeError, ValueError):
+                pass
+
+    def request_rds(self, request):
+        """Send a request on the RDS request link and return the reply, or None on timeout.
+
+        A REQ socket can't send again before it has received a reply, so the
+        socket is replaced if the RDS doesn't reply within RDS_REPLY_TIMEOUT.
+        """
+        self.RDS_req_socket.send_json(json.dumps(request))
+        if self.RDS_req_socket.poll(RDS_REPLY_TIMEOUT):
+            return self.RDS_req_socket.recv_json()
+        self.RDS_req_socket.close(linger=0)
+        self.RDS_req_socket = context.socket(zmq.REQ)
+        self.RDS_req_socket.connect(RDS_req_socket_url)
+        return None
 
     def request_poi(self, poi):
         """Requests a point of interest from the RDS
 
+        A prioritized point of interest sends the most urgent request of the
+        prio scheduler instead, see request_priority_poi. Nothing is sent if
+        that request has been cancelled.
+
         :param poi: Point of interest.
         :return The response message
         """
-        #  TODO: Evolve this
         request = {"fcn": "add_poi"}
         request_args = {"client_id": 1, "force_que_id": 0}
 
         if poi["prio"]:
-            request_args["force_que_id"] = random.randint()  # TODO: Guarantee that the number is unique
-
-        request_args["coordinates"] = poi["coordinates"]
+            prio_request = self.prio_scheduler.pop()
+            if prio_request is None:
+                return
+            request_args["force_que_id"] = prio_request.force_que_id
+            request_args["client_id"] = prio_request.client_id or 1
+            request_args["coordinates"] = {"lat": prio_request.coordinate.lat, "long": prio_request.coordinate.long}
+        else:
+            request_args["coordinates"] = poi["coordinates"]
         request["arg"] = request_args
         try:
             self.RDS_pub_socket.send_json(json.dumps(request))
@@ -68,17 +166,20 @@ class RDSPubThread(Thread):
         #TODO: Define this.
         pass
 
+    def clear_que(self):
+        """Ask the RDS to clear its image queue. Returns False if the RDS didn't reply."""
+        return self.request_rds({"fcn": "clear_que", "arg": ""}) is not None
+
     def set_mode(self, request):
-        #TODO: Define this
-        self.RDS_req_socket.send_json(json.dumps(request))
-        resp = self.RDS_req_socket.recv()
+        """Forward a set_mode request to the RDS. Returns False if the RDS didn't reply."""
+        return self.request_rds(request) is not None
 
     def quit(self):
-        request = {"fcn":"quit", "arg": ""}
-        self.RDS_req_socket.send_json(request)
-        resp = self.RDS_req_socket.recv()
+        """Tell the RDS that the IMM quits. Returns False if the RDS didn't reply."""
+        return self.request_rds({"fcn": "quit", "arg": ""}) is not None
 
     def stop(self):
         self.running = False
+        self.request_queue.close()
 
 
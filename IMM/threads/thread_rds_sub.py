@@ -1,56 +1,100 @@
-import numpy, time
-from PIL import Image as PIL_image
+import numpy, os, time
 from IMM.IMM_thread_config import context, zmq, RDS_sub_socket_url
-from threading import Thread
+from IMM.threads.thread_ingest import IngestRing, IngestWorkerThread
+from IMM.threads.thread_gui_pub import session_room
+from IMM.image_encoder import create_encoder
+from IMM.image_naming import ImageNameAllocator
+from IMM.tiling import TileRenderer
+from IMM.image_payloads import payload_cache
+from IMM.prio_matching import deliver_prio_images
+from IMM.renditions import downscale_renditions, rendition_file_name
+from IMM.view_query import CORNERS
+from threading import Thread, Lock
 
 from helper_functions import check_request
-from IMM_database.database import Image, PrioImage, session_scope, UserSession, Coordinate
+from IMM_database.database import Image, ImageRendition, session_scope, UserSession, Coordinate
+from IMM_database.database import get_active_session_id, read_scope
 from helper_functions import get_path_from_root
-import json, datetime
+import json
+
+
+image_name_allocator = ImageNameAllocator()
 
 
 def generate_image_name(timestamp):
-    with session_scope() as session:
-        count = session.query(Image).filter_by(time_taken=timestamp).count()
-    readable_time = datetime.datetime.fromtimestamp(timestamp)
-    image_datetime = readable_time.strftime("%Y-%m-%d_%H-%M-%S")
-    image_name = image_datetime + "_(" + str(count) + ")" + ".jpg"
-    return image_name
+    return image_name_allocator.next_name(timestamp)
+
+
+# Backend used to encode received images, see IMM.image_encoder.
+image_encoder = create_encoder("thread")
+
+
+def set_image_encoder(encoder):
+    """Replace the encoder backend used by save_image."""
+    global image_encoder
+    old_encoder = image_encoder
+    image_encoder = encoder
+    old_encoder.shutdown()
 
 
 def save_image(new_pic):
-    # TODO: Organize how the images are saved
-    jpg_image = PIL_image.fromarray(new_pic)
+    """Save a received image and its downscaled renditions.
+
+    All files are encoded concurrently by the image encoder. Returns a tuple
+    (timestamp, image_name, renditions) where renditions is a list of dicts
+    with the ImageRendition attributes of each downscaled rendition.
+    """
     timestamp = int(time.time())
     image_name = generate_image_name(timestamp)
-    image_path = get_path_from_root("/IMM/images/") + image_name
-    jpg_image.save(image_path)
-    return timestamp, image_name
+    image_dir = get_path_from_root("/IMM/images/")
+    futures = [image_encoder.submit(new_pic, image_dir + image_name)]
+    renditions = []
+    for rendition, array in downscale_renditions(new_pic):
+        file_name = rendition_file_name(image_name, rendition)
+        futures.append(image_encoder.submit(array, image_dir + file_name))
+        renditions.append({"rendition": rendition, "file_name": file_name,
+                           "width": array.shape[1], "height": array.shape[0]})
+    for future in futures:
+        future.result()
+    for rendition in renditions:
+        rendition["size"] = os.path.getsize(image_dir + rendition["file_name"])
+    return timestamp, image_name, renditions
 
 
 def get_session_id():
-    pass
+    """Return the id of the active UserSession, creating a dummy session if there is none."""
+    session_id = get_active_session_id()
+    if session_id is None:
+        session_id = get_dummy_session_id()
+    return session_id
+
 
+__dummy_session_mutex = Lock()
 
 def get_dummy_session_id():
-    session_id = 1
-    with session_scope() as session:
-        if session.query(UserSession).count() == 0:
-            dummy_session = UserSession(start_time=100, drone_mode="AUTO")
-            session.add(dummy_session)
+    with __dummy_session_mutex:
+        # Another thread may have created the session while we waited.
+        if get_active_session_id() is None:
+            with session_scope() as session:
+                dummy_session = UserSession(start_time=100, drone_mode="AUTO")
+                session.add(dummy_session)
 
-    with session_scope() as session:
-        session_id = session.query(UserSession).first().id
+    return get_active_session_id()
 
-    return session_id
 
+def save_to_database(img_arg, new_pic, file_data, writer=None, session_id=None):
+    """Store a received image in the database and return its id.
 
-def save_to_database(img_arg, new_pic, file_data):
+    If writer is given, the insert is handed to that DatabaseWriterThread and
+    a Future resolving to the id is returned instead. The image is stored in
+    the UserSession with id session_id, or in the one of get_session_id().
+    """
 
     def coordinate_from_json(json):
         return Coordinate(lat=json["lat"], long=json["long"])
 
-    session_id = get_dummy_session_id()
+    if session_id is None:
+        session_id = get_session_id()
 
     # Gather image info
     width = len(new_pic[0])
@@ -73,67 +117,140 @@ def save_to_database(img_arg, new_pic, file_data):
         up_right=up_right,
         down_right=down_right,
         down_left=down_left,
-        center=center
+        center=center,
+        renditions=[ImageRendition(**rendition) for rendition in file_data[2]]
     )
 
+    if writer is not None:
+        return writer.submit_insert(image)
+
     with session_scope() as session:
         session.add(image)
+        session.flush()
+        return image.id
 
 
-def match_image_to_tile(img_file_name):
-    # This function might be heavy work so maybe it should run in a worker thread.
+# Renders received images into the slippy map tile pyramid, see IMM.tiling.
+tile_renderer = TileRenderer()
+tile_renderer.add_listener(payload_cache.invalidate_tile)
 
-    with session_scope() as session:
-        image = session.query(Image).filter_by(file_name=img_file_name).first()
 
-    i=0
+def match_image_to_tile(img_file_name, new_pic):
+    """Render a stored image into the tile pyramid on the tile worker pool.
+
+    Returns a Future resolving to the list of (zoom, x, y) tiles touched, or
+    None if there is no image with the given file name.
+    """
+    with read_scope() as session:
+        row = session.query(Image.time_taken, *[getattr(Image, corner) for corner in CORNERS]).\
+            filter(Image.file_name == img_file_name).first()
+    if row is None:
+        return None
+    time_taken, corners = row[0], row[1:]
+    footprint = {corner: (coordinate.lat, coordinate.long) for corner, coordinate in zip(CORNERS, corners)}
+
+    return tile_renderer.submit(new_pic, footprint, time_taken)
 
 
 
 class RDSSubThread(Thread):
-    """This thread subscribes to the RDS and handles the data (mostly images) received from the RDS"""
-    def __init__(self, thread_handler):
+    """This thread subscribes to the RDS and handles the data (mostly images) received from the RDS
+
+    If async_ingest is True, received frames are handed to a bounded IngestRing
+    without copying and the receive loop goes straight back to the socket.
+    Saving, database work and tiling are then done by ingest_workers worker
+    threads. Otherwise every image is processed in the receive loop.
+    """
+    def __init__(self, thread_handler, async_ingest=True, ring_capacity=32, ingest_workers=4):
         super().__init__()
         self.RDS_sub_socket = context.socket(zmq.REP)
         self.RDS_sub_socket.connect(RDS_sub_socket_url)
         self.thread_handler = thread_handler
         self.running = True
+        self.ingest_ring = None
+        self.ingest_workers = []
+        if async_ingest:
+            self.ingest_ring = IngestRing(ring_capacity)
+            self.ingest_workers = [IngestWorkerThread(self.ingest_ring, self.process_image)
+                                   for _i in range(ingest_workers)]
 
     def recv_image_array(self, metadata, flags=0, copy=True, track=False):
-        """Receives and returns the image converted to a numpy array"""
+        """Receives and returns the image converted to a numpy array
+
+        With copy=False the array is a read-only view of the received zmq frame,
+        which is kept alive by the array for as long as it is used.
+        """
         msg = self.RDS_sub_socket.recv(flags=flags, copy=copy, track=track)
         self.RDS_sub_socket.send_json(json.dumps({"msg": "ack"}))
         buf = memoryview(msg)
         image_array = numpy.frombuffer(buf, dtype=metadata["dtype"])
         return image_array.reshape(metadata["shape"])
 
+    def process_image(self, img_arg, new_pic):
+        """Save a received image, store it in the database and notify the GUI."""
+        img_file_data = save_image(new_pic)
+        writer = self.get_db_writer()
+        session_id = get_session_id()
+        image_id = save_to_database(img_arg, new_pic, img_file_data, writer, session_id)
+        if writer is not None:
+            image_id = image_id.result()
+        footprint = [(img_arg["coordinates"][corner]["lat"], img_arg["coordinates"][corner]["long"])
+                     for corner in CORNERS]
+        force_que_ids = deliver_prio_images(session_id, image_id, footprint, img_arg.get("force_que_id", 0), writer)
+        tile_image = match_image_to_tile(img_file_data[1], new_pic)
+        self.send_tile_to_gui(tile_image, image_id, img_arg, force_que_ids, session_id)
+
+    def get_db_writer(self):
+        """Return the DatabaseWriterThread used for group commits, if any."""
+        if self.thread_handler is None:
+            return None
+        return self.thread_handler.get_db_writer_thread()
+
+    def get_ingest_stats(self):
+        """Return the fill level of the ingest ring, or None if images are processed synchronously."""
+        if self.ingest_ring is None:
+            return None
+        return self.ingest_ring.stats()
+
     def run(self):
+        for worker in self.ingest_workers:
+            worker.start()
         while self.running:
-            try:
-                request = self.RDS_sub_socket.recv_json()
-                check_request(request)
-                if "image_md" in request:
-                    # We have a new image
+            request = self.RDS_sub_socket.recv_json()
+            check_request(request)
+            if "image_md" in request:
+                # We have a new image
+                if self.ingest_ring is None:
                     new_pic = self.recv_image_array(request["image_md"])
-                    img_file_data = save_image(new_pic)
-                    save_to_database(request["arg"], new_pic, img_file_data)
-                    tile_image = match_image_to_tile(img_file_data[1])
-                    self.send_tile_to_gui(tile_image)
+                    self.process_image(request["arg"], new_pic)
+                else:
+                    new_pic = self.recv_image_array(request["image_md"], copy=False)
+                    self.ingest_ring.put((request["arg"], new_pic))
 
-            except:
-                raise
+    def send_tile_to_gui(self, tile_image, image_id, img_arg, force_que_ids=(), session_id=None):
+        """Send tile image to gui
 
-    def send_tile_to_gui(self, tile_image):
-        """Send tile image to gui"""
+        force_que_ids are the ids of the PrioImages delivered by the image. The
+        notification is sent to the clients of the UserSession with id
+        session_id, or to all clients if session_id is None.
+        """
 
         # Not sure how we should pass the image tile yet, code below is work in progress
-        msg = {"fcn": "new_pic", "arg": {"image_id": 1}}  # This notify message will change later
-        request = {"IMM_fcn": "send_to_gui", "arg": msg}
+        msg = {"fcn": "new_pic", "arg": {
+            "type": img_arg["type"],
+            "prioritized": bool(force_que_ids) or img_arg.get("force_que_id", 0) != 0,
+            "image_id": image_id,
+            "force_que_ids": list(force_que_ids)
+        }}
+        request = {"IMM_fcn": "send_to_gui", "arg": msg,
+                   "room": session_room(session_id) if session_id is not None else None}
 
         # contact gui pub thread
         self.thread_handler.get_gui_pub_thread().add_request(request)
 
     def stop(self):
+        if self.ingest_ring is not None:
+            self.ingest_ring.close()
         self.RDS_sub_socket.close()
         context.destroy()
         self.running = False
@@ -0,0 +1,208 @@
+"""Slippy map (XYZ) tile pyramid generated from received images.
+
+Tiles follow the standard Web Mercator XYZ scheme used by OpenStreetMap and
+most web map clients. Every received image is cut into the tiles its
+footprint covers at each zoom level of a configurable range, and composited
+on top of the existing tiles so that newer images cover older ones.
+
+The following public functions are provided:
+lat_long_to_tile -- Return the fractional tile coordinates of a point.
+tile_to_lat_long -- Return the lat/long of fractional tile coordinates.
+tiles_for_footprint -- Return the tiles a footprint intersects.
+
+The following public classes are provided:
+TileRenderer -- Renders images into tiles on a dedicated worker pool.
+"""
+import math
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import numpy
+from PIL import Image as PIL_image
+
+from Help_functions.geometry import PreparedPolygon
+from IMM.georeference import Homography, CORNER_PIXELS
+from helper_functions import get_path_from_root
+
+TILE_SIZE = 256
+
+# Web Mercator is undefined at the poles.
+_MAX_LAT = 85.0511287798
+
+
+def lat_long_to_tile(lat, long, zoom):
+    """Return the fractional (x, y) tile coordinates of a point at a zoom level.
+
+    Works on scalars as well as NumPy arrays.
+    """
+    n = 2.0 ** zoom
+    lat_rad = numpy.radians(numpy.clip(lat, -_MAX_LAT, _MAX_LAT))
+    x = (numpy.asarray(long) + 180.0) / 360.0 * n
+    y = (1.0 - numpy.log(numpy.tan(lat_rad) + 1.0 / numpy.cos(lat_rad)) / math.pi) / 2.0 * n
+    return x, y
+
+
+def tile_to_lat_long(x, y, zoom):
+    """Return the (lat, long) of fractional tile coordinates at a zoom level.
+
+    Works on scalars as well as NumPy arrays.
+    """
+    n = 2.0 ** zoom
+    long = numpy.asarray(x) / n * 360.0 - 180.0
+    lat = numpy.degrees(numpy.arctan(numpy.sinh(math.pi * (1.0 - 2.0 * numpy.asarray(y) / n))))
+    return lat, long
+
+
+def tiles_for_footprint(footprint, zoom):
+    """Return a list of the (x, y) tiles at zoom that a footprint intersects.
+
+    footprint   A list of (lat, long) tuples.
+    zoom        The zoom level.
+    """
+    lats = numpy.array([lat for lat, _long in footprint])
+    longs = numpy.array([long for _lat, long in footprint])
+    xs, ys = lat_long_to_tile(lats, longs, zoom)
+    polygon = PreparedPolygon(numpy.column_stack([xs, ys]))
+
+    n = 2 ** zoom
+    # Tiles only sharing an edge with the footprint are not considered intersecting.
+    eps = 1e-9
+    tiles = []
+    for x in range(max(int(xs.min()), 0), min(int(xs.max()), n - 1) + 1):
+        for y in range(max(int(ys.min()), 0), min(int(ys.max()), n - 1) + 1):
+            square = [(x + eps, y + eps), (x + 1 - eps, y + eps), (x + 1 - eps, y + 1 - eps), (x + eps, y + 1 - eps)]
+            if polygon.intersects(square):
+                tiles.append((x, y))
+    return tiles
+
+
+def _as_rgb(image):
+    """Return an image array as (height, width, 3) uint8."""
+    image = numpy.asarray(image)
+    if image.ndim == 2:
+        image = numpy.stack([image] * 3, axis=2)
+    return image[:, :, :3].astype(numpy.uint8, copy=False)
+
+
+class TileRenderer:
+    """Renders images into a tile pyramid, using a dedicated worker pool.
+
+    Tiles are stored as RGBA PNG files in <tile_dir>/<zoom>/<x>/<y>.png.
+    Transparent pixels are not covered by any image yet. Each tile is guarded
+    by a lock, so images overlapping the same tile are composited one at a
+    time.
+
+    Images may reach a tile out of order when several workers render at once,
+    or be rendered again later. Next to each tile, <y>.time.png stores the
+    time_taken of the image shown by every pixel, as a uint32 split over the
+    RGBA bytes, and an image only replaces the pixels showing an older image.
+    The time plane is read and written together with its tile, so no tile
+    state is kept in memory.
+    """
+
+    def __init__(self, tile_dir=None, min_zoom=12, max_zoom=18, workers=2):
+        """TileRenderer constructor.
+
+        tile_dir    The root directory of the tile pyramid. (default IMM/tiles)
+        min_zoom    The lowest zoom level rendered. (default 12)
+        max_zoom    The highest zoom level rendered. (default 18)
+        workers     The number of worker threads. (default 2)
+        """
+        if min_zoom > max_zoom:
+            raise ValueError("min_zoom must not be larger than max_zoom")
+        self.tile_dir = tile_dir or get_path_from_root("/IMM/tiles")
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+        self.__tile_locks = [Lock() for _i in range(64)]
+        self.__listeners = []
+
+    def tile_path(self, zoom, x, y):
+        """Return the file path of a tile."""
+        return os.path.join(self.tile_dir, str(zoom), str(x), str(y) + ".png")
+
+    def time_path(self, zoom, x, y):
+        """Return the file path of the time plane of a tile, see TileRenderer."""
+        return os.path.join(self.tile_dir, str(zoom), str(x), str(y) + ".time.png")
+
+    def add_listener(self, listener):
+        """Call listener(zoom, x, y) every time a tile has been recomposited."""
+        self.__listeners.append(listener)
+
+    def submit(self, image, footprint, time_taken=None):
+        """Render an image into the tile pyramid on the worker pool.
+
+        Returns a Future resolving to the list of (zoom, x, y) tiles touched.
+
+        image       The image as a (height, width[, channels]) uint8 array.
+        footprint   A dict mapping "up_left", "up_right", "down_right" and
+                    "down_left" to (lat, long) tuples.
+        time_taken  The Unix timestamp when the image was taken, or None to
+                    use the current time.
+        """
+        return self.__executor.submit(self.render, image, footprint, time_taken)
+
+    def render(self, image, footprint, time_taken=None):
+        """Render an image into the tile pyramid in the calling thread.
+
+        See submit for the arguments. Returns the list of (zoom, x, y) tiles touched.
+        """
+        image = _as_rgb(image)
+        if time_taken is None:
+            time_taken = int(time.time())
+        height, width = image.shape[:2]
+        transform = Homography.from_footprint(footprint, width, height).lat_long_to_pixel
+        polygon = [footprint[corner] for corner in CORNER_PIXELS]
+
+        touched = []
+        for zoom in range(self.min_zoom, self.max_zoom + 1):
+            for x, y in tiles_for_footprint(polygon, zoom):
+                if self.__render_tile(image, transform, zoom, x, y, time_taken):
+                    touched.append((zoom, x, y))
+        return touched
+
+    def __render_tile(self, image, transform, zoom, x, y, time_taken):
+        """Composite image on top of a single tile. Returns True if any pixel changed."""
+        height, width = image.shape[:2]
+        offsets = (numpy.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+        lat, long = tile_to_lat_long(x + offsets[numpy.newaxis, :], y + offsets[:, numpy.newaxis], zoom)
+        column, row = transform(lat, long)
+        column = numpy.floor(column).astype(numpy.int64)
+        row = numpy.floor(row).astype(numpy.int64)
+        covered = (column >= 0) & (column < width) & (row >= 0) & (row < height)
+        if not covered.any():
+            return False
+
+        path = self.tile_path(zoom, x, y)
+        with self.__tile_locks[hash((zoom, x, y)) % len(self.__tile_locks)]:
+            if os.path.exists(path):
+                with PIL_image.open(path) as existing:
+                    tile = numpy.array(existing.convert("RGBA"))
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tile = numpy.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=numpy.uint8)
+            time_path = self.time_path(zoom, x, y)
+            if os.path.exists(time_path):
+                with PIL_image.open(time_path) as existing:
+                    times = numpy.array(existing.convert("RGBA")).view("<u4")[:, :, 0]
+            else:
+                # Pixels of tiles rendered without a time plane count as oldest.
+                times = numpy.zeros((TILE_SIZE, TILE_SIZE), dtype="<u4")
+            covered &= times <= time_taken
+            if not covered.any():
+                return False
+            times[covered] = time_taken
+            tile[covered, :3] = image[row[covered], column[covered]]
+            tile[covered, 3] = 255
+            PIL_image.fromarray(tile, "RGBA").save(path)
+            PIL_image.fromarray(times.view(numpy.uint8).reshape(TILE_SIZE, TILE_SIZE, 4), "RGBA").save(time_path)
+
+        for listener in self.__listeners:
+            listener(zoom, x, y)
+        return True
+
+    def shutdown(self):
+        self.__executor.shutdown()
@@ -0,0 +1,112 @@
+"""Queries answering which images cover a client view.
+
+The following public functions are provided:
+coordinates_from_json -- Convert a RECTANGLE JSON object to a dict of Coordinates.
+images_in_view -- Return ids of the images whose footprint overlaps a view.
+record_client_view -- Store the current view of a client.
+"""
+import numpy
+
+from IMM_database.database import Image, Client, Coordinate, query_image_ids_in_polygon, load_footprints
+from IMM_database.database import get_image_columns
+from Help_functions.geometry import batch_polygons_intersect, batch_view_coverage
+
+# The corners of a view or footprint, in traversal order.
+CORNERS = ("up_left", "up_right", "down_right", "down_left")
+
+# Maximum number of ids bound to a single IN clause.
+_ID_CHUNK_SIZE = 500
+
+
+def coordinates_from_json(json):
+    """Return a dict mapping corner names to Coordinates.
+
+    json    A RECTANGLE as defined in api.md, i.e. a dict with "up_left",
+            "up_right", "down_right", "down_left" and optionally "center",
+            each with "lat" and "long".
+    """
+    return {name: Coordinate(lat=value["lat"], long=value["long"]) for name, value in json.items()}
+
+
+def _polygon(coordinates):
+    """Return the corners of a dict of Coordinates as a list of (lat, long) tuples."""
+    return [(coordinates[corner].lat, coordinates[corner].long) for corner in CORNERS]
+
+
+def _overlapping(polygons, view_polygon, min_coverage):
+    """Return a mask of the (N, 4, 2) footprint polygons that overlap view_polygon enough."""
+    overlapping = batch_polygons_intersect(polygons, view_polygon)
+    if min_coverage is not None and overlapping.any():
+        overlapping[overlapping] = batch_view_coverage(polygons[overlapping], view_polygon) >= min_coverage
+    return overlapping
+
+
+def _session_images_in_view(session, view_polygon, session_id, min_coverage):
+    """Return arrays (ids, time_taken) of the images of a UserSession overlapping view_polygon."""
+    columns = get_image_columns(session, session_id)
+    lats = [lat for lat, _long in view_polygon]
+    longs = [long for _lat, long in view_polygon]
+    candidates = columns.in_bbox(min(lats), min(longs), max(lats), max(longs))
+    polygons = columns.footprints[candidates, :8].reshape(-1, 4, 2)
+    overlapping = _overlapping(polygons, view_polygon, min_coverage)
+    return columns.ids[candidates][overlapping], columns.time_taken[candidates][overlapping]
+
+
+def _all_images_in_view(session, view, view_polygon, min_coverage):
+    """Return arrays (ids, time_taken) of the images of all UserSessions overlapping view_polygon."""
+    candidate_ids = query_image_ids_in_polygon(session, [view[corner] for corner in CORNERS])
+    ids = [numpy.empty(0, dtype=numpy.int64)]
+    for start in range(0, len(candidate_ids), _ID_CHUNK_SIZE):
+        chunk_ids, chunk_footprints = load_footprints(session, image_ids=candidate_ids[start:start + _ID_CHUNK_SIZE])
+        ids.append(chunk_ids[_overlapping(chunk_footprints[:, :8].reshape(-1, 4, 2), view_polygon, min_coverage)])
+    ids = numpy.concatenate(ids).tolist()
+
+    time_taken = {}
+    for start in range(0, len(ids), _ID_CHUNK_SIZE):
+        time_taken.update((image_id, time) for time, image_id in
+            session.query(Image.time_taken, Image.id).filter(Image.id.in_(ids[start:start + _ID_CHUNK_SIZE])))
+    return numpy.array(ids, dtype=numpy.int64), numpy.array([time_taken[image_id] for image_id in ids],
+                                                            dtype=numpy.int64)
+
+
+def images_in_view(session, view, session_id=None, limit=None, min_coverage=None):
+    """Return the ids of all images whose footprint overlaps view, newest first.
+
+    Images of a single UserSession are filtered in memory, using the column
+    arrays of get_image_columns. Otherwise the R-tree index gives the
+    candidate images whose bounding box overlaps the bounding box of the
+    view, and the footprints of the candidates are loaded as an array. In
+    both cases the footprints are tested against the view quadrilateral at once.
+
+    session     The database session to query.
+    view        A dict of Coordinates with the four view corners, see
+                coordinates_from_json.
+    session_id  If given, only images of this UserSession are returned.
+    limit       The maximum number of ids to return, or None for all.
+    min_coverage If given, images covering less than this fraction of the
+                view are left out. The view must be convex.
+    """
+    view_polygon = _polygon(view)
+    if session_id is not None:
+        ids, time_taken = _session_images_in_view(session, view_polygon, session_id, min_coverage)
+    else:
+        ids, time_taken = _all_images_in_view(session, view, view_polygon, min_coverage)
+
+    newest_first = numpy.lexsort((ids, time_taken))[::-1]
+    if limit is not None:
+        newest_first = newest_first[:limit]
+    return ids[newest_first].tolist()
+
+
+def record_client_view(session, client_id, view):
+    """Store view as the current view of the client with id client_id.
+
+    Returns False if there is no such client, else True.
+    """
+    client = session.query(Client).get(client_id) if client_id is not None else None
+    if client is None:
+        return False
+    for corner in CORNERS + ("center",):
+        if corner in view:
+            setattr(client, corner, view[corner])
+    return True
@@ -0,0 +1,100 @@
+"""Benchmark of image ingest with concurrent readers for each StorageProfile.
+
+A writer thread inserts images one commit at a time, as the ingest does
+without a DatabaseWriterThread, while reader threads repeatedly run the
+spatial query used by request_view. The commit latency of the writer and the
+query throughput of the readers are reported for each profile.
+
+Usage: python -m IMM_database.benchmark [images] [readers]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from random import uniform, seed
+from threading import Thread, Event
+
+from IMM_database.database import _Database, StorageProfile, LEGACY_STORAGE_PROFILE
+from IMM_database.database import UserSession, Image, Coordinate, query_image_ids_in_bbox
+
+
+def _random_image(session_id):
+    lat, long = uniform(58.0, 58.1), uniform(15.0, 15.1)
+    return Image(
+        session_id=session_id, time_taken=int(time.time()), width=1920, height=1080, type="RGB",
+        up_left=Coordinate(lat + 0.001, long), up_right=Coordinate(lat + 0.001, long + 0.001),
+        down_right=Coordinate(lat, long + 0.001), down_left=Coordinate(lat, long),
+        center=Coordinate(lat + 0.0005, long + 0.0005), file_name="benchmark.jpg"
+    )
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(profile, n_images, n_readers):
+    """Run the benchmark against a new database file using profile.
+
+    Returns a dict with the writer's inserts per second, its median and 99th
+    percentile commit latency in milliseconds and the readers' queries per second.
+    """
+    directory = tempfile.TemporaryDirectory()
+    database = _Database(os.path.join(directory.name, "benchmark.db"), profile=profile)
+    session = database.get_session()
+    user_session = UserSession(start_time=0, drone_mode="AUTO")
+    session.add(user_session)
+    session.commit()
+    session_id = user_session.id
+    database.release_session()
+
+    done = Event()
+    queries = [0] * n_readers
+
+    def read(i):
+        while not done.is_set():
+            session = database.get_session(read_only=True)
+            lat, long = uniform(58.0, 58.09), uniform(15.0, 15.09)
+            query_image_ids_in_bbox(session, lat, long, lat + 0.01, long + 0.01)
+            session.rollback()
+            database.release_session(read_only=True)
+            queries[i] += 1
+
+    readers = [Thread(target=read, args=(i, )) for i in range(n_readers)]
+    for reader in readers:
+        reader.start()
+
+    latencies = []
+    start = time.perf_counter()
+    for _i in range(n_images):
+        commit_start = time.perf_counter()
+        session = database.get_session()
+        session.add(_random_image(session_id))
+        session.commit()
+        database.release_session()
+        latencies.append((time.perf_counter() - commit_start) * 1000)
+    elapsed = time.perf_counter() - start
+
+    done.set()
+    for reader in readers:
+        reader.join()
+    database.dispose()
+    directory.cleanup()
+    return {
+        "inserts_per_second": n_images / elapsed,
+        "median_commit_ms": _percentile(latencies, 0.5),
+        "p99_commit_ms": _percentile(latencies, 0.99),
+        "queries_per_second": sum(queries) / elapsed,
+    }
+
+
+if __name__ == "__main__":
+    n_images = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seed(1)
+    for name, profile in (("legacy", LEGACY_STORAGE_PROFILE), ("default", StorageProfile())):
+        result = run(profile, n_images, n_readers)
+        print("{:8s} {:8.0f} inserts/s  commit median {:6.2f} ms  p99 {:6.2f} ms  {:8.0f} queries/s".format(
+            name, result["inserts_per_second"], result["median_commit_ms"], result["p99_commit_ms"],
+            result["queries_per_second"]))
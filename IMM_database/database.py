@@ -10,29 +10,53 @@ AreaVertex -- Used to track the designated area of a session.
 Image -- An image taken by a drone.
 PrioImage -- Request from a client to take an image of an area.
 Drone -- Information about an RDS drone.
+ImageRendition -- A downscaled copy of an Image.
+
+The following public classes are provided:
+StorageProfile -- SQLite settings used for the IMM database files.
+CommitCache -- Thread-safe cache of values loaded from the database.
+ImageColumns -- Snapshot of the Images of a UserSession as NumPy arrays.
 
 The following public functions are provided:
 use_production_db -- Sets the production database as the active database.
 use_test_database -- Sets a new test database as the active database.
 session_scope -- Context manager to safely interact with database sessions.
+read_scope -- Context manager for read-only database sessions.
+get_active_session_id -- Return the id of the currently active UserSession.
+get_active_drone_mode -- Return the drone mode of the currently active UserSession.
+invalidate_active_session -- Forget the cached active UserSession.
+query_image_ids_in_bbox -- Return ids of images overlapping a lat/long rectangle.
+query_image_ids_in_polygon -- Return ids of images overlapping the bounding box of a polygon.
+load_footprints -- Return the footprints of images as a NumPy array.
+update_rows -- Update rows by id with one UPDATE and return the ids updated.
+get_image_columns -- Return the Images of a UserSession as NumPy column arrays.
+invalidate_image_columns -- Forget the cached column arrays of Images.
+track_commits -- Call a function with the ORM changes of every commit.
+bulk_insert -- Insert ORM objects with bulk_save_objects.
 """
 import os
+import time
 
 from string import Formatter
 
-from sqlalchemy import create_engine, event
-from sqlalchemy import Column, Table, ForeignKey
+from sqlalchemy import create_engine, event, text, select
+from sqlalchemy import Column, Table, ForeignKey, Index
 from sqlalchemy import Integer, Float, String
 from sqlalchemy.engine import Engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool, NullPool
+from sqlalchemy.orm import sessionmaker, scoped_session, object_session
+from sqlalchemy.orm import Session
 from sqlalchemy.orm import composite, relationship
+from sqlalchemy.orm.interfaces import ONETOMANY
+from sqlalchemy import inspect
 from sqlalchemy.ext.declarative import declarative_base
 
+import numpy
 import sqlite3
 
 from contextlib import contextmanager
 
-from threading import Lock, Semaphore
+from threading import Condition, Lock
 
 from helper_functions import get_path_from_root
 
@@ -72,10 +96,15 @@ class Coordinate:
     of values stored in multiple columns. Coordinates are saved using latitude and
     longitude, each represented by degree as a float value.
 
+    Every loaded Image holds five Coordinates, so instances use __slots__
+    instead of a __dict__ to keep them small.
+
     Inspired by this SQLAlchemy tutorial:
     https://docs.sqlalchemy.org/en/13/orm/composites.html
     """
 
+    __slots__ = ("lat", "long")
+
     def __init__(self, lat, long):
         """Coordinate constructor.
 
@@ -167,6 +196,9 @@ class Client(_Base):
                     view. Nullable.
     """
     __tablename__ = 'clients'
+    __table_args__ = (
+        Index('ix_clients_session_id', 'session_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     session_id = Column(Integer, ForeignKey('sessions.id'), nullable=False)
@@ -276,8 +308,17 @@ class Image(_Base):
                 of the image. Not nullable.
     center      A Coordintae describing the location of the center point of the
                 image. Not nullable.
+    renditions  A list of the ImageRendition objects with downscaled copies of
+                the image.
     """
     __tablename__ = 'images'
+    __table_args__ = (
+        # Per-session listings, ordered or filtered by time.
+        Index('ix_images_session_id_time_taken', 'session_id', 'time_taken'),
+        Index('ix_images_time_taken', 'time_taken'),
+        # Lookups of received images by their file, e.g. in match_image_to_tile.
+        Index('ix_images_file_name', 'file_name'),
+    )
 
     id = Column(Integer, primary_key=True)
     session_id = Column(Integer, ForeignKey('sessions.id'), nullable=False)
@@ -314,6 +355,174 @@ class Image(_Base):
 UserSession.images = relationship("Image", order_by=Image.id, back_populates="session")
 
 
+# The corners of an image footprint, in traversal order.
+_FOOTPRINT_CORNERS = ("up_left", "up_right", "down_right", "down_left")
+
+
+def _footprint_column_names():
+    """Return two lists with the names of the latitude and longitude columns of the Image corners."""
+    columns = [getattr(Image, corner).property.columns for corner in _FOOTPRINT_CORNERS]
+    return [lat.name for lat, _long in columns], [long.name for _lat, long in columns]
+
+
+def _create_spatial_index(engine):
+    """Create the R-tree index of Image footprints, if it does not already exist.
+
+    The SQLite rtree virtual table image_rtree stores the lat/long bounding box
+    of every image footprint. Triggers on the images table keep it in sync
+    regardless of how rows are inserted, updated or deleted. If the index is
+    added to an existing database file, it is populated from the images table.
+    """
+    lat_columns, long_columns = _footprint_column_names()
+    bbox = lambda prefix: "min({0}), max({0}), min({1}), max({1})".format(
+        ", ".join(prefix + c for c in lat_columns), ", ".join(prefix + c for c in long_columns))
+
+    with engine.begin() as connection:
+        exists = connection.execute(text(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = 'image_rtree'")).scalar()
+        if exists:
+            return
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE image_rtree USING rtree(id, min_lat, max_lat, min_long, max_long)"))
+        connection.execute(text(
+            "INSERT INTO image_rtree SELECT id, {} FROM images".format(bbox(""))))
+        for trigger in ("image_rtree_insert", "image_rtree_update", "image_rtree_delete"):
+            connection.execute(text("DROP TRIGGER IF EXISTS " + trigger))
+        connection.execute(text(
+            "CREATE TRIGGER image_rtree_insert AFTER INSERT ON images BEGIN "
+            "INSERT INTO image_rtree VALUES (new.id, {}); END".format(bbox("new."))))
+        connection.execute(text(
+            "CREATE TRIGGER image_rtree_update AFTER UPDATE ON images BEGIN "
+            "DELETE FROM image_rtree WHERE id = old.id; "
+            "INSERT INTO image_rtree VALUES (new.id, {}); END".format(bbox("new."))))
+        connection.execute(text(
+            "CREATE TRIGGER image_rtree_delete AFTER DELETE ON images BEGIN "
+            "DELETE FROM image_rtree WHERE id = old.id; END"))
+
+
+def _create_missing_indexes(engine):
+    """Create the indexes defined in the ORM classes that are missing from the database file.
+
+    create_all only creates the indexes of tables it creates, so indexes added
+    to an ORM class after a database file was created are added here.
+    """
+    with engine.begin() as connection:
+        existing = {row[0] for row in connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        for table in _Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=connection)
+
+
+def query_image_ids_in_bbox(session, min_lat, min_long, max_lat, max_long, session_id=None):
+    """Return the ids of all images whose bounding box overlaps a lat/long rectangle.
+
+    The lookup uses the image_rtree index, so its cost depends on the number of
+    matching images rather than the size of the images table. The result is a
+    candidate set: an image whose bounding box overlaps the rectangle does not
+    necessarily have a footprint overlapping it.
+
+    session     The database session to query.
+    min_lat, min_long, max_lat, max_long -- The rectangle corners in degrees.
+    session_id  If given, only images of this UserSession are returned.
+    """
+    sql = "SELECT image_rtree.id FROM image_rtree"
+    params = {"min_lat": min_lat, "max_lat": max_lat, "min_long": min_long, "max_long": max_long}
+    if session_id is not None:
+        sql += " JOIN images ON images.id = image_rtree.id"
+    sql += " WHERE image_rtree.max_lat >= :min_lat AND image_rtree.min_lat <= :max_lat" \
+           " AND image_rtree.max_long >= :min_long AND image_rtree.min_long <= :max_long"
+    if session_id is not None:
+        sql += " AND images.session_id = :session_id"
+        params["session_id"] = session_id
+    return [row[0] for row in session.execute(text(sql), params)]
+
+
+def query_image_ids_in_polygon(session, coordinates, session_id=None):
+    """Return the ids of all images whose bounding box overlaps the bounding box of a polygon.
+
+    session     The database session to query.
+    coordinates An iterable of Coordinates, the polygon vertices.
+    session_id  If given, only images of this UserSession are returned.
+    """
+    coordinates = list(coordinates)
+    lats = [coordinate.lat for coordinate in coordinates]
+    longs = [coordinate.long for coordinate in coordinates]
+    return query_image_ids_in_bbox(session, min(lats), min(longs), max(lats), max(longs), session_id)
+
+
+# The maximum number of ids bound in a single IN clause.
+_ID_CHUNK_SIZE = 500
+
+
+def update_rows(session, model, row_ids, values, condition=None):
+    """Update the rows of model with an id in row_ids and return the ids of the rows updated.
+
+    The rows are selected and updated with one statement each (per chunk of
+    ids), both with the same predicate, in the transaction of session. The
+    SELECT runs first, so the returned ids are exactly the rows the UPDATE
+    changes.
+
+    session     The database session, which must be able to write.
+    model       The ORM class of the rows, e.g. PrioImage.
+    row_ids     A sequence of primary keys.
+    values      A dict mapping attributes to new values.
+    condition   If given, an SQL expression the rows must also match to be
+                updated, e.g. PrioImage.status == "PENDING".
+    """
+    updated = []
+    row_ids = list(row_ids)
+    for start in range(0, len(row_ids), _ID_CHUNK_SIZE):
+        predicate = [model.id.in_(row_ids[start:start + _ID_CHUNK_SIZE])]
+        if condition is not None:
+            predicate.append(condition)
+        chunk = [row_id for row_id, in session.query(model.id).filter(*predicate)]
+        if chunk:
+            session.query(model).filter(*predicate).update(values, synchronize_session=False)
+            updated.extend(chunk)
+    return updated
+
+
+# The corners and center of an image, in the column order of load_footprints.
+FOOTPRINT_POINTS = _FOOTPRINT_CORNERS + ("center", )
+
+
+def _footprint_point_columns():
+    """Return the lat and long columns of the points in FOOTPRINT_POINTS, in order."""
+    columns = []
+    for point in FOOTPRINT_POINTS:
+        columns.extend(getattr(Image, point).property.columns)
+    return columns
+
+
+def load_footprints(session, session_id=None, image_ids=None):
+    """Return the ids and footprints of images as NumPy arrays, without creating ORM objects.
+
+    Returns a tuple (ids, footprints), where ids is an (N,) int64 array of the
+    image ids in ascending order and footprints is an (N, 10) float64 array.
+    Row n of footprints holds the lat and long of each point in
+    FOOTPRINT_POINTS for image ids[n], i.e. up_left lat, up_left long,
+    up_right lat, ..., center long. footprints[:, :8].reshape(-1, 4, 2) are
+    the footprint polygons.
+
+    session     The database session to query.
+    session_id  If given, only images of this UserSession are returned.
+    image_ids   If given, only images with these ids are returned.
+    """
+    columns = [Image.id] + _footprint_point_columns()
+    query = select(columns).order_by(Image.id)
+    if session_id is not None:
+        query = query.where(Image.session_id == session_id)
+    if image_ids is not None:
+        query = query.where(Image.id.in_(list(image_ids)))
+
+    # Fetch plain tuples from the DBAPI cursor, bypassing the row proxies.
+    rows = session.execute(query).cursor.fetchall()
+    data = numpy.array(rows, dtype=numpy.float64).reshape(len(rows), len(columns))
+    return data[:, 0].astype(numpy.int64), numpy.ascontiguousarray(data[:, 1:])
+
+
 class PrioImage(_Base):
     """ORM class representing a prioritized image request.
 
@@ -349,6 +558,11 @@ class PrioImage(_Base):
                     set to None. Nullable.
     """
     __tablename__ = 'prio_images'
+    __table_args__ = (
+        # Pending requests of a session. Also serves lookups by session_id only.
+        Index('ix_prio_images_session_id_status', 'session_id', 'status'),
+        Index('ix_prio_images_image_id', 'image_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     session_id = Column(Integer, ForeignKey('sessions.id'))
@@ -397,6 +611,9 @@ class Drone(_Base):
                     current destination. Set to None if unknown. Nullable.
     """
     __tablename__ = 'drones'
+    __table_args__ = (
+        Index('ix_drones_session_id', 'session_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     session_id = Column(Integer, ForeignKey('sessions.id'), nullable=False)
@@ -413,6 +630,52 @@ class Drone(_Base):
 UserSession.drones = relationship("Drone", order_by=Drone.id, back_populates="session")
 
 
+class ImageRendition(_Base):
+    """ORM class representing a downscaled copy of an Image.
+
+    When an image is received, smaller renditions of it are saved next to the
+    full image, so that clients can load a low resolution version first.
+
+    ImageRendition has the following attributes:
+    id          An integer that uniquely identifies the rendition. Used as the
+                primary database key. If unspecified, the DBMS automatically
+                assigns a new id when the object is commited.
+    image_id    The id of the Image this is a rendition of. The DBMS
+                automatically synchronizes this with the image object. Not
+                nullable.
+    image       The Image object this is a rendition of. See notes on image_id.
+    rendition   The name of the rendition, e.g. "half" or "thumbnail". Not
+                nullable.
+    file_name   The name of the file where the rendition is stored, in the
+                default image folder for the IMM. Not nullable.
+    width       The rendition width in pixels. Not nullable.
+    height      The rendition height in pixels. Not nullable.
+    size        The size of the file in bytes. Not nullable.
+    """
+    __tablename__ = 'image_renditions'
+    __table_args__ = (
+        Index('ix_image_renditions_image_id', 'image_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    image_id = Column(Integer, ForeignKey('images.id'), nullable=False)
+    rendition = Column(String, nullable=False)
+    file_name = Column(String, nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)
+
+    image = relationship("Image", back_populates="renditions")
+
+    def __repr__(self):
+        """Return a string representation of the ImageRendition."""
+        return _NoneFormatter().format('<ImageRendition(id={0:6d}, image_id={1:6d}, rendition={2}, file_name={3}, width={4}, height={5}, size={6}',
+            self.id, self.image_id, self.rendition, self.file_name, self.width, self.height, self.size)
+
+Image.renditions = relationship("ImageRendition", order_by=ImageRendition.id, back_populates="image",
+                                cascade="all, delete-orphan")
+
+
 @event.listens_for(Engine, "connect")
 def __set_sqlite_pragma(dbapi_connection, connection_record):
     """Enable foreign key constraint checks for a SQLite3 DBMS.
@@ -428,10 +691,468 @@ def __set_sqlite_pragma(dbapi_connection, connection_record):
         cursor.execute("PRAGMA foreign_keys=ON;")
         cursor.close()
 
+class CommitCache:
+    """Thread-safe cache of values loaded from the database, kept up to date by commits.
+
+    Values are loaded on demand and cached per key. Each key has a generation,
+    which update and invalidate increment, so a value loaded concurrently with
+    a change of its key is returned but not cached. Use track_commits to
+    update or invalidate the cached values when ORM changes are commited.
+    """
+
+    def __init__(self):
+        """CommitCache constructor."""
+        self.__lock = Lock()
+        self.__values = {}
+        self.__generations = {}
+        self.__epoch = 0
+
+    def __generation(self, key):
+        return self.__epoch, self.__generations.get(key, 0)
+
+    def get(self, key, load, view=None):
+        """Return the value of key, calling load() to load it if it is not cached.
+
+        A loaded value of None is returned but not cached.
+
+        key     The key of the value.
+        load    Called without arguments to load the value.
+        view    If given, called with the value while holding the lock of the
+                cache, and its result is returned instead of the value. Needed
+                if update modifies values in place.
+        """
+        with self.__lock:
+            value = self.__values.get(key)
+            if value is not None:
+                return view(value) if view else value
+            generation = self.__generation(key)
+
+        value = load()
+        with self.__lock:
+            # Don't cache the value if the key was changed meanwhile.
+            if value is not None and generation == self.__generation(key):
+                value = self.__values.setdefault(key, value)
+            return view(value) if view and value is not None else value
+
+    def update(self, key, update):
+        """Replace the cached value of key with update(value), if key is cached.
+
+        update is called while holding the lock of the cache, so it may modify
+        the value in place. Values of key being loaded meanwhile are not cached.
+        """
+        with self.__lock:
+            self.__generations[key] = self.__generations.get(key, 0) + 1
+            value = self.__values.get(key)
+            if value is not None:
+                self.__values[key] = update(value)
+
+    def invalidate(self, key=None):
+        """Forget the cached value of key, or all cached values if key is None."""
+        with self.__lock:
+            if key is None:
+                self.__epoch += 1
+                self.__values.clear()
+            else:
+                self.__generations[key] = self.__generations.get(key, 0) + 1
+                self.__values.pop(key, None)
+
+
+def track_commits(mapped_class, events, collect, apply):
+    """Call apply with the changes to instances of mapped_class made by each commited ORM session.
+
+    collect(target) is called with every instance the ORM session flushes
+    with any of the given mapper events, and its results are kept in the
+    ORM session. When the session commits, apply(items) is called with the
+    list of collected items, unless it is empty. Items collected in a
+    transaction that is rolled back are discarded. Changes made without the
+    ORM, e.g. bulk updates with Query.update or raw SQL, are not seen, except
+    for inserts made with bulk_insert.
+
+    mapped_class    The ORM class to track.
+    events          Names of mapper events, e.g. ("after_insert", "after_update").
+    collect         Called with the flushed instance, returns the item to
+                    collect, or None to skip the instance.
+    apply           Called with the list of collected items after a commit.
+    """
+    key = object()
+
+    def collect_into(session, target):
+        item = collect(target)
+        if item is not None:
+            session.info.setdefault(key, []).append(item)
+
+    def collect_item(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            collect_into(session, target)
+
+    def apply_items(session):
+        items = session.info.pop(key, None)
+        if items:
+            apply(items)
+
+    def discard_items(session):
+        session.info.pop(key, None)
+
+    for event_name in events:
+        event.listen(mapped_class, event_name, collect_item)
+    event.listen(Session, "after_commit", apply_items)
+    event.listen(Session, "after_rollback", discard_items)
+    if "after_insert" in events:
+        __insert_collectors.setdefault(mapped_class, []).append(collect_into)
+
+
+# The after_insert collectors of track_commits by mapped class, called by bulk_insert.
+__insert_collectors = {}
+
+
+def bulk_insert(session, objects):
+    """Insert new ORM objects with bulk_save_objects, assigning their primary keys.
+
+    The objects are grouped by class and each group is inserted without the
+    unit of work of the ORM session. The loaded one-to-many children of the
+    objects, e.g. the renditions of an Image, are inserted the same way after
+    their parents. The objects are not added to the session, but track_commits
+    sees them as inserted when the session commits.
+
+    session     The database session, which must be able to write.
+    objects     A sequence of new ORM objects.
+    """
+    by_class = {}
+    for obj in objects:
+        by_class.setdefault(type(obj), []).append(obj)
+    for mapped_class, group in by_class.items():
+        session.bulk_save_objects(group, return_defaults=True)
+        for collect_into in __insert_collectors.get(mapped_class, ()):
+            for obj in group:
+                collect_into(session, obj)
+        mapper = inspect(mapped_class)
+        for relation in mapper.relationships:
+            if relation.direction is not ONETOMANY:
+                continue
+            child_mapper = relation.mapper
+            children = []
+            for obj in group:
+                for child in obj.__dict__.get(relation.key) or ():
+                    for local, remote in relation.local_remote_pairs:
+                        setattr(child, child_mapper.get_property_by_column(remote).key,
+                                getattr(obj, mapper.get_property_by_column(local).key))
+                    children.append(child)
+            if children:
+                bulk_insert(session, children)
+
+
+def __load_active_session():
+    """Return an (id, drone_mode) tuple for the active UserSession, or None."""
+    with read_scope() as session:
+        active = session.query(UserSession.id, UserSession.drone_mode).\
+            filter(UserSession.end_time == None).\
+            order_by(UserSession.id.desc()).first()
+    return tuple(active) if active is not None else None
+
+
+# Keeps the active UserSession in memory, under the key None. It is loaded
+# with a single query the first time it is needed. Commits that insert,
+# update or delete a UserSession through the ORM invalidate it.
+__active_session_cache = CommitCache()
+track_commits(UserSession, ("after_insert", "after_update", "after_delete"), lambda target: True,
+              lambda _changes: __active_session_cache.invalidate())
+
+
+def get_active_session_id():
+    """Return the id of the active UserSession, or None if no session is active.
+
+    The active UserSession is the most recently created UserSession without an
+    end time. The id is cached in memory, so calling this function normally
+    does not access the database.
+    """
+    active = __active_session_cache.get(None, __load_active_session)
+    return active[0] if active else None
+
+def get_active_drone_mode():
+    """Return the drone mode of the active UserSession, or None if no session is active."""
+    active = __active_session_cache.get(None, __load_active_session)
+    return active[1] if active else None
+
+def invalidate_active_session():
+    """Forget the cached active UserSession.
+
+    Only needed after changing UserSessions without using the ORM, since ORM
+    changes invalidate the cache automatically when commited.
+    """
+    __active_session_cache.invalidate()
+
+
+class ImageColumns:
+    """Snapshot of the Images of a UserSession as NumPy column arrays.
+
+    Every array has one row per image, in no particular order. The arrays
+    are shared with the cache of get_image_columns and must not be modified.
+    The filter methods return boolean masks, which can be combined with & and
+    used to index any of the arrays.
+
+    ids         (N,) int64 array with the ids of the images.
+    time_taken  (N,) int64 array with the time_taken of the images.
+    type_codes  (N,) int16 array with the type of the images, see type_code.
+    footprints  (N, 10) float64 array with the footprints of the images, laid
+                out as in load_footprints.
+    bounds      (N, 4) float64 array with the min lat, min long, max lat and
+                max long of the footprints.
+    """
+
+    def __init__(self, ids, time_taken, type_codes, footprints, bounds, codes_by_type):
+        """ImageColumns constructor.
+
+        codes_by_type   A dict mapping image types to the codes used in type_codes.
+        """
+        self.ids = ids
+        self.time_taken = time_taken
+        self.type_codes = type_codes
+        self.footprints = footprints
+        self.bounds = bounds
+        self.__codes_by_type = codes_by_type
+
+    def __len__(self):
+        """Return the number of images."""
+        return len(self.ids)
+
+    def type_code(self, image_type):
+        """Return the code of image_type in type_codes, or -1 if no image has that type."""
+        return self.__codes_by_type.get(image_type, -1)
+
+    def in_bbox(self, min_lat, min_long, max_lat, max_long):
+        """Return a mask of the images whose bounding box overlaps a lat/long rectangle."""
+        bounds = self.bounds
+        return (bounds[:, 2] >= min_lat) & (bounds[:, 0] <= max_lat) & \
+               (bounds[:, 3] >= min_long) & (bounds[:, 1] <= max_long)
+
+    def in_time_range(self, start=None, end=None):
+        """Return a mask of the images taken from start to end, inclusive.
+
+        start, end -- Unix timestamps, or None for no limit.
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        if start is not None:
+            mask &= self.time_taken >= start
+        if end is not None:
+            mask &= self.time_taken <= end
+        return mask
+
+    def of_type(self, *image_types):
+        """Return a mask of the images with any of the given types."""
+        return numpy.isin(self.type_codes, [self.type_code(image_type) for image_type in image_types])
+
+
+class _ImageColumnBuffer:
+    """Growable column arrays of the Images of one UserSession.
+
+    Rows are appended in place while capacity remains, so the ImageColumns
+    returned by snapshot() stay valid: they only view rows that are never
+    written again.
+    """
+
+    def __init__(self, capacity=1024):
+        """_ImageColumnBuffer constructor."""
+        self.count = 0
+        self.ids = numpy.empty(capacity, dtype=numpy.int64)
+        self.time_taken = numpy.empty(capacity, dtype=numpy.int64)
+        self.type_codes = numpy.empty(capacity, dtype=numpy.int16)
+        self.footprints = numpy.empty((capacity, 2 * len(FOOTPRINT_POINTS)), dtype=numpy.float64)
+        self.bounds = numpy.empty((capacity, 4), dtype=numpy.float64)
+
+    def append(self, ids, time_taken, type_codes, footprints):
+        """Append rows given as arrays, footprints as an (n, 10) array."""
+        n = len(ids)
+        if self.count + n > len(self.ids):
+            self.__grow(max(2 * len(self.ids), self.count + n))
+        rows = slice(self.count, self.count + n)
+        self.ids[rows] = ids
+        self.time_taken[rows] = time_taken
+        self.type_codes[rows] = type_codes
+        self.footprints[rows] = footprints
+        corners = self.footprints[rows, :2 * len(_FOOTPRINT_CORNERS)]
+        self.bounds[rows, 0] = corners[:, 0::2].min(axis=1)
+        self.bounds[rows, 1] = corners[:, 1::2].min(axis=1)
+        self.bounds[rows, 2] = corners[:, 0::2].max(axis=1)
+        self.bounds[rows, 3] = corners[:, 1::2].max(axis=1)
+        self.count += n
+
+    def __grow(self, capacity):
+        for name in ("ids", "time_taken", "type_codes", "footprints", "bounds"):
+            old = getattr(self, name)
+            new = numpy.empty((capacity, ) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def snapshot(self, codes_by_type):
+        """Return an ImageColumns viewing the rows appended so far."""
+        n = self.count
+        return ImageColumns(self.ids[:n], self.time_taken[:n], self.type_codes[:n], self.footprints[:n],
+                            self.bounds[:n], codes_by_type)
+
+
+# The columns of a UserSession are loaded from the database the first time
+# they are needed. From then on, Images inserted through the ORM are appended
+# when their insert is commited. Commits that update or delete Images through
+# the ORM drop all columns, so they are loaded again.
+__image_columns = CommitCache()
+__codes_by_type = {}
+__codes_mutex = Lock()
+
+
+def __type_codes(types):
+    """Return the codes of a sequence of image types, assigning new codes as needed."""
+    with __codes_mutex:
+        return [__codes_by_type.setdefault(image_type, len(__codes_by_type)) for image_type in types]
+
+
+def __load_image_columns(session, session_id):
+    """Return an _ImageColumnBuffer with the Images of a UserSession."""
+    buffer = _ImageColumnBuffer()
+    columns = [Image.id, Image.time_taken, Image.type] + _footprint_point_columns()
+    rows = session.execute(select(columns).where(Image.session_id == session_id)).cursor.fetchall()
+    if rows:
+        ids, time_taken, types = zip(*[row[:3] for row in rows])
+        footprints = numpy.array([row[3:] for row in rows], dtype=numpy.float64)
+        buffer.append(ids, time_taken, __type_codes(types), footprints)
+    return buffer
+
+
+def __image_row(target):
+    """Return a (session_id, id, time_taken, type, footprint) tuple of an inserted Image."""
+    footprint = []
+    for point in FOOTPRINT_POINTS:
+        coordinate = getattr(target, point)
+        footprint.extend((coordinate.lat, coordinate.long))
+    return target.session_id, target.id, target.time_taken, target.type, footprint
+
+
+def __append_image_columns(rows):
+    """Append inserted images to the columns of their UserSession, if those are loaded."""
+    by_session = {}
+    for session_id, *row in rows:
+        by_session.setdefault(session_id, []).append(row)
+    for session_id, session_rows in by_session.items():
+        ids, time_taken, types, footprints = zip(*session_rows)
+
+        def append(buffer):
+            buffer.append(ids, time_taken, __type_codes(types), numpy.array(footprints, dtype=numpy.float64))
+            return buffer
+        __image_columns.update(session_id, append)
+
+
+track_commits(Image, ("after_insert", ), __image_row, __append_image_columns)
+track_commits(Image, ("after_update", "after_delete"), lambda target: True,
+              lambda _changes: __image_columns.invalidate())
+
+
+def get_image_columns(session, session_id):
+    """Return an ImageColumns snapshot of the Images of the UserSession with id session_id.
+
+    The columns are loaded with the database session the first time they are
+    needed and then kept up to date in memory as Images are commited, so
+    calling this function normally does not access the database. Images
+    added after the call are not included in the returned snapshot.
+    """
+    return __image_columns.get(session_id, lambda: __load_image_columns(session, session_id),
+                               lambda buffer: buffer.snapshot(__codes_by_type))
+
+
+def invalidate_image_columns(session_id=None):
+    """Forget the cached columns of the UserSession with id session_id, or of all UserSessions if None.
+
+    Only needed after changing Images without using the ORM, since ORM
+    changes update the columns automatically when commited.
+    """
+    __image_columns.invalidate(session_id)
+
+
+class StorageProfile:
+    """SQLite settings used when connecting to an IMM database file.
+
+    The default profile uses write-ahead logging, so that readers don't block
+    the writer and the writer doesn't block readers, and only syncs to disk
+    at checkpoints instead of on every commit. A commit can then be lost on
+    power failure, but the database is never corrupted.
+
+    Writes go through a single pooled connection by default, since SQLite
+    only allows one writer at a time anyway. Reads can use a separate pool of
+    read-only connections. In-memory databases ignore the profile.
+    """
+
+    def __init__(self, journal_mode="WAL", synchronous="NORMAL", mmap_size=256 * 2**20,
+                 cache_size=64 * 2**20, busy_timeout=5.0, writer_pool_size=1, reader_pool_size=4):
+        """StorageProfile constructor.
+
+        journal_mode        The SQLite journal mode, e.g. "WAL" or "DELETE". (default "WAL")
+        synchronous         The SQLite synchronous setting, e.g. "NORMAL" or
+                            "FULL". (default "NORMAL")
+        mmap_size           The number of bytes of the database file accessed
+                            through memory mapping, 0 to disable. (default 256 MiB)
+        cache_size          The page cache size of each connection in bytes.
+                            (default 64 MiB)
+        busy_timeout        The number of seconds to wait for a lock held by
+                            another connection before failing. (default 5.0)
+        writer_pool_size    The number of pooled writer connections, or None
+                            to open a new connection for every session. (default 1)
+        reader_pool_size    The number of read-only connections, 0 if reads
+                            should use the writer connections. (default 4)
+        """
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.busy_timeout = busy_timeout
+        self.writer_pool_size = writer_pool_size
+        self.reader_pool_size = reader_pool_size
+
+    def pragmas(self, read_only=False):
+        """Return the list of PRAGMA statements to execute on each new connection."""
+        pragmas = [
+            "PRAGMA busy_timeout={:d};".format(int(self.busy_timeout * 1000)),
+            "PRAGMA synchronous={};".format(self.synchronous),
+            "PRAGMA mmap_size={:d};".format(self.mmap_size),
+            # A negative cache size is given in KiB.
+            "PRAGMA cache_size={:d};".format(-(self.cache_size // 1024)),
+        ]
+        if read_only:
+            pragmas.append("PRAGMA query_only=ON;")
+        else:
+            # The journal mode is stored in the database file, so setting it once is enough.
+            pragmas.insert(1, "PRAGMA journal_mode={};".format(self.journal_mode))
+        return pragmas
+
+
+# The SQLite defaults, as used before storage profiles were introduced.
+LEGACY_STORAGE_PROFILE = StorageProfile(journal_mode="DELETE", synchronous="FULL", mmap_size=0,
+                                        cache_size=2 * 2**20, writer_pool_size=None, reader_pool_size=0)
+
+
+def _create_pooled_engine(file_path, profile, pool_size, read_only=False, echo=False):
+    """Return an engine applying profile to every new connection.
+
+    The engine has a fixed size connection pool, or no pool if pool_size is None.
+    """
+    if pool_size is None:
+        engine = create_engine('sqlite:///' + file_path, echo=echo, poolclass=NullPool)
+    else:
+        engine = create_engine('sqlite:///' + file_path, echo=echo, poolclass=QueuePool, pool_size=pool_size,
+                               max_overflow=0, connect_args={"check_same_thread": False})
+    pragmas = profile.pragmas(read_only)
+
+    @event.listens_for(engine, "connect")
+    def apply_profile(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    return engine
+
+
 class _Database:
     """A simple class used to manage thread-safe SQLAlchemy session objects."""
 
-    def __init__(self, file_path, echo=False):
+    def __init__(self, file_path, echo=False, profile=None):
         """Database constructor.
 
         Sets up a new connection to a SQLite3 database file. Creates session
@@ -441,89 +1162,154 @@ class _Database:
                     database is wanted, set this to ":memory:".
         echo        True if the engine should print SQL commands sent to the
                     DBMS, else False. (default False)
+        profile     The StorageProfile of the database file. (default StorageProfile())
         """
-        self.__engine = create_engine('sqlite:///' + file_path, echo=echo)
+        self.profile = profile or StorageProfile()
+        if file_path == ":memory:":
+            # Every connection to :memory: is a new database, so only one engine can be used.
+            self.__engine = create_engine('sqlite:///' + file_path, echo=echo)
+            self.__reader_engine = self.__engine
+        else:
+            self.__engine = _create_pooled_engine(file_path, self.profile, self.profile.writer_pool_size, echo=echo)
+            if self.profile.reader_pool_size > 0:
+                self.__reader_engine = _create_pooled_engine(file_path, self.profile, self.profile.reader_pool_size,
+                                                             read_only=True, echo=echo)
+            else:
+                self.__reader_engine = self.__engine
         _Base.metadata.create_all(bind=self.__engine)
+        _create_missing_indexes(self.__engine)
+        _create_spatial_index(self.__engine)
         self.__session_maker = sessionmaker(bind=self.__engine)
         self.__Session = scoped_session(self.__session_maker)
+        self.__ReaderSession = scoped_session(sessionmaker(bind=self.__reader_engine, autoflush=False,
+                                                           expire_on_commit=False))
+
+        # Number of users that entered and have not exited yet, notified when it changes.
+        self.__users = 0
+        self.__users_changed = Condition()
+
+    def enter(self):
+        """Register a user of the database. Must be followed by a call to exit()."""
+        with self.__users_changed:
+            self.__users += 1
+
+    def exit(self):
+        """Unregister a user of the database registered with enter()."""
+        with self.__users_changed:
+            self.__users -= 1
+            if self.__users == 0:
+                self.__users_changed.notify_all()
+
+    def users(self):
+        """Return the number of users that entered and have not exited yet."""
+        with self.__users_changed:
+            return self.__users
+
+    def get_session(self, read_only=False):
+        """Return a new thread-safe session object.
+
+        read_only   True if the session should use the read-only connection
+                    pool, without autoflush and expire on commit, else False.
+                    (default False)
+        """
+        return self.__ReaderSession() if read_only else self.__Session()
 
-        self.__session_cnt = 0
-        self.__session_cnt_mutex = Lock()
-        self.__session_active_sema = Semaphore()
-        self.__session_active_sema.release() # Initialize to 1
-
-    def get_session(self):
-        """Return a new thread-safe session object."""
-        self.__session_cnt_mutex.acquire()
-        self.__session_cnt += 1
-        if self.__session_cnt == 1:
-            # Block disposing until session is released.
-            self.__session_active_sema.acquire()
-        self.__session_cnt_mutex.release()
-        return self.__Session()
-
-    def release_session(self):
+    def release_session(self, read_only=False):
         """Close and remove the session object used by the current thread."""
-        self.__session_cnt_mutex.acquire()
-        self.__session_cnt -= 1
-        if self.__session_cnt == 0:
-            # Allow disposing, since to sessions are active.
-            self.__session_active_sema.release()
-        self.__session_cnt_mutex.release()
-        return self.__Session.remove()
+        return self.__ReaderSession.remove() if read_only else self.__Session.remove()
 
     def dispose(self):
-        # Don't procees if there are active sessions remaining.
-        self.__session_active_sema.acquire()
+        """Wait until all users have exited, then close all connections."""
+        with self.__users_changed:
+            self.__users_changed.wait_for(lambda: self.__users == 0)
         self.__engine.dispose()
+        self.__reader_engine.dispose()
 
 
 __active_db = None
+__swapping_active_db = False
 __change_active_db_mutex = Lock()
 
-def use_production_db():
+
+def __replace_active_db(create_database):
+    """Replace the active database with the one returned by create_database().
+
+    Sessions are opened without taking any lock, see _enter_active_db. While
+    the database is replaced, new sessions wait for the new database and the
+    old database is disposed once its remaining sessions have been released.
+    The new database is only created then, since it may reuse the files of
+    the old one.
+    """
+    global __active_db, __swapping_active_db
+    with __change_active_db_mutex:
+        __swapping_active_db = True
+        old_db = __active_db
+        __active_db = None
+        try:
+            if old_db is not None:
+                old_db.dispose()
+            __active_db = create_database()
+        finally:
+            __swapping_active_db = False
+            __active_session_cache.invalidate()
+            __image_columns.invalidate()
+
+
+def _enter_active_db():
+    """Return the active _Database, registered as used until its exit() is called.
+
+    The database may be replaced between reading the reference and entering
+    it. Checking the reference again after entering detects this, in which
+    case the stale database is exited and the new one is tried instead.
+    """
+    while True:
+        database = __active_db
+        if database is None:
+            if not __swapping_active_db and __active_db is None:
+                raise RuntimeError("No database is active, see use_production_db and use_test_database")
+            time.sleep(0.001)
+            continue
+        database.enter()
+        if database is __active_db:
+            return database
+        database.exit()
+
+
+def use_production_db(profile=None):
     """Sets the production database as the currently active database.
 
     Note that this setting affects all methods globally. Sessions retrieved
     using the session_scope context manager are connected to the production
     database if this setting is active. Any previously opened database is
-    closed, though active connections to such database is kept alive until
-    closed.
+    closed once all sessions using it have been released.
+
+    profile     The StorageProfile used for the database file. (default StorageProfile())
     """
-    global __active_db
-    __change_active_db_mutex.acquire()
-    if __active_db:
-        __active_db.dispose()
-        __active_db = None
-    __active_db = _Database(__PRODUCTION_DATABASE_FILE_PATH)
-    __change_active_db_mutex.release()
+    __replace_active_db(lambda: _Database(__PRODUCTION_DATABASE_FILE_PATH, profile=profile))
 
-def use_test_database(in_memory=True):
+def use_test_database(in_memory=True, profile=None):
     """Sets a new test database as the currently active database.
 
     Note that this setting affects all methods globally. Sessions retrieved
     using the session_scope context manager are connected to the test
     database if this setting is active. Any previously opened database is
-    closed, though active connections to such database is kept alive until
-    closed.
+    closed once all sessions using it have been released.
 
     in_memory   If True, the test database is created as an in-memory database.
                 This setting should be set to False if the test involves multiple
                 threads accessing the database, as in-memory database access from
                 multiple threads is not supported by SQLite3.
+    profile     The StorageProfile used for the database file. Ignored for
+                in-memory databases. (default StorageProfile())
     """
-    global __active_db
-    __change_active_db_mutex.acquire()
-    if __active_db:
-        __active_db.dispose()
-        __active_db = None
-    if in_memory:
-        __active_db = _Database(":memory:")
-    else:
-        if os.path.exists(__TEST_DATABASE_FILE_PATH):
-            os.remove(__TEST_DATABASE_FILE_PATH)
-        __active_db = _Database(__TEST_DATABASE_FILE_PATH)
-    __change_active_db_mutex.release()
+    def create_database():
+        if in_memory:
+            return _Database(":memory:")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(__TEST_DATABASE_FILE_PATH + suffix):
+                os.remove(__TEST_DATABASE_FILE_PATH + suffix)
+        return _Database(__TEST_DATABASE_FILE_PATH, profile=profile)
+    __replace_active_db(create_database)
 
 @contextmanager
 def session_scope():
@@ -547,13 +1333,19 @@ def session_scope():
     single with block, or the objects has to be queried again from the new
     session object.
 
+    SQLite allows a single writer at a time, so the sessions of all
+    session_scope blocks share the writer_pool_size connections of the
+    StorageProfile, one by default. A block waits for a free connection, for
+    at most the 30 second pool timeout, and holds it until the block ends.
+    Use session_scope only to write, keep the block short, and use read_scope
+    for queries, so that readers such as Socket.IO handlers don't wait for
+    writers.
+
     This context manager is inspired by the SQLAlchemy session tutorial:
     https://docs.sqlalchemy.org/en/13/orm/session_basics.html
     """
-    # Don't proceed if the current database is in the process of being closed.
-    __change_active_db_mutex.acquire()
-    session = __active_db.get_session()
-    __change_active_db_mutex.release()
+    database = _enter_active_db()
+    session = database.get_session()
     try:
         yield session
         session.commit()
@@ -562,7 +1354,36 @@ def session_scope():
         raise
     finally:
         session.close()
-        __active_db.release_session()
+        database.release_session()
+        database.exit()
+
+@contextmanager
+def read_scope():
+    """Context manager for read-only database sessions.
+
+    Sample usage:
+    with read_scope() as session:
+        session.DATABASE_QUERY
+
+    Works like session_scope, but for queries only. The session uses the
+    read-only connections of the active database, never flushes and is not
+    commited at the end of the with block, so reading does not wait for
+    writers or cost a commit. Changes made to the session are discarded, and
+    if the database is a file, attempts to flush them raise an error.
+
+    Attributes loaded within the with block stay readable afterwards, since
+    nothing expires them. Relationships that were not loaded can however not
+    be loaded once the session is closed. Prefer querying columns, e.g.
+    session.query(Image.id, Image.file_name), which returns plain tuples.
+    """
+    database = _enter_active_db()
+    session = database.get_session(read_only=True)
+    try:
+        yield session
+    finally:
+        session.close()
+        database.release_session(read_only=True)
+        database.exit()
 
 if __name__ == '__main__':
     with session_scope() as session:
@@ -1,14 +1,21 @@
+import os
+import tempfile
 import unittest
 
+import numpy
+
 from random import randint, uniform, seed
 from time import sleep
-from threading import Thread
+from threading import Thread, Event
 
 from IMM_database.database import Coordinate
-from IMM_database.database import UserSession, Client, AreaVertex, Image, PrioImage, Drone
-from IMM_database.database import session_scope, use_test_database
+from IMM_database.database import UserSession, Client, AreaVertex, Image, PrioImage, Drone, ImageRendition
+from IMM_database.database import session_scope, read_scope, use_test_database, StorageProfile, LEGACY_STORAGE_PROFILE
+from IMM_database.database import get_active_session_id, get_active_drone_mode, invalidate_active_session
+from IMM_database.database import query_image_ids_in_bbox, query_image_ids_in_polygon, load_footprints
+from IMM_database.database import get_image_columns, invalidate_image_columns, CommitCache
 
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError
 
 class CoordinateTester(unittest.TestCase):
     def test_equality(self):
@@ -22,6 +29,12 @@ class CoordinateTester(unittest.TestCase):
     def test_composite_values(self):
         self.assertEqual(Coordinate(1, 5).__composite_values__(), (1, 5))
 
+    def test_slots(self):
+        coord = Coordinate(1, 5)
+        self.assertFalse(hasattr(coord, "__dict__"))
+        with self.assertRaises(AttributeError):
+            coord.altitude = 100
+
     def test_eq(self):
         coord = Coordinate(1, 5)
         self.assertTrue(coord.__eq__(coord))
@@ -713,6 +726,74 @@ class DroneTester(unittest.TestCase):
             with session_scope() as session:
                 session.add(Drone(session_id=self.SESSIONS + 1))
 
+class ImageRenditionTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+        with session_scope() as session:
+            session.add(UserSession(start_time=100000, drone_mode="AUTO"))
+            session.add(Image(
+                session_id=1, time_taken=123, width=480, height=360, type="RGB",
+                up_left=Coordinate(1, 5), up_right=Coordinate(5, 5),
+                down_right=Coordinate(5, 1), down_left=Coordinate(1, 1),
+                center=Coordinate(3, 3), file_name="1.jpg"
+            ))
+
+    def test_single_entry(self):
+        with session_scope() as session:
+            session.add(ImageRendition(image_id=1, rendition="half", file_name="1_half.jpg",
+                                       width=240, height=180, size=1000))
+
+        with session_scope() as session:
+            self.assertEqual(session.query(ImageRendition).count(), 1,
+                "Wrong number of entries.")
+            rendition = session.query(ImageRendition).first()
+            self.assertEqual((rendition.width, rendition.height, rendition.size), (240, 180, 1000),
+                "Wrong size retrieved.")
+            self.assertEqual(rendition.image.file_name, "1.jpg",
+                "Wrong image retrieved.")
+
+    def test_repr(self):
+        ImageRendition(image_id=1, rendition="half", file_name="1_half.jpg",
+                       width=240, height=180, size=1000).__repr__()
+
+    def test_not_nullable(self):
+        def check_invalid(rendition):
+            with self.assertRaises(IntegrityError, msg="Nullable constraint not met."):
+                with session_scope() as session:
+                    session.add(rendition)
+
+        values = {"image_id": 1, "rendition": "half", "file_name": "1_half.jpg",
+                  "width": 240, "height": 180, "size": 1000}
+        for name in values:
+            with self.subTest(name=name):
+                check_invalid(ImageRendition(**{key: value for key, value in values.items() if key != name}))
+
+    def test_foreign_key(self):
+        with self.assertRaises(IntegrityError, msg="Foreign key contraint not met."):
+            with session_scope() as session:
+                session.add(ImageRendition(image_id=2, rendition="half", file_name="2_half.jpg",
+                                           width=240, height=180, size=1000))
+
+    def test_image_relation(self):
+        with session_scope() as session:
+            image = session.query(Image).get(1)
+            image.renditions = [
+                ImageRendition(rendition="half", file_name="1_half.jpg", width=240, height=180, size=1000),
+                ImageRendition(rendition="thumbnail", file_name="1_thumbnail.jpg", width=256, height=192, size=300)
+            ]
+
+        with session_scope() as session:
+            image = session.query(Image).get(1)
+            self.assertEqual([rendition.rendition for rendition in image.renditions], ["half", "thumbnail"],
+                "Renditions not retrieved in order.")
+            session.delete(image)
+
+        with session_scope() as session:
+            self.assertEqual(session.query(ImageRendition).count(), 0,
+                "Renditions not deleted with their image.")
+
+
 class RelationTester(unittest.TestCase):
     def setUp(self):
         seed(123)   # Avoid flaky tests by using the same seed every time.
@@ -1012,5 +1093,490 @@ class DatabaseConcurrencyTester(unittest.TestCase):
             self.assertEqual(session.query(UserSession).count(), n_threads * n_sessions_per_thread,
                 "Incorrect number of sessions commited to database")
 
+class DatabaseSwapTester(unittest.TestCase):
+
+    def setUp(self):
+        # Every thread gets its own in-memory database, so a file is needed.
+        use_test_database(in_memory=False)
+
+    def tearDown(self):
+        use_test_database()
+
+    def test_swap_waits_for_sessions(self):
+        entered = Event()
+        release = Event()
+
+        def hold_session():
+            with session_scope() as session:
+                session.add(UserSession(start_time=1, drone_mode="AUTO"))
+                session.flush()
+                entered.set()
+                release.wait()
+
+        holder = Thread(target=hold_session)
+        holder.start()
+        self.assertTrue(entered.wait(10))
+        swapper = Thread(target=lambda: use_test_database(in_memory=False))
+        swapper.start()
+        swapper.join(0.1)
+        self.assertTrue(swapper.is_alive(), "Database swapped while a session was open.")
+
+        release.set()
+        holder.join()
+        swapper.join()
+        with session_scope() as session:
+            self.assertEqual(session.query(UserSession).count(), 0,
+                "Sessions not connected to the new database.")
+
+    def test_concurrent_sessions_during_swap(self):
+        errors = []
+        running = Event()
+        running.set()
+
+        def query():
+            while running.is_set():
+                try:
+                    with session_scope() as session:
+                        session.query(UserSession).count()
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [Thread(target=query) for _i in range(4)]
+        for thread in threads:
+            thread.start()
+        for _i in range(3):
+            use_test_database(in_memory=False)
+        running.clear()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+class ReadScopeTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database(in_memory=False)
+        with session_scope() as session:
+            session.add(UserSession(start_time=100, drone_mode="AUTO"))
+            session.add(_square_image(1, 58.0, 15.0, 0.01))
+
+    def tearDown(self):
+        use_test_database()
+
+    def test_read(self):
+        with read_scope() as session:
+            image = session.query(Image).first()
+            corners = session.query(Image.id, Image.up_left).first()
+        # Loaded attributes are still readable after the scope.
+        self.assertEqual(image.session_id, 1)
+        self.assertEqual(tuple(corners), (1, Coordinate(58.01, 15.0)))
+
+    def test_not_commited(self):
+        with read_scope() as session:
+            session.add(UserSession(start_time=200, drone_mode="MAN"))
+        with session_scope() as session:
+            self.assertEqual(session.query(UserSession).count(), 1,
+                "Changes in read scope were commited.")
+
+    def test_read_only(self):
+        with self.assertRaises(OperationalError):
+            with read_scope() as session:
+                session.add(UserSession(start_time=200, drone_mode="MAN"))
+                session.flush()
+
+    def test_no_autoflush(self):
+        with read_scope() as session:
+            session.add(UserSession(start_time=200, drone_mode="MAN"))
+            self.assertEqual(session.query(UserSession).count(), 1)
+
+
+class StorageProfileTester(unittest.TestCase):
+
+    def tearDown(self):
+        use_test_database()
+
+    def pragma(self, name):
+        with session_scope() as session:
+            return session.execute("PRAGMA " + name).scalar()
+
+    def test_pragmas(self):
+        profile = StorageProfile(busy_timeout=2.5, cache_size=8 * 2**20)
+        self.assertIn("PRAGMA busy_timeout=2500;", profile.pragmas())
+        self.assertIn("PRAGMA cache_size=-8192;", profile.pragmas())
+        self.assertIn("PRAGMA journal_mode=WAL;", profile.pragmas())
+        self.assertNotIn("PRAGMA query_only=ON;", profile.pragmas())
+        self.assertIn("PRAGMA query_only=ON;", profile.pragmas(read_only=True))
+        self.assertNotIn("PRAGMA journal_mode=WAL;", profile.pragmas(read_only=True))
+
+    def test_default_profile(self):
+        use_test_database(in_memory=False)
+        self.assertEqual(self.pragma("journal_mode"), "wal")
+        self.assertEqual(self.pragma("synchronous"), 1)    # NORMAL
+        self.assertEqual(self.pragma("busy_timeout"), 5000)
+        self.assertEqual(self.pragma("foreign_keys"), 1)
+
+    def test_legacy_profile(self):
+        use_test_database(in_memory=False, profile=LEGACY_STORAGE_PROFILE)
+        self.assertEqual(self.pragma("journal_mode"), "delete")
+        self.assertEqual(self.pragma("synchronous"), 2)    # FULL
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="AUTO"))
+        self.assertEqual(get_active_session_id(), 1)
+
+
+class ActiveSessionTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+
+    def test_no_session(self):
+        self.assertIsNone(get_active_session_id())
+        self.assertIsNone(get_active_drone_mode())
+
+    def test_session_start(self):
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, end_time=2, drone_mode="AUTO"))
+        self.assertIsNone(get_active_session_id(), "Ended session treated as active.")
+        with session_scope() as session:
+            session.add(UserSession(start_time=3, drone_mode="MAN"))
+        self.assertEqual(get_active_session_id(), 2, "New session not picked up.")
+        self.assertEqual(get_active_drone_mode(), "MAN")
+
+    def test_session_end(self):
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="AUTO"))
+        self.assertEqual(get_active_session_id(), 1)
+        with session_scope() as session:
+            session.query(UserSession).get(1).end_time = 2
+        self.assertIsNone(get_active_session_id(), "Ending the session did not invalidate the cache.")
+
+    def test_drone_mode_change(self):
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="AUTO"))
+        self.assertEqual(get_active_drone_mode(), "AUTO")
+        with session_scope() as session:
+            session.query(UserSession).get(1).drone_mode = "MAN"
+        self.assertEqual(get_active_drone_mode(), "MAN", "Changing mode did not invalidate the cache.")
+
+    def test_rollback(self):
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="AUTO"))
+        self.assertEqual(get_active_session_id(), 1)
+        with self.assertRaises(IntegrityError):
+            with session_scope() as session:
+                session.add(UserSession(start_time=2))
+        self.assertEqual(get_active_session_id(), 1)
+
+    def test_cached(self):
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="AUTO"))
+        self.assertEqual(get_active_session_id(), 1)
+        with session_scope() as session:
+            # Bypass the ORM, which does not invalidate the cache.
+            session.execute("UPDATE sessions SET end_time = 2")
+        self.assertEqual(get_active_session_id(), 1, "Active session was not cached.")
+        invalidate_active_session()
+        self.assertIsNone(get_active_session_id())
+
+
+def _square_image(session_id, lat, long, size=1.0):
+    """Return an Image with a square footprint whose lower left corner is (lat, long)."""
+    return Image(
+        session_id=session_id, time_taken=1, width=480, height=360, type="RGB",
+        up_left=Coordinate(lat + size, long),
+        up_right=Coordinate(lat + size, long + size),
+        down_right=Coordinate(lat, long + size),
+        down_left=Coordinate(lat, long),
+        center=Coordinate(lat + size / 2, long + size / 2),
+        file_name="images/{}_{}.jpg".format(lat, long)
+    )
+
+class SpatialIndexTester(unittest.TestCase):
+
+    def setUp(self):
+        seed(123)   # Avoid flaky tests by using the same seed every time.
+        use_test_database()
+        with session_scope() as session:
+            session.add(UserSession(start_time=1, drone_mode="AUTO"))
+            session.add(UserSession(start_time=2, drone_mode="AUTO"))
+        self.footprints = {}
+        with session_scope() as session:
+            images = [_square_image(randint(1, 2), uniform(0, 100), uniform(0, 100), uniform(0.5, 5))
+                for _i in range(300)]
+            session.add_all(images)
+            session.flush()
+            for image in images:
+                self.footprints[image.id] = (image.session_id, image.down_left.lat, image.down_left.long,
+                    image.up_right.lat, image.up_right.long)
+
+    def brute_force(self, min_lat, min_long, max_lat, max_long, session_id=None):
+        return sorted(image_id for image_id, (sid, lat0, long0, lat1, long1) in self.footprints.items()
+            if lat1 >= min_lat and lat0 <= max_lat and long1 >= min_long and long0 <= max_long
+            and (session_id is None or sid == session_id))
+
+    def test_bbox(self):
+        for _i in range(50):
+            lat, long = uniform(0, 100), uniform(0, 100)
+            size = uniform(0.1, 20)
+            with self.subTest(lat=lat, long=long, size=size):
+                with session_scope() as session:
+                    self.assertEqual(sorted(query_image_ids_in_bbox(session, lat, long, lat + size, long + size)),
+                        self.brute_force(lat, long, lat + size, long + size))
+                    self.assertEqual(sorted(query_image_ids_in_bbox(session, lat, long, lat + size, long + size, 2)),
+                        self.brute_force(lat, long, lat + size, long + size, 2))
+
+    def test_polygon(self):
+        view = [Coordinate(20, 20), Coordinate(20, 40), Coordinate(30, 40), Coordinate(30, 20)]
+        with session_scope() as session:
+            self.assertEqual(sorted(query_image_ids_in_polygon(session, view)),
+                self.brute_force(20, 20, 30, 40))
+
+    def test_delete(self):
+        with session_scope() as session:
+            session.query(Image).filter(Image.id == 1).delete()
+        with session_scope() as session:
+            self.assertNotIn(1, query_image_ids_in_bbox(session, -1000, -1000, 1000, 1000),
+                "Deleted image still indexed.")
+            self.assertEqual(len(query_image_ids_in_bbox(session, -1000, -1000, 1000, 1000)), 299)
+
+    def test_update(self):
+        with session_scope() as session:
+            image = session.query(Image).get(1)
+            image.up_left = Coordinate(501, 500)
+            image.up_right = Coordinate(501, 501)
+            image.down_right = Coordinate(500, 501)
+            image.down_left = Coordinate(500, 500)
+        with session_scope() as session:
+            self.assertEqual(query_image_ids_in_bbox(session, 499, 499, 502, 502), [1],
+                "Moved image not found at new position.")
+
+    def test_existing_database(self):
+        from IMM_database import database
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "old.db")
+            db = database._Database(path)
+            session = db.get_session()
+            session.add(UserSession(start_time=1, drone_mode="AUTO"))
+            session.add(_square_image(1, 10, 10))
+            for name in ("image_rtree_insert", "image_rtree_update", "image_rtree_delete"):
+                session.execute("DROP TRIGGER " + name)
+            session.execute("DROP TABLE image_rtree")
+            session.commit()
+            db.release_session()
+            db.dispose()
+
+            db = database._Database(path)
+            session = db.get_session()
+            self.assertEqual(query_image_ids_in_bbox(session, 10.5, 10.5, 10.6, 10.6), [1],
+                "Spatial index not populated for an existing database.")
+            db.release_session()
+            db.dispose()
+
+
+class IndexTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+
+    def query_plan(self, session, query):
+        sql = str(query.statement.compile(compile_kwargs={"literal_binds": True}))
+        return " ".join(row[-1] for row in session.execute("EXPLAIN QUERY PLAN " + sql))
+
+    def test_lookups_use_index(self):
+        lookups = [
+            (lambda s: s.query(Image).filter(Image.file_name == "image.jpg"), "ix_images_file_name"),
+            (lambda s: s.query(Image).filter(Image.session_id == 1).order_by(Image.time_taken),
+                "ix_images_session_id_time_taken"),
+            (lambda s: s.query(Image.id).filter(Image.session_id == 1, Image.time_taken >= 100),
+                "ix_images_session_id_time_taken"),
+            (lambda s: s.query(Image).filter(Image.time_taken >= 100), "ix_images_time_taken"),
+            (lambda s: s.query(PrioImage).filter(PrioImage.session_id == 1, PrioImage.status == "PENDING"),
+                "ix_prio_images_session_id_status"),
+            (lambda s: s.query(PrioImage).filter(PrioImage.session_id == 1), "ix_prio_images_session_id_status"),
+            (lambda s: s.query(PrioImage).filter(PrioImage.image_id == 1), "ix_prio_images_image_id"),
+            (lambda s: s.query(Client).filter(Client.session_id == 1), "ix_clients_session_id"),
+            (lambda s: s.query(Drone).filter(Drone.session_id == 1), "ix_drones_session_id"),
+            (lambda s: s.query(ImageRendition).filter(ImageRendition.image_id == 1), "ix_image_renditions_image_id"),
+        ]
+        with session_scope() as session:
+            for lookup, index in lookups:
+                plan = self.query_plan(session, lookup(session))
+                with self.subTest(plan=plan):
+                    self.assertIn("USING", plan)
+                    self.assertIn(index, plan)
+
+    def test_existing_database(self):
+        from IMM_database import database
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "old.db")
+            db = database._Database(path)
+            session = db.get_session()
+            indexes = [row[0] for row in session.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                          "AND name LIKE 'ix_%' ORDER BY name")]
+            self.assertEqual(len(indexes), 8)
+            for name in indexes:
+                session.execute("DROP INDEX " + name)
+            session.commit()
+            db.release_session()
+            db.dispose()
+
+            db = database._Database(path)
+            session = db.get_session()
+            self.assertEqual([row[0] for row in session.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                                 "AND name LIKE 'ix_%' ORDER BY name")], indexes,
+                "Indexes not created for an existing database.")
+            db.release_session()
+            db.dispose()
+
+
+class LoadFootprintsTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+        with session_scope() as session:
+            session.add(UserSession(start_time=100, drone_mode="AUTO"))
+            session.add(UserSession(start_time=200, drone_mode="AUTO"))
+            session.add(_square_image(1, 58.0, 15.0, 0.5))
+            session.add(_square_image(2, 59.0, 16.0, 0.25))
+            session.add(_square_image(1, 60.0, 17.0, 1.0))
+
+    def test_all(self):
+        with session_scope() as session:
+            ids, footprints = load_footprints(session)
+        self.assertEqual(ids.dtype, numpy.int64)
+        self.assertEqual(footprints.dtype, numpy.float64)
+        self.assertEqual(list(ids), [1, 2, 3])
+        self.assertEqual(footprints.shape, (3, 10))
+        self.assertEqual(list(footprints[0]), [58.5, 15.0, 58.5, 15.5, 58.0, 15.5, 58.0, 15.0, 58.25, 15.25])
+        polygons = footprints[:, :8].reshape(-1, 4, 2)
+        self.assertEqual(polygons[1].tolist(), [[59.25, 16.0], [59.25, 16.25], [59.0, 16.25], [59.0, 16.0]])
+
+    def test_filters(self):
+        with session_scope() as session:
+            self.assertEqual(list(load_footprints(session, session_id=1)[0]), [1, 3])
+            self.assertEqual(list(load_footprints(session, image_ids=[3, 2])[0]), [2, 3])
+            self.assertEqual(list(load_footprints(session, session_id=2, image_ids=[1, 3])[0]), [])
+
+    def test_empty(self):
+        with session_scope() as session:
+            ids, footprints = load_footprints(session, session_id=3)
+        self.assertEqual(ids.shape, (0, ))
+        self.assertEqual(footprints.shape, (0, 10))
+
+
+class CommitCacheTester(unittest.TestCase):
+
+    def test_get_and_update(self):
+        cache = CommitCache()
+        loads = []
+        self.assertEqual(cache.get(1, lambda: loads.append(1) or [1]), [1])
+        self.assertEqual(cache.get(1, lambda: loads.append(1) or [1]), [1])
+        self.assertEqual(len(loads), 1)
+        cache.update(1, lambda value: value + [2])
+        cache.update(2, lambda value: value + [2])
+        self.assertEqual(cache.get(1, lambda: None), [1, 2])
+        self.assertIsNone(cache.get(2, lambda: None))
+
+    def test_changed_while_loading(self):
+        cache = CommitCache()
+
+        def load():
+            cache.invalidate(1)
+            return "stale"
+        self.assertEqual(cache.get(1, load), "stale")
+        self.assertEqual(cache.get(1, lambda: "fresh"), "fresh", "Value changed while loading was cached.")
+        cache.invalidate()
+        self.assertEqual(cache.get(1, lambda: "reloaded"), "reloaded")
+
+
+class ImageColumnsTester(unittest.TestCase):
+
+    def setUp(self):
+        use_test_database()
+        with session_scope() as session:
+            session.add(UserSession(start_time=100, drone_mode="AUTO"))
+            session.add(UserSession(start_time=200, drone_mode="AUTO"))
+            for i, (session_id, image_type) in enumerate([(1, "RGB"), (1, "IR"), (2, "RGB"), (1, "RGB")]):
+                image = _square_image(session_id, 10 * i, 20 * i)
+                image.time_taken = 1000 + i
+                image.type = image_type
+                session.add(image)
+
+    def columns(self, session_id):
+        with read_scope() as session:
+            return get_image_columns(session, session_id)
+
+    def test_load(self):
+        columns = self.columns(1)
+        self.assertEqual(len(columns), 3)
+        order = numpy.argsort(columns.ids)
+        self.assertEqual(columns.ids[order].tolist(), [1, 2, 4])
+        self.assertEqual(columns.time_taken[order].tolist(), [1000, 1001, 1003])
+        self.assertEqual(columns.footprints.shape, (3, 10))
+        self.assertEqual(columns.footprints[order][1].tolist(), [11, 20, 11, 21, 10, 21, 10, 20, 10.5, 20.5])
+        self.assertEqual(columns.bounds[order][1].tolist(), [10, 20, 11, 21])
+        self.assertEqual(len(self.columns(3)), 0)
+
+    def test_filters(self):
+        columns = self.columns(1)
+        self.assertEqual(sorted(columns.ids[columns.in_bbox(5, 15, 10.5, 20.5)]), [2])
+        self.assertEqual(sorted(columns.ids[columns.in_bbox(-5, -5, 100, 100)]), [1, 2, 4])
+        self.assertEqual(sorted(columns.ids[columns.in_time_range(1001)]), [2, 4])
+        self.assertEqual(sorted(columns.ids[columns.in_time_range(1001, 1002)]), [2])
+        self.assertEqual(sorted(columns.ids[columns.of_type("RGB")]), [1, 4])
+        self.assertEqual(sorted(columns.ids[columns.of_type("RGB", "IR")]), [1, 2, 4])
+        self.assertEqual(sorted(columns.ids[columns.of_type("UV")]), [])
+        mask = columns.of_type("RGB") & columns.in_time_range(end=1001)
+        self.assertEqual(sorted(columns.ids[mask]), [1])
+
+    def test_incremental(self):
+        before = self.columns(1)
+        with session_scope() as session:
+            session.add_all([_square_image(1, 50, 50) for _i in range(1500)])
+            session.add(_square_image(2, 50, 50))
+        after = self.columns(1)
+        self.assertEqual(len(before), 3, "Snapshot changed by later inserts.")
+        self.assertEqual(len(after), 1503)
+        self.assertEqual(sorted(after.ids), [1, 2, 4] + list(range(5, 1505)))
+        self.assertEqual(after.bounds[-1].tolist(), [50, 50, 51, 51])
+        self.assertEqual(len(self.columns(2)), 2)
+
+    def test_rollback(self):
+        self.columns(1)
+        with self.assertRaises(RuntimeError):
+            with session_scope() as session:
+                session.add(_square_image(1, 50, 50))
+                session.flush()
+                raise RuntimeError()
+        self.assertEqual(len(self.columns(1)), 3, "Rolled back image added.")
+
+    def test_update_and_delete(self):
+        self.columns(1)
+        with session_scope() as session:
+            session.query(Image).get(2).time_taken = 5000
+            session.delete(session.query(Image).get(4))
+        columns = self.columns(1)
+        self.assertEqual(sorted(columns.ids), [1, 2])
+        self.assertEqual(columns.time_taken[columns.ids == 2].tolist(), [5000])
+
+    def test_invalidate(self):
+        self.columns(1)
+        with session_scope() as session:
+            session.execute("DELETE FROM images WHERE id = 4")
+        self.assertEqual(len(self.columns(1)), 3)
+        invalidate_image_columns(1)
+        self.assertEqual(sorted(self.columns(1).ids), [1, 2])
+
+    def test_caller_session(self):
+        with read_scope() as session:
+            self.assertEqual(len(get_image_columns(session, 1)), 3)
+            self.assertEqual(session.query(Image).count(), 4, "Caller's session was closed.")
+
+    def test_database_swap(self):
+        self.columns(1)
+        use_test_database()
+        self.assertEqual(len(self.columns(1)), 0)
+
+
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -37,6 +37,10 @@ class DroneThread(Thread):
     def add_image_to_queue(self, image):
         self.image_queue.append(image)
 
+    def clear_queue(self):
+        """Remove the queued images, except an image that has already arrived."""
+        del self.image_queue[1 if self.new_image else 0:]
+
     def pop_first_image(self):
         self.new_image = False
         return self.image_queue.pop(0)
@@ -177,6 +181,11 @@ class IMMRepThread(Thread):
                 self.socket.send_json(self.eta())
             elif request["fcn"] == "set_mode":
                 self.socket.send_json(self.set_mode(request))
+            elif request["fcn"] == "clear_que":
+                self.socket.send_json(self.clear_que())
+            else:
+                # Always reply, a REQ socket can't send another request before.
+                self.socket.send_json({"fcn": "error", "arg": "Unknown fcn: " + str(request["fcn"])})
             self.drone_thread.stop_change()
 
     def get_info(self):
@@ -187,8 +196,9 @@ class IMMRepThread(Thread):
         pass
 
     def clear_que(self):
-        """Returns info on connected drones, for now"""
-        pass
+        """Clears the image queue of the drone"""
+        self.drone_thread.clear_queue()
+        return {"fcn": "ack", "arg": "clear_que"}
 
     def eta(self):
         """Returns the time (in seconds) until next picture"""
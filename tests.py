@@ -1,5 +1,6 @@
 from Help_functions import geometry as help_geo
 import unittest
+import numpy
 import coverage
 
 polygon1 = [(50,50), (50,100), (100,100), (100,50)]
@@ -96,5 +97,160 @@ class TestGeometry(unittest.TestCase):
         point_outside2 = (25,36)
         self.assertFalse(help_geo.inside_polygon(point_outside2, polygon3))
 
+    def test_polygons_intersect(self):
+        self.assertTrue(help_geo.polygons_intersect(polygon1, [(60,60), (60,70), (70,70)]))  # Contained
+        self.assertTrue(help_geo.polygons_intersect([(60,60), (60,70), (70,70)], polygon1))
+        self.assertTrue(help_geo.polygons_intersect(polygon1, [(40,40), (40,60), (60,60), (60,40)]))  # Crossing
+        self.assertTrue(help_geo.polygons_intersect(polygon1, polygon2))  # Touching corner
+        self.assertFalse(help_geo.polygons_intersect(polygon1, [(0,0), (0,10), (10,10)]))
+        self.assertFalse(help_geo.polygons_intersect(polygon3, [(31,31), (31,40), (40,40), (40,31)]))  # Bboxes overlap
+
+    def test_polygons_intersect_float(self):
+        view = [(58.5, 16.5), (58.5, 16.6), (58.4, 16.6), (58.4, 16.5)]
+        self.assertTrue(help_geo.polygons_intersect(view, [(58.45, 16.55), (58.45, 16.75), (58.3, 16.75)]))
+        self.assertFalse(help_geo.polygons_intersect(view, [(58.39, 16.55), (58.2, 16.75), (58.2, 16.55)]))
+
+    def test_polygons_intersect_numpy(self):
+        view = numpy.array([(58.5, 16.5), (58.5, 16.6), (58.4, 16.6), (58.4, 16.5)])
+        inside = numpy.array([(58.45, 16.55), (58.45, 16.75), (58.3, 16.75)])
+        outside = numpy.array([(58.39, 16.55), (58.2, 16.75), (58.2, 16.55)])
+        self.assertTrue(help_geo.polygons_intersect(list(view), list(inside)))
+        self.assertFalse(help_geo.polygons_intersect(list(view), list(outside)))
+        self.assertTrue(help_geo.segments_intersect(*numpy.array([(0.0, 0.0), (10.0, 10.0), (0.0, 10.0), (10.0, 0.0)])))
+        self.assertFalse(help_geo.segments_intersect(*numpy.array([(0.0, 0.0), (10.0, 0.0), (11.0, 0.0), (15.0, 0.0)])))
+
+    def test_batch_polygons_intersect(self):
+        numpy.random.seed(7)
+        # Random quadrilaterals around random centers, including integer ones touching polygon1.
+        centers = numpy.random.uniform(0, 120, (300, 1, 2))
+        quads = numpy.round(centers + numpy.random.uniform(-15, 15, (300, 4, 2)))
+        for poly in (polygon1, polygon2, polygon3):
+            expected = [help_geo.polygons_intersect(quad.tolist(), poly) for quad in quads]
+            self.assertEqual(list(help_geo.batch_polygons_intersect(quads, poly)), expected)
+        self.assertEqual(list(help_geo.batch_polygons_intersect(numpy.zeros((0, 4, 2)), polygon1)), [])
+
+    def test_segments_intersect(self):
+        self.assertTrue(help_geo.segments_intersect((0,0), (10,10), (0,10), (10,0)))
+        self.assertTrue(help_geo.segments_intersect((0,0), (10,0), (5,0), (15,0)))  # Collinear overlap
+        self.assertFalse(help_geo.segments_intersect((0,0), (10,0), (11,0), (15,0)))
+        self.assertFalse(help_geo.segments_intersect((0,0), (10,10), (0,1), (9,10)))
+
+    def test_points_inside_polygon(self):
+        points = [(75,75), (10,10), (30,30), (49,20), (11,12), (51,50), (30,20), (11,-5), (20,-1), (25,36)]
+        for poly in (polygon1, polygon2, polygon3):
+            expected = [help_geo.inside_polygon(point, poly) for point in points]
+            self.assertEqual(list(help_geo.points_inside_polygon(points, poly)), expected)
+
+    def test_points_inside_polygons(self):
+        numpy.random.seed(123)
+        points = numpy.random.uniform(-20, 120, (500, 2))
+        squares = numpy.array([polygon1, [(0,0), (0,50), (50,50), (50,0)]], dtype=float)
+        mask = help_geo.points_inside_polygons(points, squares)
+        self.assertEqual(mask.shape, (2, 500))
+        for m, poly in enumerate(squares):
+            expected = [help_geo._even_odd(x, y, poly) for x, y in points]
+            self.assertEqual(list(mask[m]), expected)
+
+    def test_points_inside_polygon_float(self):
+        view = [(58.4, 16.5), (58.5, 16.5), (58.5, 16.6), (58.4, 16.6)]
+        mask = help_geo.points_inside_polygon([(58.45, 16.55), (58.45, 16.65), (58.39, 16.55)], view)
+        self.assertEqual(list(mask), [True, False, False])
+
+    def test_points_inside_polygon_invalid(self):
+        self.assertRaises(help_geo.ElementsError, help_geo.points_inside_polygon, [(1, 2, 3)], polygon1)
+        self.assertRaises(help_geo.ElementsError, help_geo.points_inside_polygon, [(1, 2)], [(0,0), (1,1)])
+
+    def test_prepared_polygon_contains(self):
+        points = [(75,75), (10,10), (30,30), (49,20), (11,12), (51,50), (30,20), (11,-5), (20,-1), (25,36)]
+        for poly in (polygon1, polygon2, polygon3):
+            prepared = help_geo.PreparedPolygon(poly)
+            expected = [help_geo.inside_polygon(point, poly) for point in points]
+            self.assertEqual([prepared.contains(point) for point in points], expected)
+            self.assertEqual(list(prepared.contains_points(points)), expected)
+
+    def test_prepared_polygon_bbox(self):
+        prepared = help_geo.PreparedPolygon(polygon3)
+        self.assertEqual((prepared.min_x, prepared.min_y, prepared.max_x, prepared.max_y), (10, -10, 40, 40))
+        self.assertFalse(prepared.contains((1000.5, 0.5)))
+        self.assertEqual(list(prepared.contains_points([(1000, 0), (-5, 0)])), [False, False])
+
+    def test_prepared_polygon_from_coordinates(self):
+        class Coordinate:
+            def __init__(self, lat, long):
+                self.lat, self.long = lat, long
+        class AreaVertex:
+            def __init__(self, vertex_no, lat, long):
+                self.vertex_no, self.coordinate = vertex_no, Coordinate(lat, long)
+        vertices = [AreaVertex(2, 58.5, 16.6), AreaVertex(0, 58.4, 16.5), AreaVertex(3, 58.4, 16.6), AreaVertex(1, 58.5, 16.5)]
+        prepared = help_geo.PreparedPolygon.from_area_vertices(vertices)
+        self.assertEqual(prepared.vertices.tolist(), [[58.4, 16.5], [58.5, 16.5], [58.5, 16.6], [58.4, 16.6]])
+        self.assertTrue(prepared.contains((58.45, 16.55)))
+
+    def test_prepared_polygon_intersects(self):
+        prepared = help_geo.PreparedPolygon(polygon1)
+        self.assertTrue(prepared.intersects([(40,40), (40,60), (60,60), (60,40)]))
+        self.assertTrue(prepared.intersects(help_geo.PreparedPolygon([(60,60), (60,70), (70,70)])))
+        self.assertFalse(prepared.intersects([(0,0), (0,10), (10,10)]))
+
+    def test_prepared_polygon_intersects_random(self):
+        numpy.random.seed(11)
+        centers = numpy.random.uniform(0, 120, (200, 1, 2))
+        quads = numpy.round(centers + numpy.random.uniform(-15, 15, (200, 4, 2)))
+        for poly in (polygon1, polygon2, polygon3):
+            prepared = help_geo.PreparedPolygon(poly)
+            for quad in quads:
+                self.assertEqual(prepared.intersects(quad.tolist()), help_geo.polygons_intersect(quad.tolist(), poly))
+
+    def test_prepared_polygon_contains_polygon(self):
+        prepared = help_geo.PreparedPolygon(polygon1)
+        self.assertTrue(prepared.contains_polygon([(60,60), (60,70), (70,70), (70,60)]))
+        self.assertFalse(prepared.contains_polygon([(40,40), (40,60), (60,60), (60,40)]))
+        # Concave polygon whose notch cuts through a quadrilateral with all vertices inside.
+        concave = help_geo.PreparedPolygon([(0,0), (0,100), (100,100), (100,0), (50,0), (50,60), (40,60), (40,0)])
+        self.assertFalse(concave.contains_polygon([(20,50), (20,70), (70,70), (70,50)]))
+        self.assertTrue(concave.contains_polygon([(20,70), (20,80), (70,80), (70,70)]))
+
+    def test_polygon_area(self):
+        self.assertEqual(help_geo.polygon_area(polygon1), 2500)
+        self.assertEqual(help_geo.polygon_area(polygon1[::-1]), 2500)
+        self.assertEqual(help_geo.polygon_area(polygon2), 1250)
+        self.assertEqual(help_geo.polygon_area([(0,0), (1,1)]), 0)
+
+    def test_clip_polygon(self):
+        square = [(40,40), (40,60), (60,60), (60,40)]
+        clipped = help_geo.clip_polygon(square, polygon1)
+        self.assertAlmostEqual(help_geo.polygon_area(clipped), 100)
+        self.assertEqual(help_geo.clip_polygon(square, [(0,0), (0,10), (10,10), (10,0)]), [])
+        # Clockwise clip polygon.
+        self.assertAlmostEqual(help_geo.intersection_area(square, polygon1[::-1]), 100)
+        # Subject inside clip.
+        self.assertAlmostEqual(help_geo.intersection_area([(60,60), (60,70), (70,70)], polygon1), 50)
+
+    def test_intersection_over_union(self):
+        self.assertAlmostEqual(help_geo.intersection_over_union(polygon1, polygon1), 1)
+        square = [(75,50), (75,100), (125,100), (125,50)]
+        self.assertAlmostEqual(help_geo.intersection_over_union(square, polygon1), 1250 / 3750)
+        self.assertEqual(help_geo.intersection_over_union(polygon2, polygon1), 0)
+
+    def test_view_coverage(self):
+        self.assertAlmostEqual(help_geo.view_coverage([(0,0), (0,200), (200,200), (200,0)], polygon1), 1)
+        self.assertAlmostEqual(help_geo.view_coverage([(40,40), (40,60), (60,60), (60,40)], polygon1), 0.04)
+
+    def test_batch_intersection_areas(self):
+        numpy.random.seed(123)
+        view = [(20.0,10.0), (80.0,30.0), (70.0,90.0), (10.0,60.0)]
+        centers = numpy.random.uniform(0, 100, (200, 1, 2))
+        offsets = numpy.random.uniform(5, 30, (200, 4, 1)) * numpy.array([(-1,-1), (1,-1), (1,1), (-1,1)])
+        footprints = centers + offsets
+        areas = help_geo.batch_intersection_areas(footprints, view)
+        expected = [help_geo.intersection_area(footprint.tolist(), view) for footprint in footprints]
+        numpy.testing.assert_allclose(areas, expected, atol=1e-9)
+        coverage = help_geo.batch_view_coverage(footprints, view)
+        numpy.testing.assert_allclose(coverage, numpy.array(expected) / help_geo.polygon_area(view), atol=1e-9)
+
+    def test_batch_no_overlap(self):
+        areas = help_geo.batch_intersection_areas([polygon3, polygon1], [(200,200), (200,300), (300,300)])
+        self.assertEqual(list(areas), [0, 0])
+
 if __name__ == "__main__":
     unittest.main()